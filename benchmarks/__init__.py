@@ -0,0 +1 @@
+"""Micro-benchmarks de las rutas calientes con datos sintéticos y líneas base JSON."""
@@ -0,0 +1,88 @@
+"""Ejecuta los benchmarks y guarda o compara los resultados.
+
+    python -m benchmarks                              # todos los casos
+    python -m benchmarks --group extract -k dense     # filtrar casos
+    python -m benchmarks --save main                  # benchmarks/baselines/main.json
+    python -m benchmarks --compare main --threshold 0.15
+
+Con --compare el proceso sale con código 1 si algún caso empeora su mediana
+más que el umbral, así que sirve como paso de CI o antes de un PR de
+rendimiento. Las líneas base solo son comparables en la misma máquina.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks import harness
+
+
+def _prepare_environment(workdir):
+    """Base SQLite temporal y sin tareas de fondo; debe ir antes de importar src."""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ.setdefault('UPLOAD_GC_INTERVAL_SECONDS', '0')
+    os.environ.setdefault('TRACING_EXPORTER', 'off')
+    # El registro de consultas lentas imprimiría en mitad de las mediciones
+    os.environ.setdefault('SLOW_QUERY_MS', '60000')
+    if harness.ROOT not in sys.path:
+        sys.path.insert(0, harness.ROOT)
+
+
+def main(argv=None):
+    from benchmarks.cases import GROUPS
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--group', action='append', choices=GROUPS, help='grupo a ejecutar (repetible)')
+    parser.add_argument('-k', dest='keyword', help='solo casos cuyo nombre contiene este texto')
+    parser.add_argument('--min-time', type=float, default=1.0, help='segundos mínimos por caso')
+    parser.add_argument('--save', metavar='NAME|PATH', help='guarda los resultados como línea base')
+    parser.add_argument('--compare', metavar='NAME|PATH', help='compara contra una línea base')
+    parser.add_argument('--threshold', type=float, default=harness.DEFAULT_THRESHOLD,
+                        help='empeoramiento relativo de la mediana que cuenta como regresión')
+    args = parser.parse_args(argv)
+
+    baseline = harness.load(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix='benchmarks-')
+    try:
+        _prepare_environment(workdir)
+        from benchmarks.cases import build_cases
+
+        cases = build_cases(workdir, tuple(args.group or GROUPS))
+        if args.keyword:
+            cases = [case for case in cases if args.keyword in case.name]
+        results = {}
+        for case in cases:
+            stats = harness.measure(case, min_time=args.min_time)
+            results[case.name] = stats
+            print(f"{case.name:<36} median {harness.format_seconds(stats['median']):>10}  "
+                  f"min {harness.format_seconds(stats['min']):>10}  "
+                  f"stddev {harness.format_seconds(stats['stddev']):>10}  rounds {stats['rounds']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        print(f"\nResultados guardados en {harness.save(results, harness.resolve_baseline(args.save))}")
+
+    if baseline is None:
+        return 0
+    if baseline.get('machine') != harness.machine_info():
+        print("\nAviso: la línea base se tomó en otra máquina o versión de Python; "
+              "las diferencias pueden no ser significativas.")
+    print(f"\nComparación con {args.compare} (commit {baseline.get('commit')}, umbral {args.threshold:.0%}):")
+    regressions = 0
+    for name, base, current, change, status in harness.compare(results, baseline, args.threshold):
+        change_text = f"{change:+.1%}" if change is not None else '-'
+        marker = {'regression': 'REGRESIÓN', 'improved': 'mejora', 'new': 'nuevo'}.get(status, '')
+        print(f"{name:<36} {harness.format_seconds(base):>10} -> {harness.format_seconds(current):>10} "
+              f"{change_text:>8}  {marker}")
+        regressions += status == 'regression'
+    if regressions:
+        print(f"\n{regressions} caso(s) empeoran más del {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
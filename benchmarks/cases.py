@@ -0,0 +1,172 @@
+"""Casos de benchmark sobre la app real con datos sintéticos.
+
+build_cases() genera los PDFs y una base SQLite temporal (la indicada en
+DATABASE_URL antes de importar src.main) y devuelve los casos:
+
+- extract: extract_text_from_pdf con distintas páginas y densidades de texto.
+- context: get_folder_content (estrategia full) sobre 1, 5 y 20 carpetas.
+- search:  POST /api/folders/<id>/search con y sin coincidencias.
+- listing: Folder.summaries_for_user, to_dict() por carpeta y GET /api/folders.
+- prompt:  select_history + construcción de mensajes OpenAI y prompt Gemini.
+"""
+import os
+
+from benchmarks.harness import Case
+from benchmarks.synthetic import make_pdf, make_text
+
+# (páginas, palabras por página): de un folleto a un informe denso
+PDF_SHAPES = {
+    'small-sparse': (1, 60),
+    'small-dense': (1, 700),
+    'medium-sparse': (20, 60),
+    'medium-dense': (20, 700),
+    'large-dense': (100, 700),
+}
+FOLDERS = 20
+PDFS_PER_FOLDER = 25
+WORDS_PER_PDF = 2000
+HISTORY_MESSAGES = 30
+PROMPT_CONTEXT_WORDS = 30000
+
+SYSTEM_PROMPT = (
+    "Eres un asistente inteligente especializado en responder preguntas sobre documentos PDF.\n"
+    "Solo responde basándote en el contenido de los documentos proporcionados."
+)
+
+
+def _extract_cases(workdir):
+    from src.routes.pdfs import extract_text_from_pdf
+
+    cases = []
+    for label, (pages, words) in PDF_SHAPES.items():
+        path = make_pdf(os.path.join(workdir, f"{label}.pdf"), pages=pages, words_per_page=words, seed=pages)
+        cases.append(Case(
+            f"extract[{label}]", 'extract', lambda _, path=path: extract_text_from_pdf(path),
+            params={'pages': pages, 'words_per_page': words, 'file_bytes': os.path.getsize(path)},
+        ))
+    return cases
+
+
+def _seed(app):
+    """Usuario con FOLDERS carpetas de PDFS_PER_FOLDER PDFs; devuelve (user_id, folder_ids, token)."""
+    from src.models.user import PDF, Folder, User, db
+    from src.routes.auth import _issue_tokens
+
+    with app.app_context():
+        user = User(google_id='benchmark', username='benchmark', email='benchmark@example.com')
+        db.session.add(user)
+        db.session.commit()
+        folders = [Folder(name=f"Carpeta {i}", user_id=user.id) for i in range(FOLDERS)]
+        db.session.add_all(folders)
+        db.session.commit()
+        seed = 0
+        for folder in folders:
+            for i in range(PDFS_PER_FOLDER):
+                seed += 1
+                content = make_text(WORDS_PER_PDF, seed=seed)
+                db.session.add(PDF(
+                    filename=f"bench-{seed}.pdf", original_filename=f"documento-{i}.pdf",
+                    file_path=f"/dev/null/bench-{seed}.pdf", content=content,
+                    folder_id=folder.id, file_size=len(content),
+                ))
+        db.session.commit()
+        with app.test_request_context():
+            token = _issue_tokens(user)['access_token']
+        return user.id, [f.id for f in folders], token
+
+
+def _db_cases(app):
+    from src.models.user import Folder, db
+    from src.routes.chat import get_folder_content
+
+    user_id, folder_ids, token = _seed(app)
+    client = app.test_client()
+    headers = {'Authorization': f"Bearer {token}"}
+
+    def in_app(fn):
+        def run(_):
+            with app.app_context():
+                result = fn()
+                db.session.remove()
+                return result
+        return run
+
+    cases = []
+    for count in (1, 5, FOLDERS):
+        ids = folder_ids[:count]
+        cases.append(Case(
+            f"context[full-{count}-folders]", 'context',
+            in_app(lambda ids=ids: get_folder_content(ids, user_id)),
+            params={'folders': count, 'pdfs': count * PDFS_PER_FOLDER, 'words_per_pdf': WORDS_PER_PDF},
+        ))
+
+    def search(query):
+        def run(_):
+            response = client.post(f"/api/folders/{folder_ids[0]}/search", json={'query': query}, headers=headers)
+            assert response.status_code == 200, response.status_code
+        return run
+
+    cases.append(Case('search[match]', 'search', search('garantía'), params={'pdfs': PDFS_PER_FOLDER}))
+    cases.append(Case('search[no-match]', 'search', search('inexistente'), params={'pdfs': PDFS_PER_FOLDER}))
+
+    cases.append(Case(
+        'listing[summaries_for_user]', 'listing', in_app(lambda: Folder.summaries_for_user(user_id)),
+        params={'folders': FOLDERS, 'pdfs': FOLDERS * PDFS_PER_FOLDER},
+    ))
+    cases.append(Case(
+        'listing[to_dict]', 'listing',
+        in_app(lambda: [f.to_dict() for f in Folder.query.filter_by(user_id=user_id).order_by(Folder.id)]),
+        params={'folders': FOLDERS, 'pdfs': FOLDERS * PDFS_PER_FOLDER},
+    ))
+
+    def list_folders(_):
+        response = client.get('/api/folders', headers=headers)
+        assert response.status_code == 200, response.status_code
+
+    cases.append(Case('listing[GET /api/folders]', 'listing', list_folders,
+                      params={'folders': FOLDERS, 'pdfs': FOLDERS * PDFS_PER_FOLDER}))
+    return cases
+
+
+def _prompt_cases():
+    from src.services.conversation_memory import HistoryMessage, select_history
+    from src.services.simple_ai_service import ai_service
+
+    context = make_text(PROMPT_CONTEXT_WORDS, seed=1)
+    messages = [
+        HistoryMessage(i % 2 == 0, make_text(120, seed=100 + i))
+        for i in range(HISTORY_MESSAGES)
+    ]
+    summary = make_text(200, seed=99)
+    question = '¿Qué plazo de entrega fija el contrato?'
+    params = {'context_chars': len(context), 'history_messages': HISTORY_MESSAGES}
+
+    def openai(_):
+        history = select_history(summary, messages)
+        return ai_service._openai_messages(SYSTEM_PROMPT, question, context, history, summary)
+
+    def gemini(_):
+        history = select_history(summary, messages)
+        return ai_service._gemini_prompt(SYSTEM_PROMPT, question, context, history, summary)
+
+    return [
+        Case('prompt[openai]', 'prompt', openai, params=params),
+        Case('prompt[gemini]', 'prompt', gemini, params=params),
+    ]
+
+
+GROUPS = ('extract', 'context', 'search', 'listing', 'prompt')
+
+
+def build_cases(workdir, groups=GROUPS):
+    """Casos de los grupos pedidos; la base solo se siembra si algún grupo la usa."""
+    from src.main import app
+
+    cases = []
+    if 'extract' in groups:
+        cases += _extract_cases(workdir)
+    if {'context', 'search', 'listing'} & set(groups):
+        cases += _db_cases(app)
+    if 'prompt' in groups:
+        cases += _prompt_cases()
+    return [case for case in cases if case.group in groups]
@@ -0,0 +1,152 @@
+"""Medición, guardado y comparación de resultados de benchmarks.
+
+Cada caso se ejecuta en rondas; en funciones muy rápidas cada ronda repite
+la llamada las veces necesarias para durar al menos MIN_ROUND_SECONDS, y el
+tiempo se reporta por llamada. Los resultados se guardan en JSON junto con
+los datos de la máquina y el commit, y compare() marca como regresión todo
+caso cuya mediana empeore más que el umbral respecto a la línea base.
+"""
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+MIN_ROUNDS = 5
+MAX_ROUNDS = 1000
+MIN_ROUND_SECONDS = 0.005
+DEFAULT_THRESHOLD = 0.15
+
+
+class Case:
+    """Un benchmark: fn() se mide; setup() (opcional) prepara lo que fn recibe."""
+
+    def __init__(self, name, group, fn, setup=None, params=None):
+        self.name = name
+        self.group = group
+        self.fn = fn
+        self.setup = setup
+        self.params = params or {}
+
+
+def _loops_per_round(fn, arg):
+    """Llamadas por ronda para que una ronda dure al menos MIN_ROUND_SECONDS."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn(arg)
+        if time.perf_counter() - started >= MIN_ROUND_SECONDS or loops >= 1_000_000:
+            return loops
+        loops *= 10
+
+
+def measure(case, min_time=1.0, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Ejecuta el caso y devuelve sus estadísticas (segundos por llamada)."""
+    arg = case.setup() if case.setup else None
+    loops = _loops_per_round(case.fn, arg)  # también sirve de calentamiento
+    gc.collect()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < max_rounds and (len(times) < min_rounds or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        for _ in range(loops):
+            case.fn(arg)
+        times.append((time.perf_counter() - started) / loops)
+    median = statistics.median(times)
+    return {
+        'group': case.group,
+        'params': case.params,
+        'rounds': len(times),
+        'loops': loops,
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.fmean(times),
+        'median': median,
+        'stddev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'ops': 1.0 / median if median else None,
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    data = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git_commit(),
+        'machine': machine_info(),
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def resolve_baseline(name_or_path):
+    """Ruta de una línea base: un nombre ("main") va a baselines/main.json."""
+    if os.sep in name_or_path or name_or_path.endswith('.json'):
+        return name_or_path
+    return os.path.join(BASELINE_DIR, name_or_path + '.json')
+
+
+def load(name_or_path):
+    with open(resolve_baseline(name_or_path), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """[(nombre, base, actual, cambio, estado)] comparando medianas.
+
+    estado: 'regression' si empeora más que threshold, 'improved' si mejora
+    más que threshold, 'ok' en otro caso y 'new' si no está en la base.
+    """
+    rows = []
+    base_results = baseline.get('results', {})
+    for name, current in results.items():
+        base = base_results.get(name)
+        if base is None or not base.get('median'):
+            rows.append((name, None, current['median'], None, 'new'))
+            continue
+        change = current['median'] / base['median'] - 1.0
+        if change > threshold:
+            status = 'regression'
+        elif change < -threshold:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append((name, base['median'], current['median'], change, status))
+    return rows
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    for unit, factor in (('s', 1.0), ('ms', 1e3), ('us', 1e6)):
+        if seconds * factor >= 1.0:
+            return f"{seconds * factor:.2f} {unit}"
+    return f"{seconds * 1e9:.0f} ns"
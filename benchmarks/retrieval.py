@@ -0,0 +1,327 @@
+"""Evaluación offline de la selección de contexto del chat (sin LLM).
+
+Para cada estrategia de get_folder_content (full, semantic, auto) y cada
+pregunta del conjunto mide:
+
+- recall: fracción de los pasajes esperados que aparecen en el contexto
+  (un pasaje cuenta si al menos --min-coverage de sus n-gramas de palabras
+  están en el contexto; así se toleran cortes entre fragmentos).
+- tokens del prompt completo (mensajes de OpenAI: instrucciones, documentos
+  y pregunta), con tiktoken si está instalado o ~4 caracteres por token.
+- tiempo de construcción del contexto, con el índice de embeddings ya creado.
+
+Las estrategias se indican como nombre[:k], con k = fragmentos recuperados
+(CHAT_CONTEXT_TOP_K por defecto): full, semantic:4, auto:12... Los
+embeddings usan EMBEDDING_PROVIDER (hashing por defecto, local y sin red).
+
+El conjunto es un JSON con documentos y preguntas; "path" es relativo al
+JSON y puede ser un PDF (se extrae su texto) o un .txt. "folders" es
+opcional (por defecto todas las carpetas):
+
+    {"documents": [{"folder": "Contratos", "name": "marco.pdf", "text": "..."},
+                   {"folder": "Facturas", "path": "docs/factura-12.pdf"}],
+     "questions": [{"question": "¿Qué plazo de entrega fija el contrato?",
+                    "folders": ["Contratos"],
+                    "expected": ["El plazo de entrega es de 30 días hábiles"]}]}
+
+Sin conjunto se genera uno sintético (benchmarks.synthetic.make_qa_corpus).
+
+    python -m benchmarks.retrieval
+    python -m benchmarks.retrieval evaluacion.json --strategy full --strategy semantic:8 --json actual.json
+    python -m benchmarks.retrieval evaluacion.json --compare actual.json
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import harness
+from benchmarks.cases import SYSTEM_PROMPT
+from benchmarks.synthetic import make_qa_corpus
+
+DEFAULT_STRATEGIES = ('full', 'semantic:4', 'semantic:8', 'semantic:12', 'auto')
+STRATEGIES = ('full', 'semantic', 'auto')
+NGRAM = 5
+DEFAULT_MIN_COVERAGE = 0.8
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+except ImportError:  # Estimación de conversation_memory (~4 caracteres por token)
+    _ENCODING = None
+
+
+def _prepare_environment(workdir, max_chars=None):
+    """Base SQLite e índices en un directorio temporal; debe ir antes de importar src."""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'retrieval.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ.setdefault('EMBEDDING_PROVIDER', 'hashing')
+    os.environ.setdefault('UPLOAD_GC_INTERVAL_SECONDS', '0')
+    os.environ.setdefault('TRACING_EXPORTER', 'off')
+    os.environ.setdefault('SLOW_QUERY_MS', '60000')
+    if max_chars is not None:
+        os.environ['CHAT_CONTEXT_MAX_CHARS'] = str(max_chars)
+    if harness.ROOT not in sys.path:
+        sys.path.insert(0, harness.ROOT)
+
+
+def parse_strategy(text):
+    name, _, k = text.partition(':')
+    if name not in STRATEGIES:
+        raise argparse.ArgumentTypeError(f"estrategia desconocida: {name} (opciones: {', '.join(STRATEGIES)})")
+    try:
+        return name, int(k) if k else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"k no es un entero: {text}")
+
+
+def load_dataset(path):
+    with open(path, encoding='utf-8') as f:
+        dataset = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for document in dataset['documents']:
+        if 'text' in document:
+            continue
+        doc_path = os.path.join(base, document['path'])
+        if doc_path.lower().endswith('.pdf'):
+            from src.routes.pdfs import extract_text_from_pdf
+
+            document['text'] = extract_text_from_pdf(doc_path) or ''
+        else:
+            with open(doc_path, encoding='utf-8') as f:
+                document['text'] = f.read()
+        document.setdefault('name', os.path.basename(doc_path))
+    return dataset
+
+
+def count_tokens(text):
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    from src.services.conversation_memory import estimate_tokens
+
+    return estimate_tokens(text)
+
+
+def _words(text):
+    return _WORD.findall((text or '').lower())
+
+
+def _ngrams(words, n):
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def passage_coverage(passage, context_words, context_ngrams):
+    """Fracción de los n-gramas de palabras del pasaje presentes en el contexto."""
+    words = _words(passage)
+    if not words:
+        return 1.0
+    if len(words) < NGRAM:
+        # Pasaje corto: basta con que aparezca entero como secuencia de palabras
+        return 1.0 if ' '.join(words) in ' '.join(context_words) else 0.0
+    grams = [tuple(words[i:i + NGRAM]) for i in range(len(words) - NGRAM + 1)]
+    return sum(gram in context_ngrams for gram in grams) / len(grams)
+
+
+def _seed(app, dataset):
+    """Usuario, carpetas y PDFs del conjunto; devuelve (user_id, {carpeta: id})."""
+    from src.models.user import db, User, Folder, PDF
+
+    with app.app_context():
+        user = User(google_id='retrieval-eval', username='Evaluación', email='retrieval@example.com')
+        db.session.add(user)
+        db.session.flush()
+        folders = {}
+        for i, document in enumerate(dataset['documents']):
+            name = document.get('folder', 'Documentos')
+            if name not in folders:
+                folders[name] = Folder(name=name, user_id=user.id)
+                db.session.add(folders[name])
+                db.session.flush()
+            db.session.add(PDF(
+                filename=f"eval-{i}.pdf", original_filename=document.get('name', f"documento-{i}.pdf"),
+                file_path=f"/dev/null/eval-{i}.pdf", content=document['text'],
+                folder_id=folders[name].id, file_size=len(document['text']),
+            ))
+        db.session.commit()
+        return user.id, {name: folder.id for name, folder in folders.items()}
+
+
+def _build_index(app, folder_ids):
+    from src.models.user import db
+    from src.services.vector_index import sync_folder
+
+    started = time.perf_counter()
+    with app.app_context():
+        for folder_id in folder_ids:
+            sync_folder(folder_id)
+        db.session.remove()
+    return time.perf_counter() - started
+
+
+def evaluate(app, dataset, user_id, folder_map, strategy, k, repeat=3, min_coverage=DEFAULT_MIN_COVERAGE):
+    """Métricas de una estrategia sobre todas las preguntas."""
+    from src.models.user import db
+    from src.routes.chat import CONTEXT_MAX_CHARS, get_folder_content
+    from src.services.simple_ai_service import ai_service
+
+    questions = []
+    for item in dataset['questions']:
+        folder_ids = [folder_map[name] for name in item.get('folders') or folder_map]
+        times = []
+        with app.app_context():
+            for _ in range(max(1, repeat)):
+                started = time.perf_counter()
+                context = get_folder_content(folder_ids, user_id, question=item['question'], strategy=strategy, top_k=k)
+                times.append(time.perf_counter() - started)
+                db.session.remove()
+        messages = ai_service._openai_messages(SYSTEM_PROMPT, item['question'], context, None)
+        context_words = _words(context)
+        context_ngrams = _ngrams(context_words, NGRAM)
+        coverages = [passage_coverage(p, context_words, context_ngrams) for p in item['expected']]
+        questions.append({
+            'question': item['question'],
+            'coverage': coverages,
+            'found': sum(c >= min_coverage for c in coverages),
+            'expected': len(coverages),
+            'context_chars': len(context),
+            'prompt_tokens': sum(count_tokens(m['content']) for m in messages),
+            'build_seconds': statistics.median(times),
+        })
+
+    expected = sum(q['expected'] for q in questions)
+    tokens = [q['prompt_tokens'] for q in questions]
+    build = [q['build_seconds'] for q in questions]
+    return {
+        'strategy': strategy,
+        'k': k,
+        'questions': len(questions),
+        'recall': sum(q['found'] for q in questions) / expected if expected else None,
+        'all_found': sum(q['found'] == q['expected'] for q in questions) / len(questions) if questions else None,
+        'mean_coverage': statistics.fmean(c for q in questions for c in q['coverage']) if expected else None,
+        'prompt_tokens_mean': statistics.fmean(tokens) if tokens else 0,
+        'prompt_tokens_p95': _percentile(tokens, 95),
+        'prompt_tokens_max': max(tokens, default=0),
+        # Preguntas cuyo contexto no cabe y que el chat respondería por map-reduce
+        'over_max_chars': sum(q['context_chars'] > CONTEXT_MAX_CHARS for q in questions),
+        'build_median': statistics.median(build) if build else 0,
+        'build_p95': _percentile(build, 95),
+        'details': questions,
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def _label(strategy, k):
+    return f"{strategy}:{k}" if k else strategy
+
+
+def _print_report(results, min_coverage):
+    print(f"\n{'estrategia':<14} {'recall':>7} {'completas':>9} {'cobertura':>9} {'tokens':>9} "
+          f"{'tokens p95':>10} {'> max':>6} {'construcción':>13} {'p95':>10}")
+    for label, r in results.items():
+        print(f"{label:<14} {r['recall']:>7.1%} {r['all_found']:>9.1%} {r['mean_coverage']:>9.1%} "
+              f"{r['prompt_tokens_mean']:>9.0f} {r['prompt_tokens_p95']:>10} {r['over_max_chars']:>6} "
+              f"{harness.format_seconds(r['build_median']):>13} {harness.format_seconds(r['build_p95']):>10}")
+    print(f"(pasaje encontrado si cubre >= {min_coverage:.0%} de sus {NGRAM}-gramas; tokens: "
+          f"{'tiktoken cl100k_base' if _ENCODING is not None else 'estimación ~4 caracteres/token'})")
+
+
+def _print_comparison(results, previous, dataset):
+    base = previous.get('results', {}).get('strategies', {})
+    print(f"\nComparación con la ejecución anterior (commit {previous.get('commit')}):")
+    if previous.get('results', {}).get('dataset') != dataset:
+        print("Aviso: la ejecución anterior usó otro conjunto de evaluación.")
+    for label, r in results.items():
+        old = base.get(label)
+        if old is None:
+            print(f"{label:<14} nuevo")
+            continue
+        token_change = r['prompt_tokens_mean'] / old['prompt_tokens_mean'] - 1 if old['prompt_tokens_mean'] else 0.0
+        build_change = r['build_median'] / old['build_median'] - 1 if old['build_median'] else 0.0
+        print(f"{label:<14} recall {old['recall']:.1%} -> {r['recall']:.1%}  "
+              f"tokens {token_change:+.1%}  construcción {build_change:+.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.retrieval', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset', nargs='?', help='JSON con documentos y preguntas (por defecto sintético)')
+    parser.add_argument('--strategy', action='append', type=parse_strategy,
+                        help=f"estrategia[:k] a evaluar, repetible (por defecto {' '.join(DEFAULT_STRATEGIES)})")
+    parser.add_argument('--repeat', type=int, default=3, help='construcciones por pregunta (se toma la mediana)')
+    parser.add_argument('--min-coverage', type=float, default=DEFAULT_MIN_COVERAGE)
+    parser.add_argument('--max-chars', type=int, help='CHAT_CONTEXT_MAX_CHARS para auto y el aviso de map-reduce')
+    parser.add_argument('--synthetic-folders', type=int, default=4)
+    parser.add_argument('--synthetic-docs', type=int, default=10, help='documentos por carpeta')
+    parser.add_argument('--synthetic-words', type=int, default=3000, help='palabras por documento')
+    parser.add_argument('--json', metavar='PATH', help='guarda métricas y detalle por pregunta')
+    parser.add_argument('--compare', metavar='PATH', help='JSON de una ejecución anterior (--json)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='lista las preguntas con pasajes no encontrados')
+    args = parser.parse_args(argv)
+
+    strategies = args.strategy or [parse_strategy(s) for s in DEFAULT_STRATEGIES]
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix='retrieval-')
+    try:
+        _prepare_environment(workdir, args.max_chars)
+        from src.main import app
+
+        if args.dataset:
+            dataset = load_dataset(args.dataset)
+        else:
+            dataset = make_qa_corpus(args.synthetic_folders, args.synthetic_docs, args.synthetic_words)
+        user_id, folder_map = _seed(app, dataset)
+        index_seconds = _build_index(app, folder_map.values())
+        total_chars = sum(len(d['text']) for d in dataset['documents'])
+        print(f"{len(dataset['documents'])} documentos ({total_chars} caracteres) en {len(folder_map)} carpetas, "
+              f"{len(dataset['questions'])} preguntas; índice de embeddings "
+              f"({os.environ['EMBEDDING_PROVIDER']}) en {harness.format_seconds(index_seconds)}")
+
+        results = {}
+        for strategy, k in strategies:
+            results[_label(strategy, k)] = evaluate(
+                app, dataset, user_id, folder_map, strategy, k,
+                repeat=args.repeat, min_coverage=args.min_coverage,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_report(results, args.min_coverage)
+    if args.verbose:
+        for label, r in results.items():
+            for q in r['details']:
+                if q['found'] < q['expected']:
+                    coverage = ', '.join(f"{c:.0%}" for c in q['coverage'])
+                    print(f"  [{label}] {q['question']} (cobertura {coverage})")
+    if previous is not None:
+        _print_comparison(results, previous, args.dataset or 'synthetic')
+    if args.json:
+        report = {
+            'dataset': args.dataset or 'synthetic',
+            'min_coverage': args.min_coverage,
+            'index_seconds': index_seconds,
+            'strategies': results,
+        }
+        print(f"\nResultados guardados en {harness.save(report, args.json)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
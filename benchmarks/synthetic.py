@@ -0,0 +1,134 @@
+"""Documentos sintéticos para benchmarks y pruebas de escala.
+
+make_pdf() escribe un PDF mínimo válido (fuente Helvetica estándar, texto
+sin comprimir) sin depender de reportlab; PyPDF2 extrae su texto igual que
+el de un PDF real de solo texto. make_text() genera el mismo tipo de texto
+para sembrar PDF.content directamente, y make_qa_corpus() un conjunto de
+evaluación de recuperación (documentos con datos insertados y preguntas
+sobre ellos) en el formato de benchmarks/retrieval.py.
+"""
+import random
+
+VOCABULARY = (
+    "contrato cliente proveedor factura importe plazo entrega garantía cláusula anexo "
+    "informe trimestral ventas margen coste beneficio presupuesto objetivo resultado "
+    "proyecto fase riesgo calendario equipo responsable revisión aprobación firma "
+    "documento sección artículo normativa cumplimiento auditoría registro archivo "
+    "pedido almacén inventario transporte envío devolución incidencia soporte servicio"
+).split()
+
+# (dato insertado en el documento, pregunta que lo pide); {code} lo hace único
+FACT_TEMPLATES = (
+    ("El plazo de entrega del pedido {code} es de {n} días hábiles desde la firma.",
+     "¿Cuál es el plazo de entrega del pedido {code}?"),
+    ("La garantía del equipo {code} cubre {n} meses a partir de la instalación.",
+     "¿Cuántos meses de garantía tiene el equipo {code}?"),
+    ("El importe total de la factura {code} asciende a {n} euros con impuestos incluidos.",
+     "¿A cuánto asciende la factura {code}?"),
+    ("La penalización por retraso del contrato {code} es del {n} por ciento mensual.",
+     "¿Qué penalización por retraso fija el contrato {code}?"),
+    ("La auditoría del almacén {code} detectó {n} incidencias de inventario.",
+     "¿Cuántas incidencias encontró la auditoría del almacén {code}?"),
+)
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+FONT_SIZE = 10
+LEADING = 12
+MARGIN = 50
+
+
+def make_text(words, seed=0):
+    """Texto pseudoaleatorio reproducible de `words` palabras."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(words):
+        word = rng.choice(VOCABULARY)
+        if i % 12 == 11:
+            word += '.\n'
+        out.append(word)
+    return ' '.join(out)
+
+
+def make_qa_corpus(folders=4, docs_per_folder=10, words=3000, facts_per_doc=2, folders_per_question=2, seed=0):
+    """Documentos sintéticos con datos insertados y una pregunta por dato.
+
+    Devuelve {'documents': [{'folder', 'name', 'text'}], 'questions':
+    [{'question', 'folders', 'expected'}]}: cada pregunta selecciona la carpeta
+    de su documento y otras al azar, y espera la frase del dato como pasaje.
+    """
+    rng = random.Random(seed)
+    folder_names = [f"Carpeta {i + 1}" for i in range(folders)]
+    documents, questions = [], []
+    for f, folder in enumerate(folder_names):
+        for d in range(docs_per_folder):
+            sentences = make_text(words, seed=rng.randrange(1 << 30)).split('\n')
+            for _ in range(facts_per_doc):
+                fact, question = rng.choice(FACT_TEMPLATES)
+                code = f"{rng.choice('ABCDEFGHJKLMNPRSTVXZ')}{rng.choice('ABCDEFGHJKLMNPRSTVXZ')}-{rng.randrange(1000, 9999)}"
+                passage = fact.format(code=code, n=rng.randrange(2, 90))
+                sentences.insert(rng.randrange(len(sentences) + 1), passage)
+                others = rng.sample([x for x in folder_names if x != folder], min(folders_per_question - 1, folders - 1))
+                questions.append({
+                    'question': question.format(code=code),
+                    'folders': [folder] + others,
+                    'expected': [passage],
+                })
+            documents.append({'folder': folder, 'name': f"documento-{f + 1}-{d + 1}.pdf", 'text': '\n'.join(sentences)})
+    return {'documents': documents, 'questions': questions}
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_stream(words, rng):
+    lines_per_page = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    words_per_line = max(1, -(-words // lines_per_page))
+    ops = [f"BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td"]
+    remaining = words
+    while remaining > 0:
+        count = min(words_per_line, remaining)
+        line = ' '.join(rng.choice(VOCABULARY) for _ in range(count))
+        ops.append(f"({_escape(line)}) Tj T*")
+        remaining -= count
+    ops.append("ET")
+    return '\n'.join(ops).encode('latin-1', 'replace')
+
+
+def make_pdf(path, pages=10, words_per_page=300, seed=0):
+    """Escribe un PDF de `pages` páginas con ~words_per_page palabras cada una."""
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    page_ids = []
+    for _ in range(pages):
+        stream = _page_stream(words_per_page, rng)
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (pages_obj, PAGE_WIDTH, PAGE_HEIGHT, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = b' '.join(b"%d 0 R" % pid for pid in page_ids)
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
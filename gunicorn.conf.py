@@ -0,0 +1,60 @@
+"""Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo).
+
+Las opciones de workers siguen en Procfile/render.yaml; aquí solo van los
+hooks que necesitan las métricas Prometheus en modo multiproceso: un
+directorio compartido por los workers, vaciado al arrancar el master, y la
+limpieza de los valores de cada worker que termina. Cada worker arranca
+además el recolector de uploads huérfanos una vez cargada la app.
+
+El directorio es fijo (PROMETHEUS_MULTIPROC_DIR, por defecto
+<tmp>/pdfchat-metrics) para no dejar uno nuevo en /tmp por cada arranque;
+se borra también al parar el master. Dos instancias de gunicorn en la misma
+máquina deben usar directorios distintos.
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'pdfchat-metrics'))
+
+
+def _remove_stale_pid_dirs():
+    """Directorios pdfchat-metrics-<pid> de versiones anteriores cuyo master ya no existe."""
+    base = tempfile.gettempdir()
+    for name in os.listdir(base):
+        prefix, _, pid = name.rpartition('-')
+        if prefix != 'pdfchat-metrics' or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+        except OSError:
+            pass
+
+
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    _remove_stale_pid_dirs()
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Después de cargar la app (y del monkey patching de gevent): el hilo del
+    # recolector es un greenlet del worker y no se crea en el master
+    from src.main import app
+    from src.services.upload_storage import start_upload_gc
+    start_upload_gc(app)
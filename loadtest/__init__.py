@@ -0,0 +1 @@
+"""Pruebas de carga contra la app real servida por gunicorn, con stubs locales."""
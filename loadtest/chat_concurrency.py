@@ -0,0 +1,174 @@
+"""Cientos de chats lentos en vuelo no deben bloquear el resto de la API.
+
+Levanta gunicorn con la app real (DB SQLite temporal) apuntando a un LLMStub
+con latencia fija, lanza N envíos de mensaje concurrentes y, mientras están
+esperando al proveedor, mide la latencia de /api/folders y /api/auth/check.
+
+    python -m loadtest.chat_concurrency --chats 300 --llm-latency 5
+    python -m loadtest.chat_concurrency --worker-class sync   # comparación
+
+Con workers gevent las sondas responden en milisegundos; con 3 workers sync
+quedan detrás de los chats (o agotan el timeout).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from loadtest.common import ROOT, free_port, percentile, wait_ready
+from loadtest.stubs import LLMStub
+
+
+def _seed(env, conversations):
+    """Crea un usuario con una carpeta y N conversaciones; devuelve un access token."""
+    code = (
+        "from src.main import app\n"
+        "from src.models.user import db, User, Folder, Conversation\n"
+        "from src.routes.auth import _issue_tokens\n"
+        "with app.test_request_context():\n"
+        "    u = User(google_id='loadtest', username='loadtest', email='loadtest@example.com')\n"
+        "    db.session.add(u); db.session.commit()\n"
+        "    db.session.add(Folder(name='Carga', user_id=u.id))\n"
+        f"    convs = [Conversation(user_id=u.id, title='c') for _ in range({conversations})]\n"
+        "    db.session.add_all(convs); db.session.commit()\n"
+        "    print(_issue_tokens(u)['access_token'])\n"
+        "    print(','.join(str(c.id) for c in convs))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout.strip().splitlines()
+    return out[-2], [int(x) for x in out[-1].split(',')]
+
+
+def run(chats=300, llm_latency=5.0, workers=3, worker_class='gevent', worker_connections=1000):
+    stub = LLMStub(latency=llm_latency).start()
+    tmp = tempfile.mkdtemp(prefix='loadtest-')
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'app.db')}",
+        SECRET_KEY='loadtest',
+        AI_PROVIDER='openai',
+        OPENAI_API_KEY='stub',
+        OPENAI_API_BASE=stub.base_url,
+        UPLOAD_GC_INTERVAL_SECONDS='0',
+        DRIVE_QUOTA_DB=os.path.join(tmp, 'drive_quota.db'),
+        # Todos los chats son del mismo usuario: se mide el worker, no la admisión
+        LLM_MAX_CONCURRENT=str(chats),
+        LLM_MAX_CONCURRENT_PER_USER=str(chats),
+        LLM_MAX_QUEUED_PER_USER=str(chats),
+    )
+    token, conversation_ids = _seed(env, chats)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'src.main:app',
+        '--workers', str(workers), '--worker-class', worker_class,
+        '--timeout', '120', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ]
+    if worker_class == 'gevent':
+        cmd += ['--worker-connections', str(worker_connections)]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    try:
+        wait_ready(base_url)
+        chat_latencies, chat_errors = [], []
+        probe_latencies, probe_errors = [], 0
+
+        def send_chat(conversation_id):
+            started = time.perf_counter()
+            try:
+                r = requests.post(
+                    f"{base_url}/api/conversations/{conversation_id}/messages",
+                    json={'content': 'Pregunta de carga'},
+                    headers=headers,
+                    timeout=llm_latency + 120,
+                )
+                if r.status_code == 201:
+                    chat_latencies.append(time.perf_counter() - started)
+                else:
+                    chat_errors.append(r.status_code)
+            except requests.RequestException as e:
+                chat_errors.append(type(e).__name__)
+
+        pool = ThreadPoolExecutor(max_workers=chats)
+        started = time.perf_counter()
+        futures = [pool.submit(send_chat, cid) for cid in conversation_ids]
+
+        # Sondas mientras los chats esperan al stub
+        time.sleep(min(1.0, llm_latency / 4))
+        probe_until = started + llm_latency * 0.9
+        while time.perf_counter() < probe_until:
+            for path in ('/api/folders', '/api/auth/check'):
+                t0 = time.perf_counter()
+                try:
+                    r = requests.get(f"{base_url}{path}", headers=headers, timeout=llm_latency + 60)
+                    if r.status_code != 200:
+                        probe_errors += 1
+                except requests.RequestException:
+                    probe_errors += 1
+                probe_latencies.append(time.perf_counter() - t0)
+        in_flight_at_probe_end = sum(1 for f in futures if not f.done())
+
+        for f in futures:
+            f.result()
+        pool.shutdown()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stub.stop()
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 1)
+
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'chats': chats,
+        'llm_latency_s': llm_latency,
+        'chats_ok': len(chat_latencies),
+        'chat_errors': len(chat_errors),
+        'chat_p50_ms': ms(percentile(chat_latencies, 50)),
+        'chat_p95_ms': ms(percentile(chat_latencies, 95)),
+        'chats_in_flight_during_probes': in_flight_at_probe_end,
+        'probes': len(probe_latencies),
+        'probe_errors': probe_errors,
+        'probe_p50_ms': ms(percentile(probe_latencies, 50)),
+        'probe_p95_ms': ms(percentile(probe_latencies, 95)),
+        'probe_max_ms': ms(max(probe_latencies) if probe_latencies else None),
+        'elapsed_s': round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--llm-latency', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--max-probe-p95-ms', type=float, default=500.0,
+                        help='Falla (exit 1) si el p95 de las sondas lo supera')
+    args = parser.parse_args()
+
+    result = run(args.chats, args.llm_latency, args.workers, args.worker_class)
+    for key, value in result.items():
+        print(f"{key:32} {value}")
+    ok = (
+        result['chat_errors'] == 0
+        and result['probe_errors'] == 0
+        and result['probe_p95_ms'] is not None
+        and result['probe_p95_ms'] <= args.max_probe_p95_ms
+    )
+    print("OK" if ok else "FALLO: la API se bloqueó con chats en vuelo")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+"""Google Drive falso sobre un árbol de directorios local.
+
+Implementa la parte de la API v3 que usa src/google_drive.py: files.list
+(con las condiciones de q que genera la app y paginación), files.get
+(metadatos y alt=media), files.create (carpetas y subidas resumable),
+files.delete y las peticiones batch. Los directorios son carpetas y los
+ficheros son archivos; 'root' es la raíz del árbol.
+
+La app lo usa con DRIVE_DISCOVERY_URL=<discovery_url>: el documento de
+descubrimiento servido es el de Drive v3 con rootUrl apuntando aquí, así que
+el cliente de Google envía todas las llamadas (también subidas y batch) a
+este servidor. Las credenciales no se validan.
+
+latency, jitter y error_rate (con error_status, 503 por defecto, que la app
+reintenta) se aplican a cada llamada, incluidas las de dentro de un batch.
+"""
+import email.parser
+import email.policy
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+SERVICE_PATH = '/drive/v3/'
+UPLOAD_PATH = '/upload/drive/v3/files'
+BATCH_PATH = '/batch/drive/v3'
+DISCOVERY_PATH = '/discovery/v1/apis/drive/v3/rest'
+PAGE_SIZE_DEFAULT = 100
+
+_CLAUSE_PARENT = re.compile(r"^'(?P<value>[^']*)'\s+in\s+parents$", re.I)
+_CLAUSE_FIELD = re.compile(r"^(?P<field>mimeType|name)\s*(?P<op>=|!=|contains)\s*'(?P<value>(?:[^'\\]|\\.)*)'$", re.I)
+_CLAUSE_TRASHED = re.compile(r"^trashed\s*=\s*(?P<value>true|false)$", re.I)
+
+
+class DriveApiError(Exception):
+    def __init__(self, status, message, reason='backendError'):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+    def payload(self):
+        return {'error': {'code': self.status, 'message': str(self), 'errors': [
+            {'domain': 'global', 'reason': self.reason, 'message': str(self)},
+        ]}}
+
+
+def _rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class DriveTree:
+    """Índice id <-> ruta relativa del árbol local (thread-safe)."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._paths = {'root': ''}
+        self._ids = {'': 'root'}
+        self._md5 = {}
+        for directory, dirnames, filenames in os.walk(self.root):
+            for name in sorted(dirnames) + sorted(filenames):
+                self._register(os.path.relpath(os.path.join(directory, name), self.root))
+
+    @staticmethod
+    def _id_for(relpath):
+        return hashlib.sha1(relpath.encode('utf-8')).hexdigest()[:28]
+
+    def _register(self, relpath):
+        file_id = self._ids.get(relpath)
+        if file_id is None:
+            file_id = self._id_for(relpath)
+            self._ids[relpath] = file_id
+            self._paths[file_id] = relpath
+        return file_id
+
+    def path(self, file_id):
+        with self._lock:
+            relpath = self._paths.get(file_id)
+        if relpath is None:
+            raise DriveApiError(404, f"File not found: {file_id}.", 'notFound')
+        path = os.path.join(self.root, relpath) if relpath else self.root
+        if not os.path.exists(path):
+            raise DriveApiError(404, f"File not found: {file_id}.", 'notFound')
+        return path
+
+    def metadata(self, file_id):
+        path = self.path(file_id)
+        relpath = os.path.relpath(path, self.root)
+        parent = os.path.dirname(relpath) if file_id != 'root' else None
+        stat = os.stat(path)
+        data = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'name': os.path.basename(path) if file_id != 'root' else 'Mi unidad',
+            'modifiedTime': _rfc3339(stat.st_mtime),
+            'trashed': False,
+        }
+        if parent is not None:
+            with self._lock:
+                data['parents'] = [self._ids.get(parent, 'root')]
+        if os.path.isdir(path):
+            data['mimeType'] = FOLDER_MIME
+        else:
+            data['mimeType'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            data['size'] = str(stat.st_size)
+            data['md5Checksum'] = self._checksum(path, stat)
+        return data
+
+    def _checksum(self, path, stat):
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._md5.get(key)
+        if cached is None:
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            cached = digest.hexdigest()
+            with self._lock:
+                self._md5[key] = cached
+        return cached
+
+    def children(self, parent_id):
+        directory = self.path(parent_id)
+        if not os.path.isdir(directory):
+            return []
+        relbase = os.path.relpath(directory, self.root) if parent_id != 'root' else ''
+        with self._lock:
+            return [
+                self._register(os.path.join(relbase, name) if relbase else name)
+                for name in sorted(os.listdir(directory))
+            ]
+
+    def all_ids(self):
+        ids = []
+        for directory, dirnames, filenames in os.walk(self.root):
+            relbase = os.path.relpath(directory, self.root)
+            with self._lock:
+                for name in sorted(dirnames) + sorted(filenames):
+                    ids.append(self._register(name if relbase == '.' else os.path.join(relbase, name)))
+        return ids
+
+    def create(self, parent_id, name, is_folder=False, content=None):
+        directory = self.path(parent_id)
+        if not os.path.isdir(directory):
+            raise DriveApiError(400, 'El padre no es una carpeta', 'invalidParent')
+        # Drive admite nombres repetidos; en disco se añade un sufijo
+        base, ext = os.path.splitext(os.path.basename(name) or 'sin-nombre')
+        candidate, n = base + ext, 1
+        while os.path.exists(os.path.join(directory, candidate)):
+            n += 1
+            candidate = f"{base} ({n}){ext}"
+        path = os.path.join(directory, candidate)
+        if is_folder:
+            os.makedirs(path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(content or b'')
+        with self._lock:
+            return self._register(os.path.relpath(path, self.root))
+
+    def delete(self, file_id):
+        if file_id == 'root':
+            raise DriveApiError(403, 'No se puede borrar la raíz', 'insufficientFilePermissions')
+        path = self.path(file_id)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        relpath = os.path.relpath(path, self.root)
+        with self._lock:
+            for known in [p for p in self._ids if p == relpath or p.startswith(relpath + os.sep)]:
+                self._paths.pop(self._ids.pop(known), None)
+
+
+def _parse_query(q):
+    """Condiciones [(campo, op, valor)] de un q de Drive (solo conjunciones con 'and')."""
+    conditions = []
+    for clause in re.split(r'\s+and\s+', (q or '').strip(), flags=re.I):
+        clause = clause.strip().strip('()').strip()
+        if not clause:
+            continue
+        match = _CLAUSE_PARENT.match(clause)
+        if match:
+            conditions.append(('parent', '=', match.group('value')))
+            continue
+        match = _CLAUSE_FIELD.match(clause)
+        if match:
+            value = match.group('value').replace("\\'", "'").replace('\\\\', '\\')
+            conditions.append((match.group('field').lower(), match.group('op').lower(), value))
+            continue
+        match = _CLAUSE_TRASHED.match(clause)
+        if match:
+            conditions.append(('trashed', '=', match.group('value').lower() == 'true'))
+            continue
+        raise DriveApiError(400, f"Invalid Value (q no soportado por el Drive falso: {clause})", 'invalid')
+    return conditions
+
+
+def _matches(meta, conditions):
+    for field, op, value in conditions:
+        if field == 'trashed':
+            if meta.get('trashed', False) != value:
+                return False
+        elif field == 'parent':
+            continue
+        else:
+            actual = meta.get('mimeType' if field == 'mimetype' else 'name') or ''
+            if op == '=' and actual != value:
+                return False
+            if op == '!=' and actual == value:
+                return False
+            # contains en Drive es por prefijo de palabra y sin distinguir mayúsculas
+            if op == 'contains' and value.lower() not in actual.lower():
+                return False
+    return True
+
+
+def _sort_key(order_by):
+    fields = [part.strip() for part in (order_by or '').split(',') if part.strip()]
+    if not fields:
+        return None, False
+    field, _, direction = fields[0].partition(' ')
+    reverse = direction.strip().lower() == 'desc'
+    if field == 'modifiedTime':
+        return (lambda m: m.get('modifiedTime') or ''), reverse
+    if field in ('name', 'name_natural'):
+        return (lambda m: (m.get('name') or '').lower()), reverse
+    return None, False
+
+
+class _DriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if body or status != 204:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _handle(self, method):
+        drive = self.server.drive
+        url = urlparse(self.path)
+        if url.path == DISCOVERY_PATH:
+            self._send(200, drive.discovery_document().encode('utf-8'))
+            return
+        body = self._read_body()
+        if url.path == BATCH_PATH and method == 'POST':
+            status, payload, content_type = drive.batch(self.headers.get('Content-Type', ''), body)
+            self._send(status, payload, content_type)
+            return
+        status, payload, content_type, headers = drive.dispatch(method, url.path, parse_qs(url.query), body,
+                                                                self.headers)
+        self._send(status, payload, content_type, headers)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeDrive:
+    """Servidor Drive v3 falso en 127.0.0.1:<port> sobre el directorio root."""
+
+    def __init__(self, root, port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.tree = DriveTree(root)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _DriveHandler)
+        self.server.daemon_threads = True
+        self.server.drive = self
+        self.calls = Counter()
+        self.errors = Counter()
+        self._uploads = {}
+        self._discovery = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def discovery_url(self):
+        """Para DRIVE_DISCOVERY_URL."""
+        return self.base_url + DISCOVERY_PATH
+
+    def discovery_document(self):
+        if self._discovery is None:
+            import googleapiclient.discovery_cache
+
+            path = os.path.join(os.path.dirname(googleapiclient.discovery_cache.__file__), 'documents', 'drive.v3.json')
+            with open(path, encoding='utf-8') as f:
+                document = json.load(f)
+            document['rootUrl'] = self.base_url + '/'
+            document['mtlsRootUrl'] = self.base_url + '/'
+            document['baseUrl'] = self.base_url + SERVICE_PATH
+            self._discovery = json.dumps(document)
+        return self._discovery
+
+    # ---- Inyección de latencia y errores ------------------------------------
+
+    def _before_call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.errors[name] += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            reason = 'rateLimitExceeded' if self.error_status in (403, 429) else 'backendError'
+            raise DriveApiError(self.error_status, 'Error inyectado por el Drive falso', reason)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'errors': dict(self.errors)}
+
+    # ---- API ------------------------------------------------------------------
+
+    def dispatch(self, method, path, query, body, headers):
+        """(status, cuerpo, content-type, cabeceras extra) de una llamada a la API."""
+        try:
+            return self._dispatch(method, path, query, body, headers)
+        except DriveApiError as error:
+            return error.status, error.payload(), 'application/json', {}
+
+    def _dispatch(self, method, path, query, body, headers):
+        arg = {key: values[-1] for key, values in query.items()}
+        if path == UPLOAD_PATH:
+            return self._upload(method, arg, body, headers)
+        if not path.startswith(SERVICE_PATH + 'files'):
+            raise DriveApiError(404, f"Ruta no soportada por el Drive falso: {path}", 'notFound')
+        file_id = path[len(SERVICE_PATH + 'files'):].strip('/') or None
+        if method == 'GET' and file_id is None:
+            self._before_call('files.list')
+            return 200, self._list(arg), 'application/json', {}
+        if method == 'GET' and arg.get('alt') == 'media':
+            self._before_call('files.get_media')
+            with open(self.tree.path(file_id), 'rb') as f:
+                return 200, f.read(), 'application/octet-stream', {}
+        if method == 'GET':
+            self._before_call('files.get')
+            return 200, self.tree.metadata(file_id), 'application/json', {}
+        if method == 'POST' and file_id is None:
+            self._before_call('files.create')
+            meta = json.loads(body or b'{}')
+            new_id = self.tree.create(
+                (meta.get('parents') or ['root'])[0], meta.get('name') or 'sin-nombre',
+                is_folder=meta.get('mimeType') == FOLDER_MIME,
+            )
+            return 200, self.tree.metadata(new_id), 'application/json', {}
+        if method == 'DELETE' and file_id:
+            self._before_call('files.delete')
+            self.tree.delete(file_id)
+            return 204, b'', 'application/json', {}
+        raise DriveApiError(405, f"Método no soportado por el Drive falso: {method} {path}", 'notSupported')
+
+    def _list(self, arg):
+        conditions = _parse_query(arg.get('q'))
+        parents = [value for field, _, value in conditions if field == 'parent']
+        ids = self.tree.children(parents[0]) if parents else self.tree.all_ids()
+        items = []
+        for file_id in ids:
+            try:
+                meta = self.tree.metadata(file_id)
+            except DriveApiError:
+                continue  # borrado entre el listado del directorio y el stat
+            if _matches(meta, conditions):
+                items.append(meta)
+        key, reverse = _sort_key(arg.get('orderBy'))
+        if key is not None:
+            items.sort(key=key, reverse=reverse)
+        page_size = max(1, min(int(arg.get('pageSize') or PAGE_SIZE_DEFAULT), 1000))
+        offset = int(arg.get('pageToken') or 0)
+        page = items[offset:offset + page_size]
+        result = {'kind': 'drive#fileList', 'incompleteSearch': False, 'files': page}
+        if offset + page_size < len(items):
+            result['nextPageToken'] = str(offset + page_size)
+        return result
+
+    def _upload(self, method, arg, body, headers):
+        upload_type = arg.get('uploadType')
+        if method == 'POST' and upload_type == 'resumable':
+            self._before_call('files.create')
+            upload_id = uuid.uuid4().hex
+            with self._lock:
+                self._uploads[upload_id] = {'meta': json.loads(body or b'{}'), 'data': bytearray()}
+            location = f"{self.base_url}{UPLOAD_PATH}?uploadType=resumable&upload_id={upload_id}"
+            return 200, b'', 'application/json', {'Location': location}
+        if method == 'PUT' and upload_type == 'resumable':
+            with self._lock:
+                upload = self._uploads.get(arg.get('upload_id'))
+            if upload is None:
+                raise DriveApiError(404, 'Sesión de subida desconocida', 'notFound')
+            upload['data'].extend(body)
+            total = headers.get('Content-Range', '').rpartition('/')[2]
+            if total not in ('*', '') and len(upload['data']) < int(total):
+                # Fragmento intermedio: Drive responde 308 con lo recibido
+                return 308, b'', 'application/json', {'Range': f"bytes=0-{len(upload['data']) - 1}"}
+            with self._lock:
+                self._uploads.pop(arg['upload_id'], None)
+            meta = upload['meta']
+            new_id = self.tree.create((meta.get('parents') or ['root'])[0], meta.get('name') or 'sin-nombre',
+                                      content=bytes(upload['data']))
+            return 200, self.tree.metadata(new_id), 'application/json', {}
+        if method == 'POST' and upload_type == 'media':
+            self._before_call('files.create')
+            new_id = self.tree.create('root', 'sin-nombre', content=body)
+            return 200, self.tree.metadata(new_id), 'application/json', {}
+        raise DriveApiError(400, f"uploadType no soportado por el Drive falso: {upload_type}", 'invalid')
+
+    def batch(self, content_type, body):
+        """Respuesta multipart/mixed a un batch (cada parte es una llamada HTTP completa)."""
+        message = email.parser.BytesParser(policy=email.policy.compat32).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+        )
+        if not message.is_multipart():
+            return 400, {'error': {'code': 400, 'message': 'Batch sin multipart/mixed'}}, 'application/json'
+        boundary = 'batch_' + uuid.uuid4().hex
+        out = []
+        for part in message.get_payload():
+            # El cliente puede plegar la cabecera en varias líneas
+            content_id = ' '.join(part.get('Content-ID', '').split())
+            raw = part.get_payload(decode=False)
+            request_line, _, rest = raw.replace('\r\n', '\n').partition('\n')
+            method, target, _ = request_line.split(' ', 2)
+            head, _, inner_body = rest.partition('\n\n')
+            inner_headers = dict(
+                line.split(':', 1) for line in head.splitlines() if ':' in line
+            )
+            inner_headers = {k.strip(): v.strip() for k, v in inner_headers.items()}
+            url = urlparse(target)
+            status, payload, inner_type, _ = self.dispatch(
+                method, url.path, parse_qs(url.query), inner_body.encode('utf-8'), inner_headers
+            )
+            if isinstance(payload, (dict, list)):
+                payload = json.dumps(payload).encode('utf-8')
+            reason = {200: 'OK', 204: 'No Content', 404: 'Not Found'}.get(status, 'Error')
+            response_id = content_id.replace('<', '<response-', 1) if content_id else ''
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {response_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: {inner_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n".encode('utf-8') + payload + b"\r\n"
+            )
+        out.append(f"--{boundary}--\r\n".encode('utf-8'))
+        return 200, b''.join(out), f'multipart/mixed; boundary={boundary}'
+
+    # ---- Ciclo de vida ----------------------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-drive', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,488 @@
+"""Base de datos a escala y regresiones de planes de consulta.
+
+Las bases de desarrollo tienen unas pocas carpetas; esta herramienta genera
+volúmenes realistas directamente en SQLite o Postgres (la URL de
+SQLAlchemy de --database-url o DATABASE_URL) y comprueba la app contra ellos.
+
+seed   Inserta usuarios, carpetas, PDFs (texto de --pdf-chars caracteres),
+       conversaciones y mensajes por lotes con inserciones masivas de
+       SQLAlchemy Core (sin ORM ni eventos de sesión). Las carpetas y las
+       conversaciones se reparten entre usuarios con una ley de Zipf
+       (--skew; 0 = uniforme), así que el primer usuario es el más pesado.
+       Se puede ejecutar varias veces: añade filas a las existentes.
+       Al terminar ejecuta ANALYZE para que el planificador tenga estadísticas.
+
+check  Con la app en proceso (test_client) y un stub local del LLM, repite
+       cada endpoint de la API como el usuario con más carpetas y muestra
+       mediana, p95 y consultas por petición. Cada sentencia distinta se
+       explica (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en Postgres): un
+       recorrido completo de una tabla con más de --min-rows filas o un
+       índice automático hace fallar la comprobación (exit 1), igual que
+       superar --max-ms en el p95. El chat escribe dos mensajes por petición.
+
+    python -m loadtest.scale --database-url sqlite:////tmp/scale.db seed
+    python -m loadtest.scale --database-url sqlite:////tmp/small.db seed --folders 500 --pdfs 5000 --messages 50000
+    python -m loadtest.scale --database-url sqlite:////tmp/scale.db check --max-ms 500 --json scale.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import make_text
+from loadtest.common import ROOT, percentile
+from loadtest.stubs import LLMStub
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_MIN_ROWS = 5000
+SEARCH_QUERY = 'cláusula de penalización inexistente'
+CHAT_QUESTION = '¿Qué plazo de entrega fija el contrato?'
+
+# Paso del plan que recorre una tabla entera (SQLite: "SCAN pdf", "SCAN TABLE pdf",
+# también "SCAN pdf USING COVERING INDEX ..."; Postgres: "Seq Scan on pdf")
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?'),
+    'postgresql': re.compile(r'\bSeq Scan on "?(\w+)"?'),
+}
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?\s+AS\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def _prepare_environment(database_url, llm_base_url=None):
+    """Configura la app antes de importar src: base indicada y sin tareas de fondo."""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['UPLOAD_GC_INTERVAL_SECONDS'] = '0'
+    os.environ.setdefault('TRACING_EXPORTER', 'off')
+    # Los planes se piden explícitamente; el log de lentas solo añadiría ruido
+    os.environ['QUERY_AUDIT'] = '1'
+    os.environ.setdefault('SLOW_QUERY_MS', '60000')
+    if llm_base_url:
+        os.environ['AI_PROVIDER'] = 'openai'
+        os.environ['AI_PROVIDERS'] = 'openai'
+        os.environ['OPENAI_API_KEY'] = 'scale'
+        os.environ['OPENAI_API_BASE'] = llm_base_url
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+# ---- seed ----------------------------------------------------------------------
+
+def _zipf_weights(count, skew):
+    return [1.0 / (rank + 1) ** skew for rank in range(count)]
+
+
+def _text_pool(chars, rng, size=64):
+    """Textos de al menos 2 * chars caracteres; cada fila toma un trozo al azar."""
+    words = max(8, chars * 2 // 6)
+    return [make_text(words, seed=rng.randrange(1 << 30)) for _ in range(size)]
+
+
+def _slice(pool, chars, rng):
+    text = rng.choice(pool)
+    start = rng.randrange(max(1, len(text) - chars))
+    return text[start:start + chars]
+
+
+def _next_id(conn, table):
+    from sqlalchemy import func, select
+
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def _insert(conn, table, rows, total, batch_size):
+    """Inserta las filas del generador por lotes, con un commit por lote."""
+    started = time.perf_counter()
+    done = 0
+    next_report = total // 10
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.execute(table.insert(), batch)
+            conn.commit()
+            done += len(batch)
+            batch = []
+            if next_report and done >= next_report:
+                print(f"[Scale] {table.name}: {done}/{total}")
+                next_report += total // 10
+    if batch:
+        conn.execute(table.insert(), batch)
+        conn.commit()
+        done += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f"[Scale] {table.name}: {done} filas en {elapsed:.1f} s ({done / max(elapsed, 1e-9):.0f} filas/s)")
+    return done
+
+
+def seed(users=50, folders=10_000, pdfs=100_000, conversations=50_000, messages=1_000_000,
+         pdf_chars=4000, message_chars=300, skew=1.0, seed_value=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Genera el dataset en la base de DATABASE_URL; devuelve las filas insertadas por tabla."""
+    from sqlalchemy import text
+
+    from src.main import app
+    from src.models.user import db, User, Folder, PDF, Conversation, Message
+
+    rng = random.Random(seed_value)
+    base_time = datetime.utcnow() - timedelta(days=365)
+    year_seconds = 365 * 24 * 3600
+    inserted = {}
+
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect.name
+        with engine.connect() as conn:
+            if dialect == 'sqlite':
+                # Carga masiva: sin fsync por commit; la base se puede regenerar
+                conn.exec_driver_sql('PRAGMA synchronous=OFF')
+                conn.exec_driver_sql('PRAGMA cache_size=-200000')
+
+            first_user = _next_id(conn, User.__table__)
+            user_ids = list(range(first_user, first_user + users))
+            inserted['user'] = _insert(conn, User.__table__, (
+                {
+                    'id': uid,
+                    'google_id': f"scale-{uid}",
+                    'username': f"Usuario {uid}",
+                    'email': f"scale-{uid}@example.com",
+                    'profile_picture': None,
+                    'created_at': base_time,
+                    'google_drive_token': None,
+                    'data_version': 0,
+                }
+                for uid in user_ids
+            ), users, batch_size)
+            weights = _zipf_weights(users, skew)
+
+            first_folder = _next_id(conn, Folder.__table__)
+            folder_ids = list(range(first_folder, first_folder + folders))
+            inserted['folder'] = _insert(conn, Folder.__table__, (
+                {
+                    'id': fid,
+                    'name': f"Carpeta {fid}",
+                    'user_id': owner,
+                    'created_at': base_time + timedelta(seconds=rng.randrange(year_seconds)),
+                    'drive_folder_id': None,
+                    'last_drive_sync_at': None,
+                }
+                for fid, owner in zip(folder_ids, rng.choices(user_ids, weights, k=folders))
+            ), folders, batch_size)
+
+            pdf_pool = _text_pool(pdf_chars, rng)
+            first_pdf = _next_id(conn, PDF.__table__)
+
+            def pdf_rows():
+                for pid in range(first_pdf, first_pdf + pdfs):
+                    filename = f"scale-{pid:09d}.pdf"
+                    content = f"Documento {pid}\n" + _slice(pdf_pool, pdf_chars, rng)
+                    yield {
+                        'id': pid,
+                        'filename': filename,
+                        'original_filename': f"documento-{pid}.pdf",
+                        'file_path': os.path.join('uploads', 'scale', filename),
+                        'content': content,
+                        'folder_id': rng.choice(folder_ids),
+                        'uploaded_at': base_time + timedelta(seconds=rng.randrange(year_seconds)),
+                        'file_size': len(content) * 3,
+                        'drive_file_id': None,
+                    }
+
+            inserted['pdf'] = _insert(conn, PDF.__table__, pdf_rows(), pdfs, batch_size) if folders else 0
+
+            first_conversation = _next_id(conn, Conversation.__table__)
+            conversation_ids = list(range(first_conversation, first_conversation + conversations))
+
+            def conversation_rows():
+                owners = rng.choices(user_ids, weights, k=conversations)
+                for cid, owner in zip(conversation_ids, owners):
+                    created_at = base_time + timedelta(seconds=rng.randrange(year_seconds))
+                    yield {
+                        'id': cid,
+                        'user_id': owner,
+                        'title': f"Conversación {cid}",
+                        'created_at': created_at,
+                        'updated_at': created_at + timedelta(seconds=rng.randrange(30 * 24 * 3600)),
+                        'summary': None,
+                        'summary_message_id': None,
+                    }
+
+            inserted['conversation'] = _insert(
+                conn, Conversation.__table__, conversation_rows(), conversations, batch_size
+            )
+
+            message_pool = _text_pool(message_chars, rng)
+            first_message = _next_id(conn, Message.__table__)
+            step = year_seconds / max(messages, 1)
+
+            def message_rows():
+                for i in range(messages):
+                    mid = first_message + i
+                    yield {
+                        'id': mid,
+                        'conversation_id': rng.choice(conversation_ids),
+                        'content': _slice(message_pool, message_chars, rng),
+                        'is_user': i % 2 == 0,
+                        'timestamp': base_time + timedelta(seconds=i * step),
+                        'folder_ids': None,
+                    }
+
+            inserted['message'] = _insert(
+                conn, Message.__table__, message_rows(), messages, batch_size
+            ) if conversations else 0
+
+            if dialect == 'postgresql':
+                # Los ids explícitos no avanzan las secuencias SERIAL
+                for table in ('user', 'folder', 'pdf', 'conversation', 'message'):
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                        f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"
+                    ))
+            conn.exec_driver_sql('ANALYZE')
+            conn.commit()
+    return inserted
+
+
+# ---- check ---------------------------------------------------------------------
+
+def plan_problems(statement, plan, dialect, big_tables):
+    """Pasos del plan que no escalan: recorrido completo de una tabla grande o índice automático."""
+    if not plan or plan.startswith('(sin plan'):
+        return []
+    pattern = FULL_SCAN.get(dialect)
+    aliases = {alias.lower(): table.lower() for table, alias in TABLE_ALIAS.findall(statement)}
+    problems = []
+    for step in plan.split(' | '):
+        if 'AUTOMATIC' in step:
+            problems.append(f"índice automático: {step.strip()}")
+            continue
+        match = pattern.search(step) if pattern else None
+        if match:
+            table = aliases.get(match.group(1).lower(), match.group(1).lower())
+            if table in big_tables:
+                problems.append(f"recorrido completo de {table}: {step.strip()}")
+    return problems
+
+
+def _table_sizes(conn):
+    from sqlalchemy import inspect, text
+
+    sizes = {}
+    for table in inspect(conn).get_table_names():
+        sizes[table] = conn.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar()
+    return sizes
+
+
+def _heavy_user(db):
+    """Usuario con más carpetas y, de él, la carpeta con más PDFs, un PDF y la conversación más larga."""
+    from sqlalchemy import func
+
+    from src.models.user import User, Folder, PDF, Conversation, Message
+
+    row = (
+        db.session.query(Folder.user_id, func.count(Folder.id))
+        .group_by(Folder.user_id).order_by(func.count(Folder.id).desc()).first()
+    )
+    if row is None:
+        return None
+    user = db.session.get(User, row[0])
+    folder = (
+        db.session.query(PDF.folder_id, func.count(PDF.id))
+        .join(Folder, Folder.id == PDF.folder_id).filter(Folder.user_id == user.id)
+        .group_by(PDF.folder_id).order_by(func.count(PDF.id).desc()).first()
+    )
+    folder_id = folder[0] if folder else db.session.query(Folder.id).filter(Folder.user_id == user.id).scalar()
+    pdf_id = db.session.query(PDF.id).filter(PDF.folder_id == folder_id).limit(1).scalar()
+    conversation = (
+        db.session.query(Message.conversation_id, func.count(Message.id))
+        .join(Conversation, Conversation.id == Message.conversation_id).filter(Conversation.user_id == user.id)
+        .group_by(Message.conversation_id).order_by(func.count(Message.id).desc()).first()
+    )
+    conversation_id = conversation[0] if conversation else (
+        db.session.query(Conversation.id).filter(Conversation.user_id == user.id).limit(1).scalar()
+    )
+    return {
+        'user': user,
+        'folders': row[1],
+        'folder_id': folder_id,
+        'folder_pdfs': folder[1] if folder else 0,
+        'pdf_id': pdf_id,
+        'conversation_id': conversation_id,
+        'conversation_messages': conversation[1] if conversation else 0,
+    }
+
+
+def _endpoints(target, etag):
+    """(nombre, método, ruta, cuerpo JSON, cabeceras extra, estados esperados)."""
+    folder_id = target['folder_id']
+    conversation_id = target['conversation_id']
+    endpoints = [
+        ('auth.check', 'GET', '/api/auth/check', None, {}, (200,)),
+        ('folders.list', 'GET', '/api/folders', None, {}, (200,)),
+        ('folders.list_304', 'GET', '/api/folders', None, {'If-None-Match': etag} if etag else {}, (200, 304)),
+        ('folders.summary', 'GET', '/api/folders-summary', None, {}, (200,)),
+        ('conversations.list', 'GET', '/api/conversations', None, {}, (200,)),
+    ]
+    if folder_id:
+        endpoints.append(('folders.search', 'POST', f'/api/folders/{folder_id}/search',
+                          {'query': SEARCH_QUERY}, {}, (200,)))
+    if target['pdf_id']:
+        endpoints.append(('pdfs.get', 'GET', f"/api/pdfs/{target['pdf_id']}", None, {}, (200,)))
+    if conversation_id:
+        endpoints.append(('conversations.get', 'GET', f'/api/conversations/{conversation_id}', None, {}, (200,)))
+        endpoints.append(('chat.send', 'POST', f'/api/conversations/{conversation_id}/messages',
+                          {'content': CHAT_QUESTION, 'folder_ids': [folder_id] if folder_id else []}, {}, (201,)))
+    return endpoints
+
+
+def _time_endpoint(client, endpoint, auth_headers, repeat, dialect, big_tables):
+    from src.services.query_audit import capture_queries
+
+    name, method, path, body, headers, expected = endpoint
+    times = []
+    statuses = set()
+    with capture_queries(explain=True) as log:
+        # La primera petición calienta cachés y paga los EXPLAIN; no se cuenta
+        for i in range(repeat + 1):
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers={**auth_headers, **headers})
+            elapsed = time.perf_counter() - started
+            statuses.add(response.status_code)
+            if i:
+                times.append(elapsed)
+    problems = []
+    unexpected = statuses - set(expected)
+    if unexpected:
+        problems.append(f"estado HTTP {sorted(unexpected)} (esperado {list(expected)})")
+    plans = {}
+    for statement, plan in log.plans.items():
+        found = plan_problems(statement, plan, dialect, big_tables)
+        problems.extend(f"{p}\n      en: {' '.join(statement.split())[:200]}" for p in found)
+        plans[' '.join(statement.split())] = plan
+    return {
+        'method': method,
+        'path': path,
+        'requests': len(times),
+        'median_ms': statistics.median(times) * 1000,
+        'p95_ms': percentile(times, 95) * 1000,
+        'max_ms': max(times) * 1000,
+        'queries_per_request': log.count / (repeat + 1),
+        'plans': plans,
+        'problems': problems,
+    }
+
+
+def check(repeat=20, keyword=None, min_rows=DEFAULT_MIN_ROWS, max_ms=None, verbose=False):
+    """Mide los endpoints como el usuario más pesado y valida los planes; devuelve el informe."""
+    from src.main import app
+    from src.models.user import db
+    from src.routes.auth import create_access_token
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        with db.engine.connect() as conn:
+            sizes = _table_sizes(conn)
+        big_tables = {table for table, rows in sizes.items() if rows >= min_rows}
+        target = _heavy_user(db)
+        if target is None:
+            raise SystemExit("La base no tiene carpetas: ejecuta antes `python -m loadtest.scale seed`")
+        user = target['user']
+        token = create_access_token({'user_id': user.id, 'email': user.email, 'name': user.username})
+        db.session.remove()
+
+    print(f"[Scale] {dialect}: " + ', '.join(f"{table}={rows}" for table, rows in sorted(sizes.items()) if rows))
+    print(f"[Scale] Usuario {user.id}: {target['folders']} carpetas; carpeta {target['folder_id']} con "
+          f"{target['folder_pdfs']} PDFs; conversación {target['conversation_id']} con "
+          f"{target['conversation_messages']} mensajes")
+
+    auth_headers = {'Authorization': f"Bearer {token}"}
+    client = app.test_client()
+    etag = client.get('/api/folders', headers=auth_headers).headers.get('ETag')
+    results = {}
+    for endpoint in _endpoints(target, etag):
+        if keyword and keyword not in endpoint[0]:
+            continue
+        result = _time_endpoint(client, endpoint, auth_headers, repeat, dialect, big_tables)
+        if max_ms is not None and result['p95_ms'] > max_ms:
+            result['problems'].append(f"p95 {result['p95_ms']:.1f} ms > {max_ms:.0f} ms")
+        results[endpoint[0]] = result
+        print(f"{endpoint[0]:<20} median {result['median_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+              f"queries {result['queries_per_request']:>5.1f}  {endpoint[1]} {endpoint[2]}")
+        if verbose:
+            for statement, plan in result['plans'].items():
+                print(f"    {statement[:160]}\n      plan: {plan}")
+        for problem in result['problems']:
+            print(f"    FALLO {problem}")
+    return {
+        'dialect': dialect,
+        'table_rows': sizes,
+        'big_tables': sorted(big_tables),
+        'user_id': user.id,
+        'target': {key: value for key, value in target.items() if key != 'user'},
+        'endpoints': results,
+        'ok': all(not r['problems'] for r in results.values()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest.scale', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='URL de SQLAlchemy (por defecto DATABASE_URL)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='genera el dataset')
+    seed_parser.add_argument('--users', type=int, default=50)
+    seed_parser.add_argument('--folders', type=int, default=10_000)
+    seed_parser.add_argument('--pdfs', type=int, default=100_000)
+    seed_parser.add_argument('--conversations', type=int, default=50_000)
+    seed_parser.add_argument('--messages', type=int, default=1_000_000)
+    seed_parser.add_argument('--pdf-chars', type=int, default=4000, help='caracteres de texto por PDF')
+    seed_parser.add_argument('--message-chars', type=int, default=300)
+    seed_parser.add_argument('--skew', type=float, default=1.0,
+                             help='exponente de Zipf del reparto entre usuarios (0 = uniforme)')
+    seed_parser.add_argument('--seed', type=int, default=0)
+    seed_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    check_parser = commands.add_parser('check', help='mide los endpoints y valida los planes')
+    check_parser.add_argument('--repeat', type=int, default=20, help='peticiones medidas por endpoint')
+    check_parser.add_argument('-k', dest='keyword', help='solo endpoints cuyo nombre contiene este texto')
+    check_parser.add_argument('--min-rows', type=int, default=DEFAULT_MIN_ROWS,
+                              help='filas a partir de las que recorrer la tabla entera es un fallo')
+    check_parser.add_argument('--max-ms', type=float, help='falla si el p95 de algún endpoint lo supera')
+    check_parser.add_argument('--json', metavar='PATH', help='guarda el informe (con los planes) en JSON')
+    check_parser.add_argument('-v', '--verbose', action='store_true', help='muestra cada sentencia con su plan')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('indica --database-url o DATABASE_URL')
+
+    if args.command == 'seed':
+        _prepare_environment(args.database_url)
+        started = time.perf_counter()
+        inserted = seed(
+            users=args.users, folders=args.folders, pdfs=args.pdfs, conversations=args.conversations,
+            messages=args.messages, pdf_chars=args.pdf_chars, message_chars=args.message_chars,
+            skew=args.skew, seed_value=args.seed, batch_size=args.batch_size,
+        )
+        print(f"[Scale] {sum(inserted.values())} filas en {time.perf_counter() - started:.1f} s")
+        return 0
+
+    stub = LLMStub(latency=0.0).start()
+    try:
+        _prepare_environment(args.database_url, llm_base_url=stub.base_url)
+        report = check(repeat=args.repeat, keyword=args.keyword, min_rows=args.min_rows,
+                       max_ms=args.max_ms, verbose=args.verbose)
+    finally:
+        stub.stop()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print("OK" if report['ok'] else "FALLO: planes sin índice, errores o latencia por encima del límite")
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+"""Escenarios de uso contra la app real (gunicorn) sin salir de la máquina.
+
+Levanta los stubs de OpenAI/Gemini (loadtest/stubs.py) y un Drive falso
+sobre un árbol local con PDFs sintéticos (loadtest/fake_drive.py), arranca
+gunicorn apuntando a ellos y lanza N usuarios virtuales. Cada usuario entra
+con su refresh token (POST /api/auth/refresh), importa su carpeta de Drive y
+durante --duration segundos repite una mezcla ponderada de:
+
+    chat     POST /api/conversations/<id>/messages con la carpeta seleccionada
+    search   POST /api/folders/<id>/search
+    upload   POST /api/folders/<id>/pdfs (la carpeta está vinculada: sube a Drive)
+    import   POST /api/drive/import-folder (resincronización)
+    list     GET  /api/folders
+
+Al terminar muestra throughput y percentiles de latencia por escenario, y
+las llamadas que recibieron los stubs.
+
+    python -m loadtest.scenarios --users 20 --duration 60
+    python -m loadtest.scenarios --provider gemini --llm-latency 2 --llm-error-rate 0.05
+    python -m loadtest.scenarios --mix chat=1 --drive-latency 0.2 --json resultados.json
+
+El comando termina con código 1 (FALLO) si algún usuario no llega a
+prepararse (login, importación inicial y conversación) o si la fracción de
+peticiones fallidas supera --max-error-rate (por defecto 1 %). Cuenta como
+fallo cualquier código inesperado (incluidos los 503 reintentables) o error
+de red. Con los valores por defecto la ejecución debe terminar en OK.
+
+Los stubs responden en streaming solo cuando el cliente lo pide; con la app
+actual (sin streaming) --llm-stream-chunks y --llm-chunk-delay no influyen.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.synthetic import VOCABULARY, make_pdf
+from loadtest.common import ROOT, free_port, percentile, wait_ready
+from loadtest.fake_drive import FakeDrive
+from loadtest.stubs import LLMStub
+
+DEFAULT_MIX = 'chat=4,search=3,list=3,upload=1,import=1'
+SCENARIOS = ('chat', 'search', 'upload', 'import', 'list')
+# Credenciales de Drive sembradas: el Drive falso no las valida, pero google-auth
+# exige refresh_token/client_id/client_secret y una expiración futura
+FAKE_DRIVE_CREDENTIALS = {
+    'token': 'loadtest',
+    'refresh_token': 'loadtest',
+    'client_id': 'loadtest',
+    'client_secret': 'loadtest',
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'expiry': '2099-01-01T00:00:00Z',
+}
+
+
+def parse_mix(text):
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"escenario desconocido: {name} (válidos: {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def _build_drive_tree(root, users, pdfs_per_folder, pages):
+    """Carpeta 'Carga <i>' por usuario con PDFs y una subcarpeta."""
+    for i in range(users):
+        folder = os.path.join(root, f"Carga {i}")
+        os.makedirs(os.path.join(folder, 'Anexos'))
+        for j in range(pdfs_per_folder):
+            target = folder if j % 4 else os.path.join(folder, 'Anexos')
+            make_pdf(os.path.join(target, f"documento-{j}.pdf"), pages=pages, words_per_page=300, seed=i * 1000 + j)
+
+
+def _seed(env, users):
+    """Crea los usuarios con credenciales de Drive; devuelve sus refresh tokens."""
+    code = (
+        "import json\n"
+        "from src.main import app\n"
+        "from src.models.user import db, User\n"
+        "from src.routes.auth import _issue_tokens\n"
+        "with app.test_request_context():\n"
+        "    tokens = []\n"
+        f"    for i in range({users}):\n"
+        "        u = User(google_id=f'loadtest-{i}', username=f'loadtest{i}', email=f'loadtest{i}@example.com')\n"
+        f"        u.set_drive_credentials({FAKE_DRIVE_CREDENTIALS!r})\n"
+        "        db.session.add(u); db.session.commit()\n"
+        "        tokens.append(_issue_tokens(u)['refresh_token'])\n"
+        "    print(json.dumps(tokens))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout.strip().splitlines()
+    return json.loads(out[-1])
+
+
+class Recorder:
+    """Latencias y errores por escenario (thread-safe)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def call(self, scenario, method, url, expected, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            with self._lock:
+                self.errors[scenario][type(e).__name__] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if response.status_code in expected:
+                self.latencies[scenario].append(elapsed)
+            else:
+                self.errors[scenario][response.status_code] += 1
+        return response if response.status_code in expected else None
+
+
+class VirtualUser:
+    def __init__(self, index, base_url, refresh_token, drive_folder_id, recorder, upload_bytes, timeout):
+        self.index = index
+        self.base_url = base_url
+        self.refresh_token = refresh_token
+        self.drive_folder_id = drive_folder_id
+        self.recorder = recorder
+        self.upload_bytes = upload_bytes
+        self.timeout = timeout
+        self.random = random.Random(index)
+        self.headers = {}
+        self.folder_id = None
+        self.conversation_id = None
+        self.phase = 'setup.'
+
+    def _call(self, scenario, method, path, expected=(200,), **kwargs):
+        kwargs.setdefault('headers', self.headers)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.recorder.call(self.phase + scenario, method, f"{self.base_url}{path}", expected, **kwargs)
+
+    def login(self):
+        response = self._call('login', 'POST', '/api/auth/refresh', json={'refresh_token': self.refresh_token})
+        if response is None:
+            return False
+        tokens = response.json()
+        self.refresh_token = tokens['refresh_token']
+        self.headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+        return True
+
+    def import_folder(self):
+        # 202: quedan archivos pendientes; se repite hasta completar
+        for _ in range(20):
+            response = self._call('import', 'POST', '/api/drive/import-folder', expected=(200, 202),
+                                  json={'drive_folder_id': self.drive_folder_id})
+            if response is None:
+                return False
+            self.folder_id = response.json()['id']
+            if response.status_code == 200:
+                return True
+        return False
+
+    def setup(self):
+        if not self.login() or not self.import_folder():
+            return False
+        response = self._call('conversation', 'POST', '/api/conversations', expected=(201,),
+                              json={'title': f"Carga {self.index}"})
+        if response is None:
+            return False
+        self.conversation_id = response.json()['id']
+        return True
+
+    def chat(self):
+        word = self.random.choice(VOCABULARY)
+        self._call('chat', 'POST', f"/api/conversations/{self.conversation_id}/messages", expected=(201,),
+                   json={'content': f"¿Qué dicen los documentos sobre {word}?", 'folder_ids': [self.folder_id]})
+
+    def search(self):
+        self._call('search', 'POST', f"/api/folders/{self.folder_id}/search",
+                   json={'query': self.random.choice(VOCABULARY)})
+
+    def upload(self):
+        name = f"subida-{self.index}-{self.random.getrandbits(32):08x}.pdf"
+        self._call('upload', 'POST', f"/api/folders/{self.folder_id}/pdfs", expected=(201,),
+                   files={'file': (name, self.upload_bytes, 'application/pdf')})
+
+    def resync(self):
+        self.import_folder()
+
+    def list(self):
+        self._call('list', 'GET', '/api/folders')
+
+    def run(self, mix, deadline, think):
+        self.phase = ''
+        actions = {'chat': self.chat, 'search': self.search, 'upload': self.upload,
+                   'import': self.resync, 'list': self.list}
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        while time.perf_counter() < deadline:
+            actions[self.random.choices(names, weights)[0]]()
+            if think:
+                time.sleep(self.random.uniform(0, 2 * think))
+
+
+def _summary(recorder, elapsed, setup_elapsed):
+    def ms(v):
+        return None if v is None else round(v * 1000, 1)
+
+    rows = {}
+    for scenario in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = recorder.latencies.get(scenario, [])
+        errors = recorder.errors.get(scenario, Counter())
+        seconds = setup_elapsed if scenario.startswith('setup.') else elapsed
+        rows[scenario] = {
+            'ok': len(values),
+            'errors': sum(errors.values()),
+            'error_kinds': {str(k): v for k, v in errors.items()},
+            'rps': round(len(values) / seconds, 2) if seconds else None,
+            'p50_ms': ms(percentile(values, 50)),
+            'p90_ms': ms(percentile(values, 90)),
+            'p95_ms': ms(percentile(values, 95)),
+            'p99_ms': ms(percentile(values, 99)),
+            'max_ms': ms(max(values) if values else None),
+        }
+    return rows
+
+
+def run(users=10, duration=30.0, mix=None, provider='openai', workers=3, worker_class='gevent',
+        llm_latency=1.0, llm_jitter=0.0, llm_error_rate=0.0, llm_stream_chunks=8, llm_chunk_delay=0.0,
+        drive_latency=0.0, drive_jitter=0.0, drive_error_rate=0.0, drive_pdfs=8, pdf_pages=3, think=0.0,
+        timeout=120.0):
+    mix = mix or parse_mix(DEFAULT_MIX)
+    tmp = tempfile.mkdtemp(prefix='loadtest-')
+    drive_root = os.path.join(tmp, 'drive')
+    _build_drive_tree(drive_root, users, drive_pdfs, pdf_pages)
+    upload_path = make_pdf(os.path.join(tmp, 'upload.pdf'), pages=pdf_pages, words_per_page=300, seed=7)
+    with open(upload_path, 'rb') as f:
+        upload_bytes = f.read()
+
+    stub = LLMStub(latency=llm_latency, jitter=llm_jitter, error_rate=llm_error_rate,
+                   stream_chunks=llm_stream_chunks, chunk_delay=llm_chunk_delay).start()
+    drive = FakeDrive(drive_root, latency=drive_latency, jitter=drive_jitter, error_rate=drive_error_rate).start()
+    drive_folders = {drive.tree.metadata(fid)['name']: fid for fid in drive.tree.children('root')}
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'app.db')}",
+        SECRET_KEY='loadtest',
+        AI_PROVIDER=provider,
+        OPENAI_API_KEY='stub',
+        OPENAI_API_BASE=stub.base_url,
+        GEMINI_API_KEY='stub',
+        GEMINI_API_BASE=stub.gemini_base_url,
+        DRIVE_DISCOVERY_URL=drive.discovery_url,
+        UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+        UPLOAD_GC_INTERVAL_SECONDS='0',
+        DRIVE_QUOTA_DB=os.path.join(tmp, 'drive_quota.db'),
+    )
+    refresh_tokens = _seed(env, users)
+
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'src.main:app',
+        '--workers', str(workers), '--worker-class', worker_class,
+        '--timeout', '120', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    recorder = Recorder()
+    try:
+        wait_ready(base_url)
+        virtual_users = [
+            VirtualUser(i, base_url, refresh_tokens[i], drive_folders[f"Carga {i}"], recorder, upload_bytes, timeout)
+            for i in range(users)
+        ]
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            # Preparación (login, importación inicial, conversación) fuera del tiempo medido
+            setup_started = time.perf_counter()
+            ready = [user for user, ok in zip(virtual_users, pool.map(VirtualUser.setup, virtual_users)) if ok]
+            setup_elapsed = time.perf_counter() - setup_started
+            started = time.perf_counter()
+            deadline = started + duration
+            for future in [pool.submit(user.run, mix, deadline, think) for user in ready]:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stub.stop()
+        drive.stop()
+
+    scenarios = _summary(recorder, elapsed, setup_elapsed)
+    measured = [row for name, row in scenarios.items() if not name.startswith('setup.')]
+    ok = sum(row['ok'] for row in measured)
+    errors = sum(row['errors'] for row in measured)
+    setup_errors = sum(row['errors'] for name, row in scenarios.items() if name.startswith('setup.'))
+    return {
+        'config': {
+            'users': users, 'duration_s': duration, 'mix': mix, 'provider': provider,
+            'workers': workers, 'worker_class': worker_class,
+            'llm_latency_s': llm_latency, 'llm_jitter_s': llm_jitter, 'llm_error_rate': llm_error_rate,
+            'drive_latency_s': drive_latency, 'drive_error_rate': drive_error_rate,
+            'drive_pdfs_per_folder': drive_pdfs, 'pdf_pages': pdf_pages,
+        },
+        'users_ready': len(ready),
+        'setup_s': round(setup_elapsed, 2),
+        'setup_errors': setup_errors,
+        'elapsed_s': round(elapsed, 2),
+        'requests_ok': ok,
+        'requests_failed': errors,
+        'throughput_rps': round(ok / elapsed, 2) if elapsed else None,
+        'error_rate': round(errors / (ok + errors), 4) if ok + errors else 0.0,
+        'scenarios': scenarios,
+        'llm_stub': stub.stats(),
+        'fake_drive': drive.stats(),
+    }
+
+
+def _print_report(result):
+    print(f"{result['users_ready']}/{result['config']['users']} usuarios preparados en {result['setup_s']} s "
+          f"({result['setup_errors']} errores)")
+    print(f"{result['requests_ok']} peticiones correctas, {result['requests_failed']} fallidas "
+          f"en {result['elapsed_s']} s ({result['throughput_rps']} req/s)\n")
+    header = f"{'escenario':<20}{'ok':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"
+    print(header)
+    for name, row in result['scenarios'].items():
+        cells = [row[k] if row[k] is not None else '-' for k in ('rps', 'p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        print(f"{name:<20}{row['ok']:>7}{row['errors']:>6}" + ''.join(f"{c:>9}" for c in cells)
+              + (f"  {row['error_kinds']}" if row['errors'] else ''))
+    print(f"\nStub LLM:   {result['llm_stub']}")
+    print(f"Drive falso: {result['fake_drive']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30.0, help='segundos de carga tras la preparación')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"pesos por escenario (por defecto {DEFAULT_MIX})")
+    parser.add_argument('--think', type=float, default=0.0, help='pausa media entre acciones de un usuario (s)')
+    parser.add_argument('--provider', choices=('openai', 'gemini'), default='openai')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--llm-jitter', type=float, default=0.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-stream-chunks', type=int, default=8)
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.0)
+    parser.add_argument('--drive-latency', type=float, default=0.0)
+    parser.add_argument('--drive-jitter', type=float, default=0.0)
+    parser.add_argument('--drive-error-rate', type=float, default=0.0)
+    parser.add_argument('--drive-pdfs', type=int, default=8, help='PDFs por carpeta de Drive de cada usuario')
+    parser.add_argument('--pdf-pages', type=int, default=3)
+    parser.add_argument('--json', metavar='PATH', help='guarda el resultado completo en JSON')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Falla (exit 1) si la fracción de peticiones fallidas lo supera')
+    args = parser.parse_args()
+
+    result = run(
+        users=args.users, duration=args.duration, mix=args.mix, provider=args.provider,
+        workers=args.workers, worker_class=args.worker_class,
+        llm_latency=args.llm_latency, llm_jitter=args.llm_jitter, llm_error_rate=args.llm_error_rate,
+        llm_stream_chunks=args.llm_stream_chunks, llm_chunk_delay=args.llm_chunk_delay,
+        drive_latency=args.drive_latency, drive_jitter=args.drive_jitter, drive_error_rate=args.drive_error_rate,
+        drive_pdfs=args.drive_pdfs, pdf_pages=args.pdf_pages, think=args.think,
+    )
+    _print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    ok = (
+        result['users_ready'] == args.users
+        and result['requests_ok'] > 0
+        and result['error_rate'] <= args.max_error_rate
+    )
+    if ok:
+        print("OK")
+    elif result['users_ready'] != args.users:
+        print(f"FALLO: solo {result['users_ready']}/{args.users} usuarios completaron la preparación")
+    elif result['requests_ok'] == 0:
+        print("FALLO: ninguna petición correcta")
+    else:
+        print(f"FALLO: tasa de error {result['error_rate']:.2%} > --max-error-rate {args.max_error_rate:.2%}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
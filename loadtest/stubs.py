@@ -0,0 +1,247 @@
+"""Servidores HTTP locales que imitan a los proveedores externos.
+
+LLMStub responde con el formato de OpenAI (/v1/chat/completions) y de Gemini
+(/<versión>/models/<modelo>:generateContent, :streamGenerateContent y
+/<versión>/cachedContents) tras una latencia configurable, para probar la app
+sin llamar a las APIs reales:
+
+- latency + jitter: espera antes de la respuesta (o del primer fragmento).
+- error_rate: fracción de peticiones que fallan con error_status.
+- streaming: si el cliente lo pide ("stream": true en OpenAI o
+  :streamGenerateContent?alt=sse en Gemini) la respuesta llega en
+  stream_chunks eventos SSE separados por chunk_delay.
+
+El Drive falso está en loadtest/fake_drive.py.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+GEMINI_PATH = re.compile(r'^/(?P<version>v1(?:beta)?)/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)$')
+GEMINI_CACHE_PATH = re.compile(r'^/(?P<version>v1(?:beta)?)/cachedContents$')
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events):
+        """Eventos SSE ("data: ..."); la conexión se cierra al terminar."""
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for i, event in enumerate(events):
+            if i and stub.chunk_delay:
+                time.sleep(stub.chunk_delay)
+            data = event if isinstance(event, str) else json.dumps(event)
+            self.wfile.write(f"data: {data}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        if path.endswith('/chat/completions'):
+            endpoint = 'openai'
+        elif GEMINI_PATH.match(path):
+            endpoint = 'gemini'
+        elif GEMINI_CACHE_PATH.match(path):
+            endpoint = 'gemini_cache'
+        else:
+            endpoint = 'unknown'
+        stub.record_request(endpoint)
+        time.sleep(stub.delay())
+        if endpoint == 'unknown':
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        if stub.should_fail():
+            stub.record_error(endpoint)
+            self._send_json(stub.error_status, {'error': {
+                'code': stub.error_status, 'message': 'Error inyectado por el stub', 'status': 'UNAVAILABLE',
+            }})
+            return
+        if endpoint == 'openai':
+            self._openai(request)
+        elif endpoint == 'gemini':
+            self._gemini(request, GEMINI_PATH.match(path))
+        else:
+            self._gemini_cache(request)
+
+    # ---- OpenAI --------------------------------------------------------------
+
+    def _openai(self, request):
+        stub = self.server.stub
+        prompt_chars = sum(len(m.get('content') or '') for m in request.get('messages', []))
+        answer = stub.answer(prompt_chars)
+        usage = {'prompt_tokens': prompt_chars // 4, 'completion_tokens': len(answer) // 4}
+        if not request.get('stream'):
+            self._send_json(200, {
+                'id': 'stub',
+                'object': 'chat.completion',
+                'model': request.get('model'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': answer},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+            return
+        events = [
+            {'id': 'stub', 'object': 'chat.completion.chunk', 'model': request.get('model'),
+             'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+            for piece in stub.chunks(answer)
+        ]
+        events.append({'id': 'stub', 'object': 'chat.completion.chunk', 'model': request.get('model'),
+                       'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage})
+        events.append('[DONE]')
+        self._send_events(events)
+
+    # ---- Gemini --------------------------------------------------------------
+
+    def _gemini(self, request, match):
+        stub = self.server.stub
+        prompt_chars = sum(
+            len(part.get('text') or '')
+            for content in request.get('contents', [])
+            for part in content.get('parts', [])
+        )
+        cached_chars = stub.cached_chars(request.get('cachedContent'))
+        if request.get('cachedContent') and cached_chars is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'CachedContent not found', 'status': 'NOT_FOUND'}})
+            return
+        answer = stub.answer(prompt_chars + (cached_chars or 0))
+        usage = {
+            'promptTokenCount': (prompt_chars + (cached_chars or 0)) // 4,
+            'candidatesTokenCount': len(answer) // 4,
+        }
+        if cached_chars:
+            usage['cachedContentTokenCount'] = cached_chars // 4
+        if match.group('method') == 'generateContent':
+            self._send_json(200, {
+                'candidates': [{'content': {'role': 'model', 'parts': [{'text': answer}]}, 'finishReason': 'STOP'}],
+                'usageMetadata': usage,
+                'modelVersion': match.group('model'),
+            })
+            return
+        pieces = stub.chunks(answer)
+        self._send_events([
+            {'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]},
+                             **({'finishReason': 'STOP'} if i == len(pieces) - 1 else {})}],
+             **({'usageMetadata': usage} if i == len(pieces) - 1 else {})}
+            for i, piece in enumerate(pieces)
+        ])
+
+    def _gemini_cache(self, request):
+        chars = sum(
+            len(part.get('text') or '')
+            for content in request.get('contents', [])
+            for part in content.get('parts', [])
+        ) + sum(len(part.get('text') or '') for part in (request.get('systemInstruction') or {}).get('parts', []))
+        name = self.server.stub.store_cached_content(chars)
+        self._send_json(200, {'name': name, 'model': request.get('model'), 'usageMetadata': {'totalTokenCount': chars // 4}})
+
+
+class LLMStub:
+    """Stub compatible con OpenAI (base_url) y Gemini (gemini_base_url); port=0 elige uno libre."""
+
+    def __init__(self, latency=5.0, port=0, jitter=0.0, error_rate=0.0, error_status=503,
+                 stream_chunks=8, chunk_delay=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunks = max(1, stream_chunks)
+        self.chunk_delay = chunk_delay
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _LLMHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.requests = 0
+        self.by_endpoint = Counter()
+        self.errors = Counter()
+        self._cached = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    @property
+    def gemini_base_url(self):
+        """Para GEMINI_API_BASE (la app añade /v1beta o /v1)."""
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def record_request(self, endpoint='openai'):
+        with self._lock:
+            self.requests += 1
+            self.by_endpoint[endpoint] += 1
+
+    def record_error(self, endpoint):
+        with self._lock:
+            self.errors[endpoint] += 1
+
+    def delay(self):
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    @staticmethod
+    def answer(prompt_chars):
+        return f"Respuesta de prueba ({prompt_chars} caracteres)"
+
+    def chunks(self, text):
+        size = max(1, -(-len(text) // self.stream_chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def store_cached_content(self, chars):
+        name = f"cachedContents/stub-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._cached[name] = chars
+        return name
+
+    def cached_chars(self, name):
+        if not name:
+            return 0
+        with self._lock:
+            return self._cached.get(name)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'by_endpoint': dict(self.by_endpoint), 'errors': dict(self.errors)}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='llm-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,18 +1,138 @@
 import os
 import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from io import BytesIO
+from src.services.drive_rate_limiter import (
+    DriveUnavailableError,
+    MAX_RETRIES,
+    acquire,
+    is_retryable,
+    report_success,
+    report_throttled,
+)
+from src.services.metrics import observe_drive_call
+from src.services.tracing import KIND_CLIENT, bind, start_span
+
+# Drive admite hasta 100 llamadas por request batch
+BATCH_SIZE = 100
+# Subidas concurrentes máximas (las subidas con media no se pueden agrupar en batch)
+UPLOAD_CONCURRENCY = int(os.getenv('DRIVE_UPLOAD_CONCURRENCY', '4'))
+# Documento de descubrimiento alternativo (p. ej. el Drive falso de loadtest/):
+# todas las URLs del cliente, incluidas subidas y batch, salen de su rootUrl
+DISCOVERY_URL = os.getenv('DRIVE_DISCOVERY_URL', '').strip()
+_discovery_document = None
+
+def _custom_discovery_document():
+    global _discovery_document
+    if _discovery_document is None:
+        response = requests.get(DISCOVERY_URL, timeout=10)
+        response.raise_for_status()
+        _discovery_document = response.text
+    return _discovery_document
+
+def _build_service(creds_data):
+    creds = Credentials.from_authorized_user_info(creds_data)
+    if DISCOVERY_URL:
+        return build_from_document(_custom_discovery_document(), credentials=creds)
+    return build('drive', 'v3', credentials=creds)
 
 def get_drive_service(user):
     creds_data = user.get_drive_credentials()
     if not creds_data:
         raise Exception("El usuario no tiene credenciales de Google Drive - 99.")
-    creds = Credentials.from_authorized_user_info(creds_data)
-    service = build('drive', 'v3', credentials=creds)
-    return service
+    return _build_service(creds_data)
+
+def _method_name(fn):
+    """Nombre del método de la API para las métricas (p. ej. drive.files.list)."""
+    owner = getattr(fn, '__self__', None)
+    method_id = getattr(owner, 'methodId', None)
+    if method_id:
+        return method_id
+    if type(owner).__name__ == 'BatchHttpRequest':
+        return 'batch'
+    if type(owner).__name__ == 'MediaIoBaseDownload':
+        return 'drive.files.get_media'
+    return getattr(fn, '__name__', 'other')
+
+def _call(user_key, fn, tokens=1):
+    """Ejecuta fn() pasando por el limitador compartido.
+    Reintenta con backoff adaptativo los errores de cuota/5xx y, si se agotan
+    los reintentos, lanza DriveUnavailableError (nunca un resultado vacío)."""
+    method = _method_name(fn)
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        waited = acquire(user_key, tokens)
+        started = time.perf_counter()
+        drive_span = start_span(f'drive {method}', KIND_CLIENT, **{
+            'drive.method': method, 'drive.calls': tokens, 'drive.attempt': attempt, 'drive.quota_wait_seconds': waited,
+        })
+        try:
+            result = fn()
+        except HttpError as error:
+            status = getattr(getattr(error, 'resp', None), 'status', None)
+            observe_drive_call(method, f"http_{status}", time.perf_counter() - started)
+            drive_span.set_attribute('http.status_code', status)
+            drive_span.record_error(error)
+            drive_span.end()
+            if not is_retryable(error):
+                raise
+            last_error = error
+            report_throttled(user_key)
+            continue
+        except Exception as error:
+            observe_drive_call(method, 'error', time.perf_counter() - started)
+            drive_span.record_error(error)
+            drive_span.end()
+            raise
+        observe_drive_call(method, 'ok', time.perf_counter() - started)
+        drive_span.end()
+        report_success(user_key)
+        return result
+    raise DriveUnavailableError(f"Google Drive no disponible: {last_error}", retry_after=30)
+
+def _execute(user_key, request):
+    return _call(user_key, request.execute)
+
+def _execute_batched(user_key, service, make_request, file_ids):
+    """Ejecuta make_request(file_id) para cada id usando BatchHttpRequest.
+    Devuelve {file_id: (respuesta, excepción)}. Las llamadas rechazadas por
+    cuota dentro del batch se reintentan en la siguiente ronda."""
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    pending = list(dict.fromkeys(fid for fid in file_ids if fid))
+    for _ in range(MAX_RETRIES + 1):
+        if not pending:
+            break
+        for i in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[i:i + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=callback)
+            for fid in chunk:
+                batch.add(make_request(fid), request_id=fid)
+            try:
+                _call(user_key, batch.execute, tokens=len(chunk))
+            except HttpError as error:
+                print(f"Error ejecutando batch de Drive: {error}")
+                for fid in chunk:
+                    results.setdefault(fid, (None, error))
+        throttled = [
+            fid for fid in pending
+            if isinstance(results.get(fid, (None, None))[1], HttpError) and is_retryable(results[fid][1])
+        ]
+        if throttled:
+            report_throttled(user_key)
+        pending = throttled
+    if pending:
+        raise DriveUnavailableError("Google Drive no disponible (batch)", retry_after=30)
+    return results
 
 def create_drive_folder(user, folder_name):
     service = get_drive_service(user)
@@ -21,7 +141,7 @@ def create_drive_folder(user, folder_name):
         'mimeType': 'application/vnd.google-apps.folder'
     }
     try:
-        folder = service.files().create(body=file_metadata, fields='id').execute()
+        folder = _execute(user.id, service.files().create(body=file_metadata, fields='id'))
         return folder.get('id')
     except HttpError as error:
         print(f"Error al crear carpeta en Drive: {error}")
@@ -30,7 +150,7 @@ def create_drive_folder(user, folder_name):
 def delete_drive_folder(user, folder_id):
     service = get_drive_service(user)
     try:
-        service.files().delete(fileId=folder_id).execute()
+        _execute(user.id, service.files().delete(fileId=folder_id))
         return True
     except HttpError as error:
         print(f"Error al eliminar carpeta en Drive: {error}")
@@ -44,21 +164,62 @@ def upload_file_to_drive(user, folder_id, file_path, filename=None):
     }
     media = MediaFileUpload(file_path, resumable=True)
     try:
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        file = _execute(user.id, service.files().create(body=file_metadata, media_body=media, fields='id'))
         return file.get('id')
     except HttpError as error:
         print(f"Error al subir archivo a Drive: {error}")
         return None
 
+def upload_files_to_drive(user, folder_id, files, max_workers=None):
+    """Sube varios archivos en paralelo con concurrencia acotada.
+    files: lista de (file_path, filename). Devuelve {file_path: drive_id o None}."""
+    if not files:
+        return {}
+    creds_data = user.get_drive_credentials()
+    if not creds_data:
+        raise Exception("El usuario no tiene credenciales de Google Drive - 99.")
+    user_key = user.id
+
+    def upload_one(entry):
+        file_path, filename = entry
+        # httplib2 no es thread-safe: un servicio por subida
+        service = _build_service(creds_data)
+        file_metadata = {
+            'name': filename if filename else os.path.basename(file_path),
+            'parents': [folder_id]
+        }
+        try:
+            media = MediaFileUpload(file_path, resumable=True)
+            file = _execute(user_key, service.files().create(body=file_metadata, media_body=media, fields='id'))
+            return file_path, file.get('id')
+        except (HttpError, OSError, DriveUnavailableError) as error:
+            print(f"Error al subir archivo a Drive: {error}")
+            return file_path, None
+
+    workers = max(1, min(max_workers or UPLOAD_CONCURRENCY, len(files)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(bind(upload_one), files))
+
 def delete_drive_file(user, file_id):
     service = get_drive_service(user)
     try:
-        service.files().delete(fileId=file_id).execute()
+        _execute(user.id, service.files().delete(fileId=file_id))
         return True
     except HttpError as error:
         print(f"Error al eliminar archivo en Drive: {error}")
         return False
 
+def delete_drive_files(user, file_ids):
+    """Elimina varios archivos con requests batch. Devuelve {file_id: bool}."""
+    service = get_drive_service(user)
+    results = _execute_batched(user.id, service, lambda fid: service.files().delete(fileId=fid), file_ids)
+    out = {}
+    for fid, (_, exception) in results.items():
+        if exception is not None:
+            print(f"Error al eliminar archivo en Drive ({fid}): {exception}")
+        out[fid] = exception is None
+    return out
+
 def list_drive_folders(user, parent_id=None, query_text=None, page_size=100, order_by: str = "modifiedTime desc"):
     """Lista carpetas de Drive del usuario. Si parent_id es None, usa 'root'.
     - parent_id='any' habilita búsqueda global (sin restricción de padre).
@@ -86,14 +247,14 @@ def list_drive_folders(user, parent_id=None, query_text=None, page_size=100, ord
             remaining = None if page_size == -1 else max(0, int(page_size))
             while True:
                 req_size = 200 if remaining is None else max(1, min(remaining, 200))
-                resp = service.files().list(
+                resp = _execute(user.id, service.files().list(
                     q=q,
                     spaces='drive',
                     fields="nextPageToken, files(id, name, modifiedTime)",
                     pageSize=req_size,
                     orderBy=order_by,
                     pageToken=page_token,
-                ).execute()
+                ))
                 batch = resp.get('files', [])
                 items.extend(batch)
                 page_token = resp.get('nextPageToken')
@@ -139,14 +300,14 @@ def list_drive_folders(user, parent_id=None, query_text=None, page_size=100, ord
             page_token = None
             while True:
                 req_size = 200 if remaining is None else max(1, min(remaining, 200))
-                resp = service.files().list(
+                resp = _execute(user.id, service.files().list(
                     q=q,
                     spaces='drive',
                     fields="nextPageToken, files(id, name, modifiedTime)",
                     pageSize=req_size,
                     orderBy=order_by,
                     pageToken=page_token,
-                ).execute()
+                ))
                 for f in resp.get('files', []):
                     fid = f.get('id')
                     if fid and fid not in combined:
@@ -185,7 +346,7 @@ def list_pdfs_in_folder(user, folder_id, page_size=200):
     service = get_drive_service(user)
     q = f"'{folder_id}' in parents and mimeType = 'application/pdf' and trashed = false"
     try:
-        results = service.files().list(q=q, spaces='drive', fields="files(id, name, mimeType, size)", pageSize=page_size).execute()
+        results = _execute(user.id, service.files().list(q=q, spaces='drive', fields="files(id, name, mimeType, size, md5Checksum)", pageSize=page_size))
         return results.get('files', [])
     except HttpError as error:
         print(f"Error listando PDFs en carpeta de Drive: {error}")
@@ -194,7 +355,8 @@ def list_pdfs_in_folder(user, folder_id, page_size=200):
 def list_pdfs_in_folder_recursive(user, folder_id, page_size=200):
     """
     Lista todos los PDFs dentro de una carpeta de Drive y sus subcarpetas (recursivo).
-    Devuelve una lista de dicts con al menos: id, name, mimeType, size.
+    Devuelve una lista de dicts con al menos: id, name, mimeType, size, md5Checksum.
+    El listado es completo o lanza DriveUnavailableError, nunca parcial.
     """
     service = get_drive_service(user)
 
@@ -207,20 +369,21 @@ def list_pdfs_in_folder_recursive(user, folder_id, page_size=200):
         page_token = None
         while True:
             try:
-                resp = service.files().list(
+                resp = _execute(user.id, service.files().list(
                     q=q,
                     spaces='drive',
-                    fields="nextPageToken, files(id, name, mimeType, size)",
+                    fields="nextPageToken, files(id, name, mimeType, size, md5Checksum)",
                     pageSize=page_size,
                     pageToken=page_token,
-                ).execute()
+                ))
                 items.extend(resp.get('files', []))
                 page_token = resp.get('nextPageToken')
                 if not page_token:
                     break
             except HttpError as error:
+                # Un listado parcial haría que la sincronización borrase PDFs locales que sí existen
                 print(f"Error listando hijos en Drive: {error}")
-                break
+                raise DriveUnavailableError(f"No se pudo listar la carpeta de Drive: {error}", retry_after=30) from error
         return items
 
     all_pdfs = []
@@ -238,11 +401,22 @@ def list_pdfs_in_folder_recursive(user, folder_id, page_size=200):
 def get_file_metadata(user, file_id, fields="id, name, mimeType, size"):
     service = get_drive_service(user)
     try:
-        return service.files().get(fileId=file_id, fields=fields).execute()
+        return _execute(user.id, service.files().get(fileId=file_id, fields=fields))
     except HttpError as error:
         print(f"Error obteniendo metadatos del archivo Drive: {error}")
         return None
 
+def get_files_metadata(user, file_ids, fields="id, name, mimeType, size"):
+    """Metadatos de varios archivos con requests batch. Devuelve {file_id: dict o None}."""
+    service = get_drive_service(user)
+    results = _execute_batched(user.id, service, lambda fid: service.files().get(fileId=fid, fields=fields), file_ids)
+    out = {}
+    for fid, (response, exception) in results.items():
+        if exception is not None:
+            print(f"Error obteniendo metadatos del archivo Drive ({fid}): {exception}")
+        out[fid] = response if exception is None else None
+    return out
+
 def download_file_to_path(user, file_id, dest_path):
     """Descarga un archivo de Drive al path indicado."""
     service = get_drive_service(user)
@@ -252,7 +426,7 @@ def download_file_to_path(user, file_id, dest_path):
     done = False
     try:
         while not done:
-            status, done = downloader.next_chunk()
+            status, done = _call(user.id, downloader.next_chunk)
         with open(dest_path, 'wb') as f:
             f.write(fh.getvalue())
         return True
@@ -1,4 +1,5 @@
 import os
+import sqlite3
 import sys
 from dotenv import load_dotenv
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -10,17 +11,47 @@ load_dotenv()
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 # Importaciones después de configurar el path
-from flask import Flask, jsonify, send_from_directory, request, session
+from flask import Flask, jsonify, request, session, g
 from flask_cors import CORS
-from flask_session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from src.models.user import db
 from src.routes.user import user_bp
-from src.routes.auth import auth_bp
+from src.routes.auth import auth_bp, verify_access_token_cached
 from src.routes.folders import folders_bp
 from src.routes.pdfs import pdfs_bp
 from src.routes.chat import chat_bp
+from src.routes.admin import admin_bp
+from src.services.session_store import init_session_backend
+from src.services.static_assets import StaticManifest
+from src.services.compression import init_compression
+from src.services.json_provider import init_json_provider
+from src.services.metrics import init_metrics
+from src.services.tracing import init_tracing
+from src.services.query_audit import init_query_audit
+# Registra los listeners que versionan los datos de cada usuario (ETag de listados)
+import src.services.data_version  # noqa: F401
+# Indexado de embeddings al confirmar altas/bajas de PDFs
+import src.services.vector_index  # noqa: F401
 from authlib.integrations.flask_client import OAuth
-from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """WAL (lectores sin bloquear al escritor) y espera ante el lock en cada conexión SQLite."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        # En WAL, NORMAL solo arriesga la última transacción ante un corte de luz
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    finally:
+        cursor.close()
+
 
 def create_app():
     # Crear aplicación Flask
@@ -31,7 +62,8 @@ def create_app():
 
     # Configuración básica
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "clave-secreta-por-defecto-cambiar-en-produccion")
-    app.config["SESSION_TYPE"] = "filesystem"
+    # Backend de sesión: cookie (por defecto, sin estado), sqlite, memory o filesystem
+    app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "cookie")
     app.config["SESSION_PERMANENT"] = False
     app.config["SESSION_USE_SIGNER"] = True
     app.config["SESSION_COOKIE_SAMESITE"] = "None"
@@ -44,12 +76,29 @@ def create_app():
     
     # Configuración de la base de datos (usar src/database/app.db)
     DB_PATH = os.path.join(os.path.dirname(__file__), "database", "app.db")
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
+    # DATABASE_URL permite apuntar a otra base (pruebas de carga, datasets de escala)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # Con workers gevent y escritores en segundo plano (índice, resúmenes,
+        # caché de map-reduce) las escrituras concurrentes esperan al lock en
+        # lugar de fallar con "database is locked" (ver _configure_sqlite)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
 
     # Inicializar extensiones
     db.init_app(app)
-    Session(app)
+    init_session_backend(app)
+    # JSON rápido (orjson si está disponible) y compresión gzip/br de respuestas grandes
+    init_json_provider(app)
+    init_compression(app)
+    # Histogramas por ruta, DB, Drive, IA y extracción en /metrics
+    init_metrics(app)
+    # Trazas por petición (TRACING_EXPORTER=console|jsonl); sin efecto si está en off
+    init_tracing(app)
+    # Consultas lentas con su plan y N+1 por petición (por defecto solo en tests y debug; ver QUERY_AUDIT)
+    init_query_audit(app)
     # Configurar CORS (normalizando FRONTEND_URL para evitar slash final) y asegurar que los preflight incluyan headers
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173").rstrip("/")
     allowed_origins = [
@@ -66,7 +115,7 @@ def create_app():
                 "origins": allowed_origins,
                 "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
                 "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-                "expose_headers": ["Content-Type"],
+                "expose_headers": ["Content-Type", "X-Trace-Id"],
             }
         },
         vary_header=True,
@@ -94,6 +143,7 @@ def create_app():
     app.register_blueprint(folders_bp, url_prefix="/api")
     app.register_blueprint(pdfs_bp, url_prefix="/api")
     app.register_blueprint(chat_bp, url_prefix="/api")
+    app.register_blueprint(admin_bp, url_prefix="/api/admin")
     # Registrar Drive con import local seguro para evitar NameError en despliegue
     try:
         from src.routes.drive import drive_bp as _drive_bp
@@ -102,9 +152,6 @@ def create_app():
         print(f"[Init] Aviso: no se pudo registrar drive_bp: {e}")
 
     # ====== Autenticación por token (fallback móvil sin cookies) ======
-    SECRET_KEY = app.config["SECRET_KEY"]
-    _serializer = URLSafeTimedSerializer(SECRET_KEY, salt="auth-token")
-
     @app.before_request
     def bearer_token_auth():
         # Si ya hay sesión, no hacer nada
@@ -119,18 +166,15 @@ def create_app():
         token = auth.split(" ", 1)[1].strip()
         if not token:
             return None
-        try:
-            data = _serializer.loads(token, max_age=3600)
-        except (BadSignature, SignatureExpired):
+        data = verify_access_token_cached(token)
+        if not data:
             return None
-        # Poblar sesión para este request
+        # Identidad solo para este request (flask.g): no se crea ni se escribe sesión
         uid = data.get("user_id")
         if uid:
-            session["user_id"] = uid
-            if data.get("email"):
-                session["user_email"] = data.get("email")
-            if data.get("name"):
-                session["user_name"] = data.get("name")
+            g.user_id = uid
+            g.user_email = data.get("email")
+            g.user_name = data.get("name")
         return None
 
     # Middleware para manejar correctamente los encabezados detrás de un proxy
@@ -166,28 +210,86 @@ with app.app_context():
                 if 'last_drive_sync_at' not in folder_cols:
                     conn.execute(text("ALTER TABLE folder ADD COLUMN last_drive_sync_at DATETIME"))
                     print("[DB Migration] Columna last_drive_sync_at agregada a tabla folder")
+                # Columnas de la caché de descargas de Drive en las tablas de importación
+                result3 = conn.execute(text("PRAGMA table_info(drive_import_item)"))
+                if 'md5_checksum' not in [row[1] for row in result3]:
+                    conn.execute(text("ALTER TABLE drive_import_item ADD COLUMN md5_checksum VARCHAR(64)"))
+                    print("[DB Migration] Columna md5_checksum agregada a tabla drive_import_item")
+                result4 = conn.execute(text("PRAGMA table_info(drive_import_job)"))
+                if 'cache_hits' not in [row[1] for row in result4]:
+                    conn.execute(text("ALTER TABLE drive_import_job ADD COLUMN cache_hits INTEGER DEFAULT 0"))
+                    print("[DB Migration] Columna cache_hits agregada a tabla drive_import_job")
+                # Contador de versión por usuario para los ETag de listados
+                result5 = conn.execute(text("PRAGMA table_info(user)"))
+                if 'data_version' not in [row[1] for row in result5]:
+                    conn.execute(text("ALTER TABLE user ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+                    print("[DB Migration] Columna data_version agregada a tabla user")
+                # Resumen acumulado del historial de chat
+                result6 = conn.execute(text("PRAGMA table_info(conversation)"))
+                conversation_cols = [row[1] for row in result6]
+                if 'summary' not in conversation_cols:
+                    conn.execute(text("ALTER TABLE conversation ADD COLUMN summary TEXT"))
+                    print("[DB Migration] Columna summary agregada a tabla conversation")
+                if 'summary_message_id' not in conversation_cols:
+                    conn.execute(text("ALTER TABLE conversation ADD COLUMN summary_message_id INTEGER"))
+                    print("[DB Migration] Columna summary_message_id agregada a tabla conversation")
+                # Índice usado por el recolector de archivos huérfanos
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pdf_filename ON pdf (filename)"))
+                # Índices de los listados por usuario, carpeta y conversación (ver loadtest/scale.py)
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_folder_user_id ON folder (user_id)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pdf_folder_id ON pdf (folder_id)"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_conversation_user_id_updated_at ON conversation (user_id, updated_at)"
+                ))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_message_conversation_id_timestamp ON message (conversation_id, timestamp)"
+                ))
+                # Un solo job de importación en curso por carpeta: cerrar duplicados previos
+                conn.execute(text(
+                    "UPDATE drive_import_job SET status = 'completed' WHERE status = 'running' AND id NOT IN "
+                    "(SELECT MAX(id) FROM drive_import_job WHERE status = 'running' GROUP BY folder_id)"
+                ))
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_drive_import_job_running_folder "
+                    "ON drive_import_job (folder_id) WHERE status = 'running'"
+                ))
     except Exception as e:
         # Log but do not crash the app
         print(f"[DB Migration] Aviso: no se pudo actualizar la columna drive_file_id: {e}")
 
+# Manifiesto de estáticos construido una vez al arrancar (sin os.path.exists por request)
+static_manifest = StaticManifest(app.static_folder)
+
 # Ruta para servir archivos estáticos
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve(path):
-    static_folder = app.static_folder
-    if not static_folder:
+    if not app.static_folder:
         return jsonify({"error": "Static folder not configured"}), 500
 
-    if path != "" and os.path.exists(os.path.join(static_folder, path)):
-        return send_from_directory(static_folder, path)
+    if path != "":
+        response = static_manifest.respond(path)
+        if response is not None:
+            return response
 
-    index_path = os.path.join(static_folder, "index.html")
-    if os.path.exists(index_path):
-        return send_from_directory(static_folder, "index.html")
+    # SPA: cualquier otra ruta devuelve index.html
+    response = static_manifest.respond("index.html")
+    if response is not None:
+        return response
 
     return jsonify({"error": "Not found"}), 404
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.getenv("FLASK_ENV") != "production"
+    if debug:
+        # Servidor de desarrollo: log de consultas lentas y N+1 salvo QUERY_AUDIT=0
+        app.debug = True
+        init_query_audit(app)
+    # Migración al layout particionado de uploads y recolección periódica de
+    # huérfanos (con gunicorn la arranca post_worker_init en gunicorn.conf.py).
+    # Con el reloader solo en el proceso hijo, que es el que sirve.
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        from src.services.upload_storage import start_upload_gc
+        start_upload_gc(app)
     app.run(host="0.0.0.0", port=port, debug=debug)
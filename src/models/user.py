@@ -20,6 +20,10 @@ class User(db.Model):
     # Token de Google Drive (JSON serializado)
     google_drive_token = db.Column(db.Text)
 
+    # Se incrementa con cada escritura en sus carpetas, PDFs, conversaciones o
+    # mensajes (ver src/services/data_version.py); base de los ETag de listados
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     # Relaciones
     folders = db.relationship('Folder', backref='user', lazy=True, cascade='all, delete-orphan')
     conversations = db.relationship('Conversation', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -62,12 +66,13 @@ class Folder(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     drive_folder_id = db.Column(db.String(255))
     last_drive_sync_at = db.Column(db.DateTime, nullable=True)
 
-    pdfs = db.relationship('PDF', backref='folder', lazy=True, cascade='all, delete-orphan')
+    pdfs = db.relationship('PDF', backref='folder', lazy=True, cascade='all, delete-orphan', order_by='PDF.id')
+    import_jobs = db.relationship('DriveImportJob', backref='folder', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Folder {self.name}>'
@@ -83,6 +88,35 @@ class Folder(db.Model):
             'last_drive_sync_at': self.last_drive_sync_at.isoformat() if self.last_drive_sync_at else None,
         }
 
+    @staticmethod
+    def summaries_for_user(user_id):
+        """Mismo formato que to_dict() para todas las carpetas del usuario, con
+        una sola consulta de columnas + COUNT (sin cargar PDFs ni su contenido)."""
+        rows = (
+            db.session.query(
+                Folder.id, Folder.name, Folder.user_id, Folder.created_at,
+                Folder.drive_folder_id, Folder.last_drive_sync_at,
+                db.func.count(PDF.id),
+            )
+            .outerjoin(PDF, PDF.folder_id == Folder.id)
+            .filter(Folder.user_id == user_id)
+            .group_by(Folder.id)
+            .order_by(Folder.id)
+            .all()
+        )
+        return [
+            {
+                'id': fid,
+                'name': name,
+                'user_id': uid,
+                'created_at': created_at.isoformat() if created_at else None,
+                'pdf_count': pdf_count,
+                'drive_folder_id': drive_folder_id,
+                'last_drive_sync_at': last_sync.isoformat() if last_sync else None,
+            }
+            for fid, name, uid, created_at, drive_folder_id, last_sync, pdf_count in rows
+        ]
+
 
 # ===============================
 # MODELO PDF
@@ -91,11 +125,11 @@ class PDF(db.Model):
     __tablename__ = "pdf"
 
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(500), nullable=False)
+    filename = db.Column(db.String(500), nullable=False, index=True)
     original_filename = db.Column(db.String(500), nullable=False)
     file_path = db.Column(db.String(1000), nullable=False)
     content = db.Column(db.Text)
-    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), nullable=False)
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), nullable=False, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     file_size = db.Column(db.Integer)
     drive_file_id = db.Column(db.String(255))
@@ -120,34 +154,77 @@ class PDF(db.Model):
 # ===============================
 class Conversation(db.Model):
     __tablename__ = "conversation"
+    # Listado por usuario ordenado por updated_at sin recorrer la tabla
+    __table_args__ = (db.Index('ix_conversation_user_id_updated_at', 'user_id', 'updated_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(250), default='Nueva conversación')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Resumen acumulado de los mensajes con id <= summary_message_id
+    summary = db.Column(db.Text)
+    summary_message_id = db.Column(db.Integer)
 
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Conversation {self.title}>'
 
-    def to_dict(self):
+    def to_dict(self, message_count=None):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'message_count': len(self.messages)
+            'message_count': len(self.messages) if message_count is None else message_count
         }
 
+    @staticmethod
+    def summaries_for_user(user_id):
+        """Mismo formato que to_dict() para las conversaciones del usuario (más
+        recientes primero) con una consulta de columnas + COUNT de mensajes.
+
+        El COUNT va en subconsulta correlacionada y no en JOIN + GROUP BY: así
+        SQLite recorre ix_conversation_user_id_updated_at ya en orden en lugar
+        de la tabla entera (ver loadtest/scale.py check)."""
+        message_count = (
+            db.select(db.func.count(Message.id))
+            .where(Message.conversation_id == Conversation.id)
+            .correlate(Conversation)
+            .scalar_subquery()
+        )
+        rows = (
+            db.session.query(
+                Conversation.id, Conversation.user_id, Conversation.title,
+                Conversation.created_at, Conversation.updated_at,
+                message_count,
+            )
+            .filter(Conversation.user_id == user_id)
+            .order_by(Conversation.updated_at.desc())
+            .all()
+        )
+        return [
+            {
+                'id': cid,
+                'user_id': uid,
+                'title': title,
+                'created_at': created_at.isoformat() if created_at else None,
+                'updated_at': updated_at.isoformat() if updated_at else None,
+                'message_count': message_count,
+            }
+            for cid, uid, title, created_at, updated_at, message_count in rows
+        ]
+
 
 # ===============================
 # MODELO MENSAJE
 # ===============================
 class Message(db.Model):
     __tablename__ = "message"
+    # Mensajes de una conversación ya en el orden de dicts_for_conversation()
+    __table_args__ = (db.Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),)
 
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
@@ -168,3 +245,194 @@ class Message(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'folder_ids': self.folder_ids.split(',') if self.folder_ids else []
         }
+
+    @staticmethod
+    def dicts_for_conversation(conversation_id):
+        """Mensajes de la conversación como dicts de to_dict(), ordenados por
+        fecha en la DB y sin instanciar objetos ORM."""
+        rows = (
+            db.session.query(
+                Message.id, Message.conversation_id, Message.content,
+                Message.is_user, Message.timestamp, Message.folder_ids,
+            )
+            .filter(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp, Message.id)
+            .all()
+        )
+        return [
+            {
+                'id': mid,
+                'conversation_id': cid,
+                'content': content,
+                'is_user': is_user,
+                'timestamp': timestamp.isoformat() if timestamp else None,
+                'folder_ids': folder_ids.split(',') if folder_ids else [],
+            }
+            for mid, cid, content, is_user, timestamp, folder_ids in rows
+        ]
+
+
+# ===============================
+# MODELO REFRESH TOKEN (rotación)
+# ===============================
+class RefreshToken(db.Model):
+    __tablename__ = "refresh_token"
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    # Al rotar se revoca el anterior; reutilizar uno revocado revoca toda la familia
+    revoked_at = db.Column(db.DateTime, nullable=True)
+    replaced_by = db.Column(db.String(64), nullable=True)
+
+    def __repr__(self):
+        return f'<RefreshToken {self.jti}>'
+
+
+# ===============================
+# MODELO IMPORTACIÓN DRIVE (checkpoint)
+# ===============================
+class DriveImportJob(db.Model):
+    __tablename__ = "drive_import_job"
+    # Como mucho un job en curso por carpeta (índice único parcial)
+    __table_args__ = (
+        db.Index(
+            'uq_drive_import_job_running_folder', 'folder_id', unique=True,
+            sqlite_where=db.text("status = 'running'"),
+            postgresql_where=db.text("status = 'running'"),
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), nullable=False, index=True)
+    drive_folder_id = db.Column(db.String(255), nullable=False)
+    overwrite = db.Column(db.Boolean, default=True)
+    # running | completed
+    status = db.Column(db.String(20), default='running', nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Mientras lease_until esté en el futuro, otro worker está procesando el job
+    lease_until = db.Column(db.DateTime, nullable=True)
+
+    # Contadores de progreso y rendimiento
+    total_files = db.Column(db.Integer, default=0)
+    deleted_count = db.Column(db.Integer, default=0)
+    pushed_count = db.Column(db.Integer, default=0)
+    imported_count = db.Column(db.Integer, default=0)
+    updated_count = db.Column(db.Integer, default=0)
+    bytes_downloaded = db.Column(db.BigInteger, default=0)
+    cache_hits = db.Column(db.Integer, default=0)
+    active_seconds = db.Column(db.Float, default=0.0)
+
+    items = db.relationship('DriveImportItem', backref='job', lazy=True, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<DriveImportJob {self.id} {self.status}>'
+
+    def to_dict(self):
+        counts = dict(
+            db.session.query(DriveImportItem.status, db.func.count(DriveImportItem.id))
+            .filter(DriveImportItem.job_id == self.id)
+            .group_by(DriveImportItem.status)
+            .all()
+        )
+        active = self.active_seconds or 0.0
+        processed = counts.get('committed', 0) + counts.get('failed', 0)
+        return {
+            'id': self.id,
+            'folder_id': self.folder_id,
+            'drive_folder_id': self.drive_folder_id,
+            'status': self.status,
+            'overwrite': bool(self.overwrite),
+            'total_files': self.total_files or 0,
+            'pending': counts.get('pending', 0),
+            'downloaded': counts.get('downloaded', 0),
+            'extracted': counts.get('extracted', 0),
+            'committed': counts.get('committed', 0),
+            'failed': counts.get('failed', 0),
+            'deleted_count': self.deleted_count or 0,
+            'pushed_count': self.pushed_count or 0,
+            'imported_count': self.imported_count or 0,
+            'updated_count': self.updated_count or 0,
+            'bytes_downloaded': self.bytes_downloaded or 0,
+            'cache_hits': self.cache_hits or 0,
+            'active_seconds': round(active, 3),
+            'files_per_second': round(processed / active, 3) if active > 0 else None,
+            'bytes_per_second': round((self.bytes_downloaded or 0) / active, 1) if active > 0 else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class DriveImportItem(db.Model):
+    __tablename__ = "drive_import_item"
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('drive_import_job.id'), nullable=False, index=True)
+    drive_file_id = db.Column(db.String(255), nullable=False)
+    md5_checksum = db.Column(db.String(64))
+    original_filename = db.Column(db.String(500), nullable=False)
+    filename = db.Column(db.String(500), nullable=False)
+    file_path = db.Column(db.String(1000), nullable=False)
+    # pending -> downloaded -> extracted -> committed (o failed)
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    # Texto extraído pendiente de volcar al PDF (se limpia al confirmar)
+    content = db.Column(db.Text)
+    file_size = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DriveImportItem {self.drive_file_id} {self.status}>'
+
+
+# ===============================
+# MODELO CACHÉ DE DESCARGAS DRIVE
+# ===============================
+class DriveFileCache(db.Model):
+    """Blob descargado y texto extraído de un archivo de Drive, compartido entre usuarios.
+
+    Solo se entrega a quien ve el mismo (drive_file_id, md5Checksum) en su propio
+    listado de Drive, es decir, a quien ya demostró acceso con sus credenciales.
+    """
+    __tablename__ = "drive_file_cache"
+    __table_args__ = (db.UniqueConstraint('drive_file_id', 'md5_checksum', name='uq_drive_file_cache_version'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    drive_file_id = db.Column(db.String(255), nullable=False)
+    md5_checksum = db.Column(db.String(64), nullable=False)
+    blob_path = db.Column(db.String(1000), nullable=False)
+    content = db.Column(db.Text)
+    file_size = db.Column(db.Integer)
+    hits = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DriveFileCache {self.drive_file_id} {self.md5_checksum}>'
+
+
+# ===============================
+# MODELO CACHÉ DE RESPUESTAS PARCIALES (MAP-REDUCE)
+# ===============================
+class PartialAnswerCache(db.Model):
+    """Respuesta de la fase map para (pregunta, modelo, grupo de documentos).
+
+    La clave incluye id y hash del contenido de cada PDF del grupo, así que
+    cambiar o reemplazar un documento invalida solo los grupos que lo contienen.
+    """
+    __tablename__ = "partial_answer_cache"
+
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    # '' = el grupo no tenía información relevante (también se cachea)
+    answer = db.Column(db.Text, nullable=False, default='')
+    hits = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PartialAnswerCache {self.cache_key[:12]}>'
@@ -0,0 +1,119 @@
+from flask import Blueprint, current_app, jsonify, request, send_file
+from flask_cors import cross_origin
+from src.models.user import User
+from src.routes.auth import current_user_id
+from src.services import profiling
+import os
+
+admin_bp = Blueprint('admin', __name__)
+
+# Correos (separados por comas) con acceso a las herramientas de administración
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+def require_admin():
+    """401 sin sesión, 403 si el usuario no está en ADMIN_EMAILS"""
+    user_id = current_user_id()
+    if not user_id:
+        return jsonify({'error': 'No autenticado'}), 401
+    user = User.query.get(user_id)
+    if not user or not user.email or user.email.lower() not in ADMIN_EMAILS:
+        return jsonify({'error': 'Acceso restringido a administradores'}), 403
+    return None
+
+@admin_bp.route('/profile', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def profile_status():
+    """Estado del perfil en este worker y volcados disponibles"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    status = profiling.request_profiler.status()
+    status['dumps'] = profiling.list_profiles()
+    return jsonify(status)
+
+@admin_bp.route('/profile', methods=['POST'])
+@cross_origin(supports_credentials=True)
+def start_profile():
+    """Arma el perfil para las próximas N peticiones de este worker.
+
+    Body: {"mode": "sample"|"cprofile", "requests": 20, "interval_ms": 5, "path_prefix": "/api/"}
+    """
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    data = request.json or {}
+    try:
+        status = profiling.request_profiler.arm(
+            current_app._get_current_object(),
+            mode=data.get('mode', 'sample'),
+            requests=data.get('requests', profiling.DEFAULT_REQUESTS),
+            interval_ms=data.get('interval_ms', profiling.DEFAULT_INTERVAL_MS),
+            path_prefix=data.get('path_prefix'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'status': profiling.request_profiler.status()}), 409
+    return jsonify(status), 201
+
+@admin_bp.route('/profile', methods=['DELETE'])
+@cross_origin(supports_credentials=True)
+def stop_profile():
+    """Termina el perfil en curso antes de llegar a N peticiones"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    result = profiling.request_profiler.disarm()
+    if result is None:
+        return jsonify({'error': 'No hay un perfil en curso en este worker'}), 404
+    return jsonify(result)
+
+@admin_bp.route('/profile/<profile_id>', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def download_profile(profile_id):
+    """Descarga el volcado (.folded o .prof); ?format=text resume un .prof con pstats"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        return jsonify({'error': 'Perfil no encontrado'}), 404
+    if path.endswith('.prof') and request.args.get('format') == 'text':
+        text = profiling.pstats_text(path, limit=request.args.get('limit', 50, type=int),
+                                     sort=request.args.get('sort', 'cumulative'))
+        return current_app.response_class(text, mimetype='text/plain')
+    mimetype = 'text/plain' if path.endswith('.folded') else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(path))
+
+@admin_bp.route('/memory/snapshot', methods=['POST'])
+@cross_origin(supports_credentials=True)
+def memory_snapshot():
+    """Arranca tracemalloc (si hace falta) y fija la instantánea base"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    return jsonify(profiling.memory_snapshot()), 201
+
+@admin_bp.route('/memory/diff', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def memory_diff():
+    """Crecimiento de memoria desde la instantánea base (?limit=25&group_by=lineno|traceback|filename)"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    diff = profiling.memory_diff(
+        limit=request.args.get('limit', 25, type=int),
+        group_by=request.args.get('group_by', 'lineno'),
+    )
+    if diff is None:
+        return jsonify({'error': 'No hay instantánea base en este worker (POST /api/admin/memory/snapshot)'}), 404
+    return jsonify(diff)
+
+@admin_bp.route('/memory', methods=['DELETE'])
+@cross_origin(supports_credentials=True)
+def memory_stop():
+    """Para tracemalloc y descarta la instantánea base"""
+    auth_error = require_admin()
+    if auth_error:
+        return auth_error
+    return jsonify(profiling.memory_stop())
@@ -1,11 +1,16 @@
 import os
-from flask import Blueprint, request, jsonify, session, redirect
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, session, redirect, g
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from google.auth.transport import requests
 from google.oauth2 import id_token
 from google_auth_oauthlib.flow import Flow
 from urllib.parse import quote
-from src.models.user import User, db
+from src.models.user import User, RefreshToken, db
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -16,19 +21,76 @@ SECRET_KEY = os.getenv("SECRET_KEY", "clave-secreta-por-defecto-cambiar-en-produ
 
 # Token helpers (fallback sin cookies)
 _serializer = URLSafeTimedSerializer(SECRET_KEY, salt="auth-token")
+_refresh_serializer = URLSafeTimedSerializer(SECRET_KEY, salt="refresh-token")
 
-def create_access_token(payload: dict, expires_in_seconds: int = 3600) -> str:
+ACCESS_TOKEN_TTL = 3600
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", str(30 * 24 * 3600)))
+# Caché de tokens ya verificados: evita repetir el HMAC y el parseo en cada request
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_MAX = 1024
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def create_access_token(payload: dict, expires_in_seconds: int = ACCESS_TOKEN_TTL) -> str:
     data = dict(payload)
     data["exp"] = expires_in_seconds  # marker; verificación por edad en loads
     return _serializer.dumps(data)
 
-def verify_access_token(token: str, max_age_seconds: int = 3600):
+def verify_access_token(token: str, max_age_seconds: int = ACCESS_TOKEN_TTL):
     try:
         data = _serializer.loads(token, max_age=max_age_seconds)
         return data
     except (BadSignature, SignatureExpired):
         return None
 
+def verify_access_token_cached(token: str, max_age_seconds: int = ACCESS_TOKEN_TTL):
+    """Como verify_access_token pero con una caché TTL pequeña en memoria.
+    Una entrada nunca sobrevive a la expiración del propio token."""
+    now = time.time()
+    with _token_cache_lock:
+        hit = _token_cache.get(token)
+        if hit is not None:
+            if hit[1] > now:
+                _token_cache.move_to_end(token)
+                return hit[0]
+            del _token_cache[token]
+    try:
+        data, issued_at = _serializer.loads(token, max_age=max_age_seconds, return_timestamp=True)
+    except (BadSignature, SignatureExpired):
+        return None
+    valid_until = min(now + TOKEN_CACHE_TTL, issued_at.timestamp() + max_age_seconds)
+    with _token_cache_lock:
+        _token_cache[token] = (data, valid_until)
+        while len(_token_cache) > TOKEN_CACHE_MAX:
+            _token_cache.popitem(last=False)
+    return data
+
+def create_refresh_token(user, jti=None) -> str:
+    """Emite un refresh token de un solo uso registrado en la DB (hace commit)."""
+    jti = jti or secrets.token_urlsafe(24)
+    db.session.add(RefreshToken(
+        jti=jti,
+        user_id=user.id,
+        expires_at=datetime.utcnow() + timedelta(seconds=REFRESH_TOKEN_TTL),
+    ))
+    db.session.commit()
+    return _refresh_serializer.dumps({"jti": jti, "user_id": user.id})
+
+def _issue_tokens(user, refresh_jti=None):
+    return {
+        "access_token": create_access_token({
+            "user_id": user.id,
+            "email": user.email,
+            "name": user.username,
+        }, expires_in_seconds=ACCESS_TOKEN_TTL),
+        "refresh_token": create_refresh_token(user, jti=refresh_jti),
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
+
+def current_user_id():
+    """Usuario autenticado del request: sesión (cookie) o bearer token (flask.g)."""
+    return g.get("user_id") or session.get("user_id")
+
 client_config = {
     "web": {
         "client_id": GOOGLE_CLIENT_ID,
@@ -116,16 +178,15 @@ def callback():
         session["user_email"] = user.email
         session["user_name"] = user.username
 
-        # Generar access token (para móviles con bloqueo de cookies)
-        access_token = create_access_token({
-            "user_id": user.id,
-            "email": user.email,
-            "name": user.username,
-        }, expires_in_seconds=3600)
+        # Generar access + refresh token (para móviles con bloqueo de cookies)
+        tokens = _issue_tokens(user)
 
         # Redirigir al frontend (cliente) con HTML/JS para mejorar compatibilidad móvil
         frontend_url = os.getenv("FRONTEND_URL") or ""
-        target = (frontend_url.rstrip("/") or "") + f"/?login=success#access_token={access_token}"
+        target = (frontend_url.rstrip("/") or "") + (
+            f"/?login=success#access_token={tokens['access_token']}"
+            f"&refresh_token={tokens['refresh_token']}&expires_in={tokens['expires_in']}"
+        )
         html = f"""
         <!DOCTYPE html>
         <html lang=\"es\">
@@ -174,19 +235,70 @@ def callback():
         """
         return html
 
+@auth_bp.route("/refresh", methods=["POST"])
+def refresh():
+    """Rota el refresh token: devuelve un access token nuevo y un refresh token nuevo.
+    Reutilizar un refresh token ya rotado revoca todos los del usuario."""
+    data = request.get_json(silent=True) or {}
+    token = data.get("refresh_token") or ""
+    try:
+        payload = _refresh_serializer.loads(token, max_age=REFRESH_TOKEN_TTL)
+    except (BadSignature, SignatureExpired):
+        return jsonify({"error": "Refresh token inválido"}), 401
+
+    record = RefreshToken.query.filter_by(jti=payload.get("jti")).first()
+    now = datetime.utcnow()
+    if not record or record.user_id != payload.get("user_id") or record.expires_at < now:
+        return jsonify({"error": "Refresh token inválido"}), 401
+    user = User.query.get(record.user_id)
+    if not user:
+        return jsonify({"error": "Usuario no encontrado"}), 404
+
+    # Revocación condicional: de dos rotaciones concurrentes del mismo token solo una gana
+    new_jti = secrets.token_urlsafe(24)
+    rotated = RefreshToken.query.filter(
+        RefreshToken.jti == record.jti,
+        RefreshToken.revoked_at.is_(None),
+    ).update({"revoked_at": now, "replaced_by": new_jti}, synchronize_session=False)
+    if rotated != 1:
+        # Ya rotado (reutilización o carrera perdida), posible robo: invalidar la familia completa
+        RefreshToken.query.filter(
+            RefreshToken.user_id == record.user_id,
+            RefreshToken.revoked_at.is_(None),
+        ).update({"revoked_at": now}, synchronize_session=False)
+        db.session.commit()
+        return jsonify({"error": "Refresh token reutilizado"}), 401
+
+    # create_refresh_token confirma la revocación y el token nuevo en el mismo commit
+    return jsonify(_issue_tokens(user, refresh_jti=new_jti))
+
 @auth_bp.route("/logout", methods=["POST"])
 def logout():
     session.clear()
+    # Revocar el refresh token del cliente móvil si lo envía
+    data = request.get_json(silent=True) or {}
+    token = data.get("refresh_token")
+    if token:
+        try:
+            payload = _refresh_serializer.loads(token, max_age=REFRESH_TOKEN_TTL)
+            RefreshToken.query.filter_by(jti=payload.get("jti"), revoked_at=None).update(
+                {"revoked_at": datetime.utcnow()}, synchronize_session=False
+            )
+            db.session.commit()
+        except (BadSignature, SignatureExpired):
+            pass
     return jsonify({"message": "Sesión cerrada exitosamente"})
 
 @auth_bp.route("/check", methods=["GET"])
 def check_auth():
-    if "user_id" in session:
+    user_id = current_user_id()
+    if user_id:
+        identity = g if g.get("user_id") else session
         return jsonify({
             "authenticated": True,
-            "user_id": session["user_id"],
-            "user_email": session["user_email"],
-            "user_name": session["user_name"]
+            "user_id": user_id,
+            "user_email": identity.get("user_email"),
+            "user_name": identity.get("user_name")
         })
     else:
         return jsonify({"authenticated": False})
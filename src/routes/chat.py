@@ -1,7 +1,17 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, current_app
 from flask_cors import cross_origin
 from src.models.user import User, Folder, PDF, Conversation, Message, db
+from src.routes.auth import current_user_id
+from src.services.data_version import list_etag, not_modified_response, with_list_cache_headers
 from src.services.simple_ai_service import ai_service
+from src.services import map_reduce
+from src.services.admission import AdmissionRejected, llm_admission
+from src.services.conversation_memory import (
+    pending_messages,
+    select_history,
+    summary_due,
+    schedule_summary_update,
+)
 import os
 import json
 
@@ -9,30 +19,98 @@ chat_bp = Blueprint('chat', __name__)
 
 def require_auth():
     """Decorador para verificar autenticación"""
-    if 'user_id' not in session:
+    if not current_user_id():
         return jsonify({'error': 'No autenticado'}), 401
     return None
 
-def get_folder_content(folder_ids, user_id):
-    """Obtiene el contenido de texto de las carpetas seleccionadas"""
+def _admission_rejected(error):
+    """429 (cola llena) o 503 (plazo en cola vencido) con Retry-After"""
+    resp = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    resp.status_code = error.status_code
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp
+
+# Selección de contexto: full (todo el texto), semantic (fragmentos más
+# similares a la pregunta) o auto (full mientras quepa en CHAT_CONTEXT_MAX_CHARS)
+CONTEXT_STRATEGY = os.getenv('CHAT_CONTEXT_STRATEGY', 'full').lower()
+CONTEXT_TOP_K = int(os.getenv('CHAT_CONTEXT_TOP_K', '12'))
+CONTEXT_MAX_CHARS = int(os.getenv('CHAT_CONTEXT_MAX_CHARS', '200000'))
+# Map-reduce: auto (cuando el contexto completo no cabe) u off; el cliente
+# puede pedirlo explícitamente con "mode": "map_reduce" o evitarlo con "direct"
+MAP_REDUCE_MODE = os.getenv('CHAT_MAP_REDUCE', 'auto').lower()
+
+def selected_content_chars(folder_ids, user_id):
+    """Caracteres de texto de los PDFs de esas carpetas (sin cargar el texto)"""
+    return db.session.query(db.func.sum(db.func.length(PDF.content))).join(
+        Folder, Folder.id == PDF.folder_id
+    ).filter(
+        Folder.id.in_(folder_ids),
+        Folder.user_id == user_id
+    ).scalar() or 0
+
+def choose_answer_mode(requested_mode, folder_ids, user_id):
+    """'map_reduce' o 'direct' para este mensaje"""
+    if not folder_ids or requested_mode == 'direct':
+        return 'direct'
+    if requested_mode == 'map_reduce':
+        return 'map_reduce'
+    # Con recuperación semántica el contexto ya está acotado
+    if MAP_REDUCE_MODE != 'auto' or CONTEXT_STRATEGY in ('semantic', 'auto'):
+        return 'direct'
+    return 'map_reduce' if selected_content_chars(folder_ids, user_id) > CONTEXT_MAX_CHARS else 'direct'
+
+def get_folder_content(folder_ids, user_id, question=None, strategy=None, top_k=None):
+    """Obtiene el contenido de texto de las carpetas seleccionadas (top_k:
+    fragmentos en la estrategia semantic; por defecto CHAT_CONTEXT_TOP_K)"""
     if not folder_ids:
         return ""
     
     content = []
+    # Orden estable (carpeta, PDF): el mismo conjunto de documentos produce el
+    # mismo prefijo de prompt y aprovecha el caché de prefijos del proveedor
     folders = Folder.query.filter(
         Folder.id.in_(folder_ids),
         Folder.user_id == user_id
-    ).all()
+    ).order_by(Folder.id).all()
+    
+    strategy = (strategy or CONTEXT_STRATEGY) if question else 'full'
+    if strategy == 'auto':
+        total_chars = selected_content_chars([f.id for f in folders], user_id)
+        strategy = 'full' if total_chars <= CONTEXT_MAX_CHARS else 'semantic'
+    if strategy == 'semantic':
+        return get_semantic_folder_content(folders, question, top_k=top_k)
     
+    # Los PDFs de todas las carpetas en una sola consulta (no una por carpeta)
+    pdfs_by_folder = {}
+    for pdf in PDF.query.filter(PDF.folder_id.in_([f.id for f in folders])).order_by(PDF.folder_id, PDF.id):
+        pdfs_by_folder.setdefault(pdf.folder_id, []).append(pdf)
     for folder in folders:
         content.append(f"\n=== CARPETA: {folder.name} ===\n")
-        for pdf in folder.pdfs:
+        for pdf in pdfs_by_folder.get(folder.id, []):
             content.append(f"\n--- DOCUMENTO: {pdf.original_filename} ---\n")
             content.append(pdf.content)
             content.append("\n")
     
     return "\n".join(content)
 
+def get_semantic_folder_content(folders, question, top_k=None):
+    """Contexto con solo los fragmentos más similares a la pregunta (índice de embeddings)"""
+    from src.services.vector_index import retrieve_passages
+    
+    names = {folder.id: folder.name for folder in folders}
+    passages = retrieve_passages(list(names), question, k=top_k or CONTEXT_TOP_K)
+    content = []
+    current_folder = None
+    for _, filename, folder_id, texts in sorted(passages, key=lambda p: (p[2], p[0])):
+        if folder_id != current_folder:
+            content.append(f"\n=== CARPETA: {names[folder_id]} ===\n")
+            current_folder = folder_id
+        content.append(f"\n--- DOCUMENTO: {filename} (fragmentos relevantes) ---\n")
+        content.append("\n[...]\n".join(texts))
+        content.append("\n")
+    
+    return "\n".join(content)
+
 @chat_bp.route('/ai-info', methods=['GET'])
 @cross_origin(supports_credentials=True)
 def get_ai_info():
@@ -41,7 +119,9 @@ def get_ai_info():
     if auth_error:
         return auth_error
     
-    return jsonify(ai_service.get_provider_info())
+    info = ai_service.get_provider_info()
+    info['admission'] = llm_admission.snapshot()
+    return jsonify(info)
 
 @chat_bp.route('/conversations', methods=['GET'])
 @cross_origin(supports_credentials=True)
@@ -51,12 +131,14 @@ def get_conversations():
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
-    conversations = Conversation.query.filter_by(user_id=user_id).order_by(
-        Conversation.updated_at.desc()
-    ).all()
-    
-    return jsonify([conv.to_dict() for conv in conversations])
+    user_id = current_user_id()
+    # La versión se lee antes que los datos: nunca se asocia un ETag nuevo a datos viejos
+    etag = list_etag('conversations', user_id)
+    cached = not_modified_response(etag)
+    if cached is not None:
+        return cached
+    # Proyección de columnas + COUNT: no carga los mensajes de cada conversación
+    return with_list_cache_headers(jsonify(Conversation.summaries_for_user(user_id)), etag)
 
 @chat_bp.route('/conversations', methods=['POST', 'OPTIONS'])
 @cross_origin(supports_credentials=True)
@@ -70,7 +152,7 @@ def create_conversation():
         return auth_error
     
     data = request.json or {}
-    user_id = session['user_id']
+    user_id = current_user_id()
     
     conversation = Conversation(
         user_id=user_id,
@@ -90,7 +172,7 @@ def get_conversation(conversation_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     conversation = Conversation.query.filter_by(
         id=conversation_id, 
         user_id=user_id
@@ -99,11 +181,10 @@ def get_conversation(conversation_id):
     if not conversation:
         return jsonify({'error': 'Conversación no encontrada'}), 404
     
-    conversation_data = conversation.to_dict()
-    # Ordenar mensajes en memoria
-    conversation_data['messages'] = [
-        msg.to_dict() for msg in sorted(conversation.messages, key=lambda m: m.timestamp)
-    ]
+    # Mensajes ordenados por la DB como tuplas de columnas (sin objetos ORM)
+    messages = Message.dicts_for_conversation(conversation.id)
+    conversation_data = conversation.to_dict(message_count=len(messages))
+    conversation_data['messages'] = messages
     
     return jsonify(conversation_data)
 
@@ -122,7 +203,7 @@ def send_message(conversation_id):
     if not data or 'content' not in data:
         return jsonify({'error': 'Contenido del mensaje requerido'}), 400
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     conversation = Conversation.query.filter_by(
         id=conversation_id, 
         user_id=user_id
@@ -132,42 +213,68 @@ def send_message(conversation_id):
         return jsonify({'error': 'Conversación no encontrada'}), 404
     
     try:
-        # Crear mensaje del usuario
-        user_message = Message(
-            conversation_id=conversation_id,
-            content=data['content'],
-            is_user=True,
-            folder_ids=','.join(map(str, data.get('folder_ids', []))) if data.get('folder_ids') else None
+        # Obtener contenido de las carpetas seleccionadas
+        folder_ids = data.get('folder_ids', [])
+        answer_mode = choose_answer_mode(data.get('mode'), folder_ids, user_id)
+        # En map-reduce el texto se lee por grupos, nunca entero
+        context = None if answer_mode == 'map_reduce' else get_folder_content(
+            folder_ids, user_id, question=data['content']
         )
         
-        db.session.add(user_message)
+        # Historial: resumen acumulado + mensajes posteriores dentro del presupuesto de tokens
+        pending = pending_messages(conversation)
+        history_summary = conversation.summary
+        conversation_history = select_history(history_summary, pending)
+        is_first_message = not pending and not conversation.summary_message_id
         
-        # Obtener contenido de las carpetas seleccionadas
-        folder_ids = data.get('folder_ids', [])
-        context = get_folder_content(folder_ids, user_id)
+        # Liberar la conexión a la DB mientras se espera al proveedor de IA: con
+        # workers gevent hay cientos de chats en vuelo y el pool no debe agotarse.
+        # close() desasocia los objetos pero conserva sus atributos ya cargados.
+        db.session.close()
         
-        # Obtener historial de la conversación y ordenar en memoria
-        conversation_history = sorted(conversation.messages, key=lambda m: m.timestamp)
+        # Generar respuesta de IA usando el servicio configurable. La admisión
+        # limita las llamadas simultáneas por usuario y en total, con cola justa.
+        with llm_admission.slot(user_id):
+            if answer_mode == 'map_reduce':
+                ai_response, _ = map_reduce.answer(
+                    data['content'],
+                    folder_ids,
+                    user_id,
+                    conversation_history,
+                    history_summary=history_summary,
+                )
+            else:
+                ai_response = ai_service.generate_response(
+                    data['content'], 
+                    context, 
+                    conversation_history,
+                    history_summary=history_summary,
+                )
         
-        # Generar respuesta de IA usando el servicio configurable
-        ai_response = ai_service.generate_response(
-            data['content'], 
-            context, 
-            conversation_history
+        # Crear mensaje del usuario y de IA juntos, con una sola transacción corta
+        user_message = Message(
+            conversation_id=conversation_id,
+            content=data['content'],
+            is_user=True,
+            folder_ids=','.join(map(str, folder_ids)) if folder_ids else None
         )
-        
-        # Crear mensaje de IA
         ai_message = Message(
             conversation_id=conversation_id,
             content=ai_response,
             is_user=False,
             folder_ids=','.join(map(str, folder_ids)) if folder_ids else None
         )
-        
+        db.session.add(user_message)
         db.session.add(ai_message)
         
+        conversation = db.session.get(Conversation, conversation_id)
+        if conversation is None:
+            # Se eliminó mientras se generaba la respuesta
+            db.session.rollback()
+            return jsonify({'error': 'Conversación no encontrada'}), 404
+        
         # Actualizar título de la conversación si es el primer mensaje
-        if len(conversation_history) == 0:
+        if is_first_message:
             # Generar título basado en la primera pregunta
             title = data['content'][:50] + '...' if len(data['content']) > 50 else data['content']
             conversation.title = title
@@ -178,11 +285,18 @@ def send_message(conversation_id):
         
         db.session.commit()
         
+        # Compactar el historial en segundo plano cada N turnos sin resumir
+        if summary_due(len(pending) + 2):
+            schedule_summary_update(current_app._get_current_object(), conversation_id)
+        
         return jsonify({
             'user_message': user_message.to_dict(),
-            'ai_message': ai_message.to_dict()
+            'ai_message': ai_message.to_dict(),
+            'answer_mode': answer_mode
         }), 201
         
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Error procesando el mensaje: {str(e)}'}), 500
@@ -198,7 +312,7 @@ def delete_conversation(conversation_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     conversation = Conversation.query.filter_by(
         id=conversation_id, 
         user_id=user_id
@@ -220,14 +334,25 @@ def get_folders_summary():
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
-    folders = Folder.query.filter_by(user_id=user_id).all()
-    
-    folders_data = []
-    for folder in folders:
-        folder_info = folder.to_dict()
-        folder_info['pdfs'] = [{'id': pdf.id, 'name': pdf.original_filename} 
-                              for pdf in folder.pdfs]
-        folders_data.append(folder_info)
-    
-    return jsonify(folders_data)
+    user_id = current_user_id()
+    etag = list_etag('folders-summary', user_id)
+    cached = not_modified_response(etag)
+    if cached is not None:
+        return cached
+    folders_data = Folder.summaries_for_user(user_id)
+
+    # Solo id y nombre de cada PDF (el contenido no se carga)
+    pdfs_by_folder = {}
+    pdf_rows = (
+        db.session.query(PDF.folder_id, PDF.id, PDF.original_filename)
+        .join(Folder, Folder.id == PDF.folder_id)
+        .filter(Folder.user_id == user_id)
+        .order_by(PDF.id)
+        .all()
+    )
+    for folder_id, pdf_id, name in pdf_rows:
+        pdfs_by_folder.setdefault(folder_id, []).append({'id': pdf_id, 'name': name})
+    for folder_info in folders_data:
+        folder_info['pdfs'] = pdfs_by_folder.get(folder_info['id'], [])
+
+    return with_list_cache_headers(jsonify(folders_data), etag)
@@ -1,34 +1,46 @@
 # src/routes/drive.py
 import os
-import uuid
-import os.path
 from flask import Blueprint, jsonify, request, session, redirect
 from flask_cors import cross_origin
+from sqlalchemy.exc import OperationalError
 
 from src.models.user import User, db
-from src.models.user import PDF, Folder  # ajusta import si tus modelos están en otro módulo
+from src.models.user import Folder, DriveImportJob  # ajusta import si tus modelos están en otro módulo
 
-from src.routes.auth import login as auth_login, client_config, SCOPES, GOOGLE_REDIRECT_URI  # reutiliza generación de auth_url
+from src.routes.auth import login as auth_login, client_config, SCOPES, GOOGLE_REDIRECT_URI, current_user_id  # reutiliza generación de auth_url
 from google_auth_oauthlib.flow import Flow
 
-from src.google_drive import (
-    get_file_metadata,
-    list_pdfs_in_folder,
-    list_pdfs_in_folder_recursive,
-    download_file_to_path,
-    upload_file_to_drive,
-)
+from src.google_drive import get_file_metadata
 
-# Reutiliza utilidades de PDFs (ya las tienes)
-from src.routes.pdfs import ensure_upload_directory, extract_text_from_pdf
+from src.services.drive_import import get_active_job, start_job, run_job
+from src.services.drive_rate_limiter import DriveUnavailableError, get_quota_metrics
+
+# Segundos sugeridos al cliente cuando la base está ocupada por otra escritura
+DB_BUSY_RETRY_AFTER = 5
 
 drive_bp = Blueprint("drive", __name__)
 
+def _drive_unavailable(error):
+    """503 con Retry-After cuando Drive limita la cuota: no se toca nada local."""
+    resp = jsonify({"error": str(error), "retry_after": error.retry_after})
+    resp.status_code = 503
+    if error.retry_after:
+        resp.headers["Retry-After"] = str(error.retry_after)
+    return resp
+
+def _database_busy(error):
+    """503 reintentable cuando otra escritura retiene la base más allá del timeout."""
+    print(f"[Drive] Base de datos ocupada durante la importación: {error}")
+    resp = jsonify({"error": "Base de datos ocupada, reintenta en unos segundos", "retry_after": DB_BUSY_RETRY_AFTER})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(DB_BUSY_RETRY_AFTER)
+    return resp
+
 @drive_bp.route("/status", methods=["GET"])
 @cross_origin(supports_credentials=True)
 def drive_status():
     # conectado si hay sesión y credenciales de Drive guardadas
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"connected": False}), 200
     user = User.query.get(user_id)
@@ -59,7 +71,7 @@ def import_folder():
     if request.method == "OPTIONS":
         return "", 204
 
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
     user = User.query.get(user_id)
@@ -76,7 +88,10 @@ def import_folder():
     folder = Folder.query.filter_by(user_id=user_id, drive_folder_id=drive_folder_id).first()
 
     # Obtener metadatos de la carpeta en Drive
-    meta = get_file_metadata(user, drive_folder_id, fields="id, name, mimeType")
+    try:
+        meta = get_file_metadata(user, drive_folder_id, fields="id, name, mimeType")
+    except DriveUnavailableError as e:
+        return _drive_unavailable(e)
     if not meta or meta.get("mimeType") != "application/vnd.google-apps.folder":
         # Si no existe en Drive, permitir borrar localmente la carpeta y sus PDFs
         if folder:
@@ -108,112 +123,50 @@ def import_folder():
         db.session.add(folder)
         db.session.commit()
 
-    # Evitar duplicados por drive_file_id y permitir sobreescritura si se solicita
-    existing_by_id = {p.drive_file_id: p for p in folder.pdfs if p.drive_file_id}
-    existing_ids = set(existing_by_id.keys())
-    # Incluir PDFs de subcarpetas también
-    drive_files = list_pdfs_in_folder_recursive(user, drive_folder_id) or []
-    drive_ids = {f.get("id") for f in drive_files if f.get("id")}
-
-    # Eliminar PDFs locales que ya no existen en la carpeta de Drive (sincronización completa)
-    deleted_count = 0
-    to_delete = [p for p in folder.pdfs if p.drive_file_id and p.drive_file_id not in drive_ids]
-    for p in to_delete:
-        # borrar archivo físico si existe
-        if p.file_path and os.path.exists(p.file_path):
+    # Reanudar la importación en curso o planificar una nueva (ver src/services/drive_import.py)
+    try:
+        job = get_active_job(folder)
+        if not job:
             try:
-                os.remove(p.file_path)
-            except OSError:
-                pass
-        db.session.delete(p)
-        deleted_count += 1
-    if deleted_count:
-        db.session.commit()
+                job = start_job(user, folder, drive_folder_id, overwrite=overwrite)
+            except DriveUnavailableError as e:
+                db.session.rollback()
+                return _drive_unavailable(e)
+        finished = run_job(user, job)
+    except OperationalError as e:
+        # "database is locked": el progreso ya confirmado se conserva y el
+        # cliente puede reintentar para continuar desde el checkpoint
+        db.session.rollback()
+        return _database_busy(e)
 
-    # Subir a Drive los PDFs locales que no tienen drive_file_id (sincronización bidireccional)
-    pushed_count = 0
-    for p in folder.pdfs:
-        if not p.drive_file_id:
-            new_id = upload_file_to_drive(user, drive_folder_id, p.file_path, filename=p.original_filename)
-            if new_id:
-                p.drive_file_id = new_id
-                db.session.commit()
-                pushed_count += 1
-
-    imported_count = 0
-    updated_count = 0
-    for f in drive_files:
-        drive_id = f.get("id")
-        file_name = (f.get("name") or "archivo.pdf").strip() or "archivo.pdf"
-        if not drive_id:
-            continue
-
-        # Si no queremos sobreescribir y ya existe, lo saltamos
-        if not overwrite and drive_id in existing_ids:
-            continue
-
-        # Preparar descarga
-        original_filename = file_name if file_name.lower().endswith(".pdf") else f"{file_name}.pdf"
-        unique_filename = f"{uuid.uuid4().hex}.pdf"
-        upload_path = ensure_upload_directory()
-        file_path = os.path.join(upload_path, unique_filename)
-
-        if not download_file_to_path(user, drive_id, file_path):
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError:
-                    pass
-            continue
-
-        file_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
-        extracted_text = extract_text_from_pdf(file_path)
-
-        # Si ya existe y overwrite=True, actualizar el registro y reemplazar archivo
-        if overwrite and drive_id in existing_ids:
-            existing_pdf = existing_by_id.get(drive_id)
-            # eliminar archivo antiguo si existe
-            old_path = existing_pdf.file_path or ""
-            if old_path and os.path.exists(old_path):
-                try:
-                    os.remove(old_path)
-                except OSError:
-                    pass
-            # actualizar campos
-            existing_pdf.filename = unique_filename
-            existing_pdf.original_filename = original_filename
-            existing_pdf.file_path = file_path
-            existing_pdf.content = extracted_text
-            existing_pdf.file_size = file_size
-            db.session.commit()
-            updated_count += 1
-            continue
-
-        # Caso nuevo archivo: crear registro
-        pdf = PDF(
-            filename=unique_filename,
-            original_filename=original_filename,
-            file_path=file_path,
-            content=extracted_text,
-            folder_id=folder.id,
-            file_size=file_size,
-            drive_file_id=drive_id,
-        )
-        db.session.add(pdf)
-        db.session.commit()
-        imported_count += 1
+    resp = folder.to_dict()
+    job_data = job.to_dict()
+    resp["imported_count"] = job_data["imported_count"]
+    resp["updated_count"] = job_data["updated_count"]
+    resp["deleted_count"] = job_data["deleted_count"]
+    resp["pushed_count"] = job_data["pushed_count"]
+    resp["job"] = job_data
+    # 202: quedan archivos pendientes; volver a llamar continúa desde el checkpoint
+    return jsonify(resp), (200 if finished else 202)
 
-    # Actualizar marca de tiempo de última sincronización
-    try:
-        from datetime import datetime
-        folder.last_drive_sync_at = datetime.utcnow()
-        db.session.commit()
-    except Exception:
-        pass
 
-    resp = folder.to_dict()
-    resp["imported_count"] = imported_count
-    resp["updated_count"] = updated_count
-    resp["deleted_count"] = deleted_count
-    resp["pushed_count"] = pushed_count
-    return jsonify(resp), 200
\ No newline at end of file
+@drive_bp.route("/import-jobs/<int:job_id>", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def import_job_status(job_id):
+    """Progreso y throughput de una importación."""
+    user_id = current_user_id()
+    if not user_id:
+        return jsonify({"error": "No autenticado"}), 401
+    job = DriveImportJob.query.filter_by(id=job_id, user_id=user_id).first()
+    if not job:
+        return jsonify({"error": "Importación no encontrada"}), 404
+    return jsonify(job.to_dict()), 200
+
+@drive_bp.route("/quota", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def drive_quota():
+    """Métricas del limitador de Drive del usuario actual."""
+    user_id = current_user_id()
+    if not user_id:
+        return jsonify({"error": "No autenticado"}), 401
+    return jsonify(get_quota_metrics(user_id)), 200
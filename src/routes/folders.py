@@ -1,20 +1,41 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify
 from flask_cors import cross_origin
-from src.models.user import User, Folder, db
+from src.models.user import User, Folder, PDF, db
+from src.routes.auth import current_user_id
 from src.google_drive import (
     create_drive_folder,
     list_drive_folders,
     list_pdfs_in_folder,
     get_file_metadata,
+    delete_drive_files,
 )
-from src.routes.pdfs import ensure_upload_directory, extract_text_from_pdf
+from src.routes.pdfs import sharded_upload_path, extract_text_from_pdf
+from src.services.drive_rate_limiter import DriveUnavailableError
+from src.services.data_version import list_etag, not_modified_response, with_list_cache_headers
+from src.services.metrics import observe_sync
 from werkzeug.utils import secure_filename
 import os
+import time
 import uuid
 from datetime import datetime, timedelta
 
 folders_bp = Blueprint("folders", __name__)
 
+# Intervalo mínimo entre auto-sync de una carpeta vinculada a Drive
+AUTO_SYNC_INTERVAL = timedelta(minutes=3)
+
+
+def _auto_sync_due(user_id, now):
+    """True si alguna carpeta vinculada a Drive del usuario toca sincronizar."""
+    return db.session.query(
+        Folder.query.filter(
+            Folder.user_id == user_id,
+            Folder.drive_folder_id.isnot(None),
+            db.or_(Folder.last_drive_sync_at.is_(None), Folder.last_drive_sync_at < now - AUTO_SYNC_INTERVAL),
+        ).exists()
+    ).scalar()
+
+
 # =========================
 # Listar carpetas del usuario
 # =========================
@@ -22,28 +43,38 @@ folders_bp = Blueprint("folders", __name__)
 @cross_origin(supports_credentials=True)
 def list_folders():
     try:
-        user_id = session.get("user_id")
+        user_id = current_user_id()
         if not user_id:
             return jsonify({"error": "No autenticado"}), 401
+        now = datetime.utcnow()
+        # La versión se lee antes que los datos: nunca se asocia un ETag nuevo a datos viejos
+        etag = list_etag('folders', user_id)
+        if request.if_none_match and not _auto_sync_due(user_id, now):
+            cached = not_modified_response(etag)
+            if cached is not None:
+                return cached
+
         user = User.query.get(user_id)
         folders = Folder.query.filter_by(user_id=user_id).all()
 
         # Auto-sync Drive para carpetas vinculadas (throttle)
-        now = datetime.utcnow()
-        min_interval = timedelta(minutes=3)
+        min_interval = AUTO_SYNC_INTERVAL
         default_max_files = 5
 
         for folder in folders:
+            if not folder.drive_folder_id:
+                continue
+            if folder.last_drive_sync_at and (now - folder.last_drive_sync_at) < min_interval:
+                continue
+            sync_started = time.monotonic()
             try:
-                if not folder.drive_folder_id:
-                    continue
-                if folder.last_drive_sync_at and (now - folder.last_drive_sync_at) < min_interval:
-                    continue
                 # Ajustar límite: primera vez (sincronización inicial) trae más archivos
                 max_files_per_folder = 200 if not folder.last_drive_sync_at else default_max_files
-                # Mapear existentes por drive_file_id
+                # Mapear existentes por drive_file_id (solo la columna, sin cargar contenido)
                 existing_ids = {
-                    p.drive_file_id for p in folder.pdfs if p.drive_file_id
+                    row[0] for row in db.session.query(PDF.drive_file_id).filter(
+                        PDF.folder_id == folder.id, PDF.drive_file_id.isnot(None)
+                    )
                 }
                 drive_files = list_pdfs_in_folder(user, folder.drive_folder_id) or []
                 imported_count = 0
@@ -55,16 +86,16 @@ def list_folders():
                     if not drive_id or drive_id in existing_ids:
                         continue
 
-                    # Descargar y registrar
-                    from src.google_drive import download_file_to_path
+                    # Descargar (o tomar de la caché compartida) y registrar
+                    from src.services.drive_cache import fetch_pdf
                     original_filename = secure_filename(name)
                     if not original_filename.lower().endswith('.pdf'):
                         original_filename = f"{original_filename}.pdf"
                     unique_filename = f"{uuid.uuid4().hex}.pdf"
-                    upload_path = ensure_upload_directory()
-                    file_path = os.path.join(upload_path, unique_filename)
+                    file_path = sharded_upload_path(unique_filename)
 
-                    if not download_file_to_path(user, drive_id, file_path):
+                    ok, extracted_text, file_size, _ = fetch_pdf(user, f, file_path)
+                    if not ok:
                         # Limpieza si falló descarga
                         if os.path.exists(file_path):
                             try:
@@ -73,9 +104,6 @@ def list_folders():
                                 pass
                         continue
 
-                    file_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
-                    extracted_text = extract_text_from_pdf(file_path)
-                    from src.models.user import PDF
                     pdf = PDF(
                         filename=unique_filename,
                         original_filename=original_filename,
@@ -91,11 +119,22 @@ def list_folders():
 
                 folder.last_drive_sync_at = now
                 db.session.commit()
+                observe_sync('auto_sync', 'ok', time.monotonic() - sync_started)
+            except DriveUnavailableError as quota_err:
+                # Cuota de Drive agotada: no insistir con el resto de carpetas
+                db.session.rollback()
+                observe_sync('auto_sync', 'unavailable', time.monotonic() - sync_started)
+                print(f"[AutoSync] Drive no disponible, se pospone la sincronización: {quota_err}")
+                break
             except Exception as sync_err:
                 # No romper listado por fallos de sync
+                observe_sync('auto_sync', 'error', time.monotonic() - sync_started)
                 print(f"[AutoSync] Carpeta {folder.id} error: {sync_err}")
 
-        return jsonify([f.to_dict() for f in folders])
+        # El auto-sync pudo escribir: releer la versión para el ETag de la respuesta
+        etag = list_etag('folders', user_id)
+        # Proyección de columnas + COUNT en lugar de cargar todos los PDFs por carpeta
+        return with_list_cache_headers(jsonify(Folder.summaries_for_user(user_id)), etag)
     except Exception as e:
         # Log del error para Render
         print(f"[Folders][GET] Error listando carpetas: {e}")
@@ -110,7 +149,7 @@ def create_folder():
     # Preflight CORS
     if request.method == "OPTIONS":
         return "", 204
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
 
@@ -154,7 +193,7 @@ def create_folder():
 @folders_bp.route("/folders/<int:folder_id>", methods=["DELETE"])
 @cross_origin(supports_credentials=True)
 def delete_folder(folder_id):
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
 
@@ -162,9 +201,36 @@ def delete_folder(folder_id):
     if not folder or folder.user_id != user_id:
         return jsonify({"error": "No autorizado"}), 403
 
+    # El cascade solo borra las filas: guardar las rutas antes de borrar
+    rows = db.session.query(PDF.file_path, PDF.drive_file_id).filter(PDF.folder_id == folder.id).all()
+    paths = [path for path, _ in rows]
+    # Opcional (?delete_drive_files=1): borrar también las copias en Drive de una carpeta vinculada
+    delete_in_drive = (request.args.get("delete_drive_files", "") or "").strip().lower() in ("1", "true", "yes", "y")
+    drive_ids = [fid for _, fid in rows if fid] if delete_in_drive and folder.drive_folder_id else []
+
     # Eliminar de DB
     db.session.delete(folder)
     db.session.commit()
+
+    # Archivos físicos solo tras el commit; si algo queda, lo recoge el GC de uploads
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    if drive_ids:
+        # Best effort: la carpeta local ya está borrada; en Drive, en requests batch
+        try:
+            results = delete_drive_files(User.query.get(user_id), drive_ids)
+            failed = [fid for fid, ok in results.items() if not ok]
+            if failed:
+                print(f"[DeleteFolder] {len(failed)} archivo(s) de Drive no se pudieron eliminar")
+        except DriveUnavailableError as e:
+            print(f"[DeleteFolder] Drive no disponible, archivos no eliminados en Drive: {e}")
+        except Exception as e:
+            print(f"[DeleteFolder] Error eliminando archivos en Drive: {e}")
     return '', 204
 
 
@@ -176,7 +242,7 @@ def delete_folder(folder_id):
 def drive_list_folders():
     if request.method == "OPTIONS":
         return "", 204
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
     user = User.query.get(user_id)
@@ -237,7 +303,7 @@ def drive_list_folders():
 def drive_list_pdfs(drive_folder_id):
     if request.method == "OPTIONS":
         return "", 204
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
     user = User.query.get(user_id)
@@ -254,6 +320,12 @@ def drive_list_pdfs(drive_folder_id):
             files = list_pdfs_in_folder(user, drive_folder_id)
 
         return jsonify({"files": files, "recursive": recursive})
+    except DriveUnavailableError as e:
+        resp = jsonify({"error": str(e), "retry_after": e.retry_after})
+        resp.status_code = 503
+        if e.retry_after:
+            resp.headers["Retry-After"] = str(e.retry_after)
+        return resp
     except Exception as e:
         print(f"[Drive][list_pdfs] {e}")
         return jsonify({"error": str(e)}), 400
@@ -267,7 +339,7 @@ def drive_list_pdfs(drive_folder_id):
 def link_drive_folder(folder_id):
     if request.method == "OPTIONS":
         return "", 204
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
     folder = Folder.query.get(folder_id)
@@ -293,7 +365,7 @@ def link_drive_folder(folder_id):
 def create_folder_from_drive():
     if request.method == "OPTIONS":
         return "", 204
-    user_id = session.get("user_id")
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "No autenticado"}), 401
     user = User.query.get(user_id)
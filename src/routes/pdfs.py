@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
 from src.models.user import User, Folder, PDF, db
+from src.routes.auth import current_user_id
 from src.google_drive import (
     upload_file_to_drive,
     delete_drive_file,
@@ -9,21 +10,27 @@ from src.google_drive import (
     download_file_to_path,
     get_file_metadata,
 )
+from src.services.drive_rate_limiter import DriveUnavailableError
+from src.services.metrics import observe_extraction
+from src.services.tracing import start_span
 import os
+import time
 import uuid
+import hashlib
 import PyPDF2
 from io import BytesIO
 
 pdfs_bp = Blueprint('pdfs', __name__)
 
 # Configuración de subida de archivos
-UPLOAD_FOLDER = 'uploads'
+# Relativa a src/ o absoluta (las pruebas de carga usan un directorio temporal)
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
 ALLOWED_EXTENSIONS = {'pdf'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 
 def require_auth():
     """Decorador para verificar autenticación"""
-    if 'user_id' not in session:
+    if not current_user_id():
         return jsonify({'error': 'No autenticado'}), 401
     return None
 
@@ -34,6 +41,9 @@ def allowed_file(filename):
 
 def extract_text_from_pdf(file_path):
     """Extrae texto de un archivo PDF"""
+    started = time.perf_counter()
+    pages = 0
+    extract_span = start_span('pdf.extract', file_bytes=os.path.getsize(file_path) if os.path.exists(file_path) else None)
     try:
         with open(file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
@@ -42,11 +52,20 @@ def extract_text_from_pdf(file_path):
             for page_num in range(len(pdf_reader.pages)):
                 page = pdf_reader.pages[page_num]
                 text += page.extract_text() + "\n"
+                pages += 1
             
-            return text.strip()
+            observe_extraction(pages, time.perf_counter() - started)
+            text = text.strip()
+            extract_span.set_attributes(pages=pages, chars=len(text))
+            return text
     except Exception as e:
+        observe_extraction(pages, time.perf_counter() - started, ok=False)
+        extract_span.set_attribute('pages', pages)
+        extract_span.record_error(e)
         print(f"Error extrayendo texto del PDF: {str(e)}")
         return ""
+    finally:
+        extract_span.end()
 
 def ensure_upload_directory():
     """Asegura que el directorio de subida existe"""
@@ -55,6 +74,14 @@ def ensure_upload_directory():
         os.makedirs(upload_path)
     return upload_path
 
+def sharded_upload_path(filename, base=None):
+    """Ruta uploads/ab/cd/<filename>: dos niveles por hash del nombre para que
+    ningún directorio crezca sin límite. Crea los directorios si faltan."""
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    directory = os.path.join(base or ensure_upload_directory(), digest[:2], digest[2:4])
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
 @pdfs_bp.route('/folders/<int:folder_id>/pdfs', methods=['POST', 'OPTIONS'])
 @cross_origin(supports_credentials=True)
 def upload_pdf(folder_id):
@@ -66,7 +93,7 @@ def upload_pdf(folder_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     
     # Verificar que la carpeta existe y pertenece al usuario
     folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
@@ -99,9 +126,8 @@ def upload_pdf(folder_id):
         file_extension = original_filename.rsplit('.', 1)[1].lower()
         unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
         
-        # Asegurar que el directorio de subida existe
-        upload_path = ensure_upload_directory()
-        file_path = os.path.join(upload_path, unique_filename)
+        # Ruta dentro del directorio de subida (particionado por hash)
+        file_path = sharded_upload_path(unique_filename)
         
         # Guardar el archivo
         file.save(file_path)
@@ -153,7 +179,7 @@ def get_pdf(pdf_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     
     # Verificar que el PDF pertenece al usuario
     pdf = db.session.query(PDF).join(Folder).filter(
@@ -176,7 +202,7 @@ def delete_pdf(pdf_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     
     # Verificar que el PDF pertenece al usuario
     pdf = db.session.query(PDF).join(Folder).filter(
@@ -214,7 +240,7 @@ def search_in_folder(folder_id):
     if auth_error:
         return auth_error
     
-    user_id = session['user_id']
+    user_id = current_user_id()
     
     # Verificar que la carpeta pertenece al usuario
     folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
@@ -263,7 +289,7 @@ def sync_drive_pdfs(folder_id):
     if auth_error:
         return auth_error
 
-    user_id = session['user_id']
+    user_id = current_user_id()
     folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
     if not folder:
         return jsonify({'error': 'Carpeta no encontrada'}), 404
@@ -295,10 +321,11 @@ def sync_drive_pdfs(folder_id):
             if not original_filename.lower().endswith('.pdf'):
                 original_filename = f"{original_filename}.pdf"
             unique_filename = f"{uuid.uuid4().hex}.pdf"
-            upload_path = ensure_upload_directory()
-            file_path = os.path.join(upload_path, unique_filename)
+            file_path = sharded_upload_path(unique_filename)
 
-            ok = download_file_to_path(user, drive_id, file_path)
+            # Descarga o reutiliza la copia cacheada de la misma versión (drive_id + md5)
+            from src.services.drive_cache import fetch_pdf
+            ok, extracted_text, file_size, _ = fetch_pdf(user, f, file_path)
             if not ok:
                 skipped.append({'id': drive_id, 'name': name, 'reason': 'download_failed'})
                 # Limpieza si corresponde
@@ -309,11 +336,7 @@ def sync_drive_pdfs(folder_id):
                         pass
                 continue
 
-            # Calcular tamaño
-            file_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
-
-            # Extraer texto e insertar en DB
-            extracted_text = extract_text_from_pdf(file_path)
+            # Insertar en DB
             pdf = PDF(
                 filename=unique_filename,
                 original_filename=original_filename,
@@ -333,6 +356,13 @@ def sync_drive_pdfs(folder_id):
             'imported': imported,
             'skipped': skipped
         })
+    except DriveUnavailableError as e:
+        db.session.rollback()
+        resp = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        resp.status_code = 503
+        if e.retry_after:
+            resp.headers['Retry-After'] = str(e.retry_after)
+        return resp
     except Exception as e:
         db.session.rollback()
         print(f"[Drive Sync] Error: {e}")
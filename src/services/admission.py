@@ -0,0 +1,331 @@
+"""Control de admisión para las llamadas al proveedor de IA.
+
+Cada worker limita cuántas respuestas de IA genera a la vez en total
+(LLM_MAX_CONCURRENT) y por usuario (LLM_MAX_CONCURRENT_PER_USER). Lo que no
+cabe espera en una cola acotada que se reparte por turnos (round robin)
+entre usuarios: un usuario con diez chats en cola no adelanta al que tiene
+uno. Cada petición en cola tiene un plazo (LLM_QUEUE_TIMEOUT_SECONDS).
+
+Cuando la cola está llena (en total o la parte de un usuario) se rechaza al
+momento con AdmissionRejected, que las rutas convierten en 429 con
+Retry-After; si vence el plazo en cola, 503 con Retry-After.
+
+Los huecos acotan las llamadas al proveedor, no solo las peticiones: la
+ruta de chat toma el hueco de la petición con slot() y ProviderRouter carga
+cada llamada lanzada (también hedging y failover) con provider_call(). La
+primera llamada de la petición usa su propio hueco; las simultáneas de más
+(los grupos del map-reduce, el hedge) toman un hueco extra del total, sin
+contar para el límite por usuario, y las que no vienen de una petición
+(resúmenes en segundo plano) compiten como un usuario más (BACKGROUND_KEY).
+El hueco de la petición no se libera mientras una llamada suya siga en
+curso, aunque la petición ya haya respondido.
+
+Los límites son por proceso: con varios workers de gunicorn el máximo real
+es LLM_MAX_CONCURRENT × workers. La profundidad de la cola, los huecos
+ocupados y la espera se exportan también en /metrics.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.services.metrics import observe_admission, set_admission_gauges
+
+MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', '32'))
+MAX_CONCURRENT_PER_USER = int(os.getenv('LLM_MAX_CONCURRENT_PER_USER', '2'))
+MAX_QUEUED = int(os.getenv('LLM_MAX_QUEUED', '200'))
+MAX_QUEUED_PER_USER = int(os.getenv('LLM_MAX_QUEUED_PER_USER', '4'))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', '30'))
+# Muestras de espera para los percentiles de las métricas
+WAIT_WINDOW = 500
+# Estimación inicial de la duración de una llamada (antes de tener datos)
+DEFAULT_SERVICE_SECONDS = 5.0
+# Usuario al que se cargan las llamadas sin petición (resúmenes en segundo plano)
+BACKGROUND_KEY = '_background'
+
+# Hueco de la petición en curso (lo consulta provider_call)
+_current_lease = ContextVar('llm_admission_lease', default=None)
+
+
+class AdmissionRejected(Exception):
+    """No hay hueco para la petición; retry_after en segundos."""
+
+    def __init__(self, message, retry_after, status_code=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class _Ticket:
+    __slots__ = ('user_key', 'enqueued_at', 'granted', 'extra')
+
+    def __init__(self, user_key, extra=False):
+        self.user_key = user_key
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        # Hueco extra de una petición ya admitida: no cuenta para el límite por usuario
+        self.extra = extra
+
+
+class _Lease:
+    """Hueco de una petición; in_use mientras una llamada al proveedor lo ocupa.
+
+    closed cuando la petición terminó: si aún había una llamada usándolo (la
+    perdedora de un hedge), el hueco se libera cuando esa llamada acaba.
+    """
+    __slots__ = ('controller', 'user_key', 'in_use', 'closed', 'started')
+
+    def __init__(self, controller, user_key):
+        self.controller = controller
+        self.user_key = user_key
+        self.in_use = False
+        self.closed = False
+        self.started = time.monotonic()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=MAX_CONCURRENT, per_user=MAX_CONCURRENT_PER_USER,
+                 max_queued=MAX_QUEUED, max_queued_per_user=MAX_QUEUED_PER_USER,
+                 queue_timeout=QUEUE_TIMEOUT_SECONDS, export_metrics=False):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.export_metrics = export_metrics
+        self._cond = threading.Condition()
+        self._active = {}
+        self._total_active = 0
+        # Colas por usuario y turno de usuarios con peticiones esperando
+        self._queues = {}
+        self._turns = deque()
+        self._queued = 0
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self._service_seconds = DEFAULT_SERVICE_SECONDS
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0, 'extra_slots': 0}
+
+    def _can_run(self, user_key, extra=False):
+        if self._total_active >= self.max_concurrent:
+            return False
+        return extra or self._active.get(user_key, 0) < self.per_user
+
+    def _start(self, user_key, extra=False):
+        if extra:
+            self.counters['extra_slots'] += 1
+        else:
+            self._active[user_key] = self._active.get(user_key, 0) + 1
+        self._total_active += 1
+        self.counters['admitted'] += 1
+
+    def _record_wait(self, seconds, outcome='admitted'):
+        self._waits.append(seconds)
+        if self.export_metrics:
+            observe_admission(outcome, seconds)
+
+    def _publish(self):
+        if self.export_metrics:
+            set_admission_gauges(self._queued, self._total_active)
+
+    def _dispatch(self):
+        """Concede huecos libres por turnos entre los usuarios en cola."""
+        skipped = 0
+        while self._turns and self._total_active < self.max_concurrent and skipped < len(self._turns):
+            user_key = self._turns[0]
+            self._turns.rotate(-1)
+            queue = self._queues[user_key]
+            if not queue[0].extra and self._active.get(user_key, 0) >= self.per_user:
+                skipped += 1
+                continue
+            skipped = 0
+            ticket = queue.popleft()
+            self._queued -= 1
+            if not queue:
+                del self._queues[user_key]
+                self._turns.remove(user_key)
+            ticket.granted = True
+            self._start(user_key, ticket.extra)
+            self._record_wait(time.monotonic() - ticket.enqueued_at)
+        self._publish()
+        self._cond.notify_all()
+
+    def _retry_after(self, ahead):
+        """Segundos estimados hasta que se atiendan `ahead` peticiones."""
+        rounds = ahead / float(max(1, self.max_concurrent)) + 1
+        return max(1, int(rounds * self._service_seconds + 0.999))
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.user_key)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._queues[ticket.user_key]
+                self._turns.remove(ticket.user_key)
+
+    def acquire(self, user_key, timeout=None, extra=False):
+        """Espera un hueco para user_key. Devuelve los segundos en cola.
+
+        Con extra=True el hueco es adicional al de una petición ya admitida:
+        solo cuenta para el total. Lanza AdmissionRejected (429) si la cola
+        está llena y (503) si vence el plazo.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            # Sin cola por delante y con hueco: entra directamente
+            if not self._queued and self._can_run(user_key, extra):
+                self._start(user_key, extra)
+                self._record_wait(0.0)
+                self._publish()
+                return 0.0
+            user_queued = len(self._queues.get(user_key, ()))
+            if self._queued >= self.max_queued or (not extra and user_queued >= self.max_queued_per_user):
+                self.counters['rejected'] += 1
+                if self.export_metrics:
+                    observe_admission('rejected')
+                raise AdmissionRejected(
+                    "Demasiadas solicitudes de chat en curso. Inténtalo de nuevo en unos segundos.",
+                    retry_after=self._retry_after(self._queued),
+                )
+            ticket = _Ticket(user_key, extra)
+            if user_key not in self._queues:
+                self._queues[user_key] = deque()
+                self._turns.append(user_key)
+            self._queues[user_key].append(ticket)
+            self._queued += 1
+            self.counters['queued'] += 1
+            self._dispatch()
+
+            deadline = ticket.enqueued_at + timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self.counters['timed_out'] += 1
+                    self._publish()
+                    if self.export_metrics:
+                        observe_admission('timed_out', time.monotonic() - ticket.enqueued_at)
+                    raise AdmissionRejected(
+                        "El servicio de IA está saturado. Inténtalo de nuevo en unos segundos.",
+                        retry_after=self._retry_after(self._queued),
+                        status_code=503,
+                    )
+                self._cond.wait(remaining)
+            return time.monotonic() - ticket.enqueued_at
+
+    def release(self, user_key, service_seconds=None, extra=False):
+        with self._cond:
+            if not extra:
+                count = self._active.get(user_key, 0) - 1
+                if count > 0:
+                    self._active[user_key] = count
+                else:
+                    self._active.pop(user_key, None)
+            self._total_active -= 1
+            if service_seconds is not None:
+                # Media móvil de la duración de las llamadas para estimar Retry-After
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, user_key, timeout=None):
+        """Hueco de una petición; sus llamadas al proveedor lo usan vía provider_call()."""
+        self.acquire(user_key, timeout)
+        lease = _Lease(self, user_key)
+        token = _current_lease.set(lease)
+        try:
+            yield
+        finally:
+            _current_lease.reset(token)
+            with self._cond:
+                lease.closed = True
+                busy = lease.in_use
+            if not busy:
+                self.release(user_key, time.monotonic() - lease.started)
+
+    @contextmanager
+    def provider_call(self):
+        """Hueco para una llamada al proveedor.
+
+        Usa el de la petición en curso si está libre; si no (llamadas en
+        paralelo) toma uno extra, y fuera de una petición compite como
+        BACKGROUND_KEY con el límite por usuario.
+        """
+        lease = _current_lease.get()
+        if lease is not None and lease.controller is self:
+            with self._cond:
+                own = not lease.in_use and not lease.closed
+                if own:
+                    lease.in_use = True
+            if own:
+                try:
+                    yield
+                finally:
+                    with self._cond:
+                        lease.in_use = False
+                        closed = lease.closed
+                    if closed:
+                        # La petición terminó antes que esta llamada: liberar su hueco ahora
+                        self.release(lease.user_key, time.monotonic() - lease.started)
+                return
+            user_key, extra = lease.user_key, True
+        else:
+            user_key, extra = BACKGROUND_KEY, False
+        self.acquire(user_key, extra=extra)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user_key, time.monotonic() - started, extra=extra)
+
+    def bind(self, fn):
+        """fn ejecutada en otro hilo carga sus llamadas al hueco de la petición actual."""
+        lease = _current_lease.get()
+        if lease is None:
+            return fn
+
+        def run(*args, **kwargs):
+            token = _current_lease.set(lease)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _current_lease.reset(token)
+        return run
+
+    def snapshot(self):
+        with self._cond:
+            waits = list(self._waits)
+            oldest = min((q[0].enqueued_at for q in self._queues.values()), default=None)
+            data = {
+                'active': self._total_active,
+                'active_users': len(self._active),
+                'queue_depth': self._queued,
+                'queued_users': len(self._turns),
+                'oldest_wait_seconds': None if oldest is None else round(time.monotonic() - oldest, 3),
+                'avg_service_seconds': round(self._service_seconds, 3),
+                'limits': {
+                    'max_concurrent': self.max_concurrent,
+                    'per_user': self.per_user,
+                    'max_queued': self.max_queued,
+                    'max_queued_per_user': self.max_queued_per_user,
+                    'queue_timeout_seconds': self.queue_timeout,
+                },
+            }
+            data.update(self.counters)
+        data.update(
+            wait_p50_ms=None if not waits else round(_percentile(waits, 50) * 1000, 1),
+            wait_p95_ms=None if not waits else round(_percentile(waits, 95) * 1000, 1),
+            wait_max_ms=None if not waits else round(max(waits) * 1000, 1),
+        )
+        return data
+
+
+llm_admission = AdmissionController(export_metrics=True)
@@ -0,0 +1,77 @@
+"""Compresión negociada (br/gzip) de respuestas dinámicas.
+
+Se aplica en un after_request a respuestas de texto/JSON que superan un umbral
+de tamaño. Las respuestas que ya traen Content-Encoding (estáticos
+precomprimidos) o que se envían como archivo/stream no se tocan.
+"""
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+# Calidad baja: para contenido dinámico importa más la CPU que el último byte
+BROTLI_QUALITY = 4
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/csv',
+}
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    # La respuesta varía según Accept-Encoding aunque esta vez no se comprima
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < MIN_BYTES:
+        return response
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_BYTES:
+        return response
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Un ETag fuerte identifica bytes exactos: pasa a ser débil tras comprimir
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    if os.getenv('RESPONSE_COMPRESSION', '1') == '0':
+        return
+    app.after_request(compress_response)
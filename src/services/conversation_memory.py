@@ -0,0 +1,126 @@
+"""Historial de chat compacto: resumen acumulado + mensajes recientes.
+
+Cada turno envía al proveedor el resumen guardado en Conversation.summary y
+los mensajes posteriores a Conversation.summary_message_id que quepan en
+CHAT_HISTORY_TOKEN_BUDGET (de más reciente a más antiguo). Cuando se acumulan
+CHAT_SUMMARY_EVERY_TURNS turnos sin resumir, un hilo en segundo plano integra
+los más antiguos en el resumen y deja sin tocar los CHAT_KEEP_RECENT_MESSAGES
+últimos. Así el tamaño del prompt deja de crecer con la conversación.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from sqlalchemy import update
+
+from src.models.user import db, Conversation, Message
+
+SUMMARY_EVERY_TURNS = int(os.getenv('CHAT_SUMMARY_EVERY_TURNS', '4'))
+HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '2000'))
+KEEP_RECENT_MESSAGES = int(os.getenv('CHAT_KEEP_RECENT_MESSAGES', '4'))
+# Tope por mensaje al pedir el resumen (respuestas muy largas del asistente)
+SUMMARY_INPUT_CHARS_PER_MESSAGE = 4000
+
+HistoryMessage = namedtuple('HistoryMessage', ['is_user', 'content'])
+
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Aproximación barata (~4 caracteres por token) suficiente para presupuestar."""
+    return len(text or '') // 4 + 1
+
+
+def pending_messages(conversation):
+    """Mensajes aún no integrados en el resumen, en orden cronológico."""
+    query = Message.query.filter(Message.conversation_id == conversation.id)
+    if conversation.summary_message_id:
+        query = query.filter(Message.id > conversation.summary_message_id)
+    return query.order_by(Message.timestamp, Message.id).all()
+
+
+def select_history(summary, messages, budget=None):
+    """Mensajes recientes (como HistoryMessage) que caben en el presupuesto
+    junto con el resumen. El más reciente se recorta si no cabe entero."""
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+    selected = []
+    for msg in reversed(messages):
+        cost = estimate_tokens(msg.content)
+        if cost > remaining:
+            if not selected and remaining > 0:
+                # Al menos parte del último intercambio
+                selected.append(HistoryMessage(msg.is_user, msg.content[: remaining * 4] + '…'))
+            break
+        selected.append(HistoryMessage(msg.is_user, msg.content))
+        remaining -= cost
+    selected.reverse()
+    return selected
+
+
+def summary_due(pending_count):
+    return pending_count - KEEP_RECENT_MESSAGES >= SUMMARY_EVERY_TURNS * 2
+
+
+def update_summary(conversation_id):
+    """Integra en el resumen los mensajes pendientes salvo los más recientes.
+
+    Requiere app context. Devuelve True si el resumen cambió.
+    """
+    from src.services.simple_ai_service import ai_service
+
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        return False
+    pending = pending_messages(conversation)
+    if not summary_due(len(pending)):
+        return False
+    to_fold = pending[:-KEEP_RECENT_MESSAGES] if KEEP_RECENT_MESSAGES else pending
+    previous_summary = conversation.summary
+    previous_marker = conversation.summary_message_id
+    snapshot = [HistoryMessage(m.is_user, m.content[:SUMMARY_INPUT_CHARS_PER_MESSAGE]) for m in to_fold]
+    last_id = to_fold[-1].id
+    # Sin conexión retenida durante la llamada al proveedor
+    db.session.close()
+
+    new_summary = ai_service.summarize_history(previous_summary, snapshot)
+    if not new_summary:
+        return False
+    # Solo si nadie lo actualizó mientras tanto; updated_at no cambia (el
+    # resumen no es actividad visible en el listado)
+    marker_matches = (
+        Conversation.summary_message_id.is_(None)
+        if previous_marker is None
+        else Conversation.summary_message_id == previous_marker
+    )
+    result = db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id, marker_matches)
+        .values(summary=new_summary, summary_message_id=last_id, updated_at=Conversation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def schedule_summary_update(app, conversation_id):
+    """Lanza update_summary en un hilo daemon (uno por conversación a la vez)."""
+    with _in_progress_lock:
+        if conversation_id in _in_progress:
+            return None
+        _in_progress.add(conversation_id)
+
+    def run():
+        try:
+            with app.app_context():
+                update_summary(conversation_id)
+        except Exception as e:
+            print(f"[Chat] Error actualizando resumen de la conversación {conversation_id}: {e}")
+        finally:
+            with _in_progress_lock:
+                _in_progress.discard(conversation_id)
+
+    thread = threading.Thread(target=run, name=f'conversation-summary-{conversation_id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,114 @@
+"""Versión de datos por usuario para GET condicionales (ETag / 304).
+
+Cada flush que crea, modifica o borra filas de Folder, PDF, Conversation o
+Message incrementa user.data_version de los usuarios afectados dentro de la
+misma transacción. Los listados derivan su ETag de ese contador, así que un
+sondeo sin cambios se resuelve con una lectura por clave primaria y un 304,
+sin consultar ni serializar carpetas o conversaciones.
+"""
+from flask import current_app, request
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from src.models.user import db, User, Folder, PDF, Conversation, Message
+
+LIST_CACHE_CONTROL = 'private, no-cache'
+
+
+def _owner_ids(session, instances):
+    """user_id dueño de cada instancia versionada."""
+    user_ids = set()
+    folder_ids = set()
+    conversation_ids = set()
+    for obj in instances:
+        if isinstance(obj, (Folder, Conversation)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, PDF):
+            folder = obj.__dict__.get('folder')
+            if folder is not None:
+                user_ids.add(folder.user_id)
+            else:
+                folder_ids.add(obj.folder_id)
+        elif isinstance(obj, Message):
+            conversation = obj.__dict__.get('conversation')
+            if conversation is not None:
+                user_ids.add(conversation.user_id)
+            else:
+                conversation_ids.add(obj.conversation_id)
+    # Un solo SELECT por tipo para los padres que no están cargados
+    with session.no_autoflush:
+        folder_ids.discard(None)
+        if folder_ids:
+            user_ids.update(
+                r[0] for r in session.query(Folder.user_id).filter(Folder.id.in_(folder_ids))
+            )
+        conversation_ids.discard(None)
+        if conversation_ids:
+            user_ids.update(
+                r[0] for r in session.query(Conversation.user_id).filter(Conversation.id.in_(conversation_ids))
+            )
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_owners(session, flush_context, instances):
+    tracked = (Folder, PDF, Conversation, Message)
+    changed = [o for o in session.new if isinstance(o, tracked)]
+    changed += [o for o in session.deleted if isinstance(o, tracked)]
+    changed += [
+        o for o in session.dirty
+        if isinstance(o, tracked) and session.is_modified(o, include_collections=False)
+    ]
+    if changed:
+        session.info.setdefault('data_version_users', set()).update(_owner_ids(session, changed))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_versions(session, flush_context):
+    user_ids = session.info.pop('data_version_users', None)
+    if not user_ids:
+        return
+    session.connection().execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(data_version=User.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('data_version_users', None)
+
+
+def get_data_version(user_id):
+    """Versión actual de los datos del usuario (lectura por clave primaria)."""
+    version = db.session.query(User.data_version).filter(User.id == user_id).scalar()
+    return version or 0
+
+
+def list_etag(scope, user_id, version=None):
+    if version is None:
+        version = get_data_version(user_id)
+    return f"{scope}-u{user_id}-v{version}"
+
+
+def not_modified_response(etag):
+    """304 si el If-None-Match del cliente coincide con etag; si no, None.
+
+    Comparación débil: la compresión convierte el ETag en W/"...".
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    return with_list_cache_headers(response, etag)
+
+
+def with_list_cache_headers(response, etag):
+    response.set_etag(etag)
+    # Siempre revalidar: el contenido cambia con cualquier escritura del usuario
+    response.headers['Cache-Control'] = LIST_CACHE_CONTROL
+    response.vary.add('Cookie')
+    response.vary.add('Authorization')
+    return response
@@ -0,0 +1,108 @@
+"""Caché de descargas de Drive compartida entre usuarios y carpetas.
+
+La clave es (drive_file_id, md5Checksum): si el archivo cambia en Drive cambia
+el checksum y la entrada vieja deja de usarse. Solo se consulta con el md5 que
+devolvió el listado de Drive hecho con las credenciales del propio usuario, por
+lo que quien recibe el blob ya demostró tener acceso al archivo.
+"""
+import os
+import shutil
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db, DriveFileCache
+from src.google_drive import download_file_to_path
+from src.routes.pdfs import ensure_upload_directory, sharded_upload_path, extract_text_from_pdf
+
+CACHE_DIRNAME = '_drive_cache'
+
+
+def _cache_directory():
+    path = os.path.join(ensure_upload_directory(), CACHE_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_blob_name(drive_file_id, md5_checksum):
+    return f"{drive_file_id}-{md5_checksum}.pdf"
+
+
+def _link_or_copy(src, dest):
+    """Hard link (sin duplicar disco) y copia como respaldo."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def lookup(drive_file_id, md5_checksum):
+    """Entrada de caché válida (con blob en disco) o None."""
+    if not drive_file_id or not md5_checksum:
+        return None
+    entry = DriveFileCache.query.filter_by(drive_file_id=drive_file_id, md5_checksum=md5_checksum).first()
+    if entry and os.path.exists(entry.blob_path):
+        return entry
+    return None
+
+
+def materialize(entry, dest_path):
+    """Copia el blob cacheado a dest_path y marca el uso. True si pudo."""
+    try:
+        _link_or_copy(entry.blob_path, dest_path)
+    except OSError as e:
+        print(f"[DriveCache] No se pudo usar la caché de {entry.drive_file_id}: {e}")
+        return False
+    entry.hits = (entry.hits or 0) + 1
+    entry.last_used_at = datetime.utcnow()
+    return True
+
+
+def store(drive_file_id, md5_checksum, file_path, content, file_size=None):
+    """Guarda un archivo recién descargado y su texto. Hace su propio commit."""
+    if not drive_file_id or not md5_checksum or not os.path.exists(file_path):
+        return None
+    if lookup(drive_file_id, md5_checksum):
+        return None
+    blob_path = sharded_upload_path(cache_blob_name(drive_file_id, md5_checksum), base=_cache_directory())
+    try:
+        _link_or_copy(file_path, blob_path)
+        entry = DriveFileCache(
+            drive_file_id=drive_file_id,
+            md5_checksum=md5_checksum,
+            blob_path=blob_path,
+            content=content,
+            file_size=file_size,
+        )
+        db.session.add(entry)
+        db.session.commit()
+        return entry
+    except IntegrityError:
+        # Otro worker la guardó a la vez
+        db.session.rollback()
+        return None
+    except OSError as e:
+        print(f"[DriveCache] No se pudo guardar {drive_file_id} en caché: {e}")
+        return None
+
+
+def fetch_pdf(user, drive_file, dest_path):
+    """Deja en dest_path el PDF de Drive y devuelve (ok, texto, tamaño, desde_cache).
+
+    drive_file es un dict del listado de Drive del usuario (id, md5Checksum).
+    """
+    drive_id = drive_file.get('id')
+    md5 = drive_file.get('md5Checksum')
+    entry = lookup(drive_id, md5)
+    if entry and materialize(entry, dest_path):
+        db.session.commit()
+        return True, entry.content or "", entry.file_size, True
+
+    if not download_file_to_path(user, drive_id, dest_path):
+        return False, None, None, False
+    file_size = os.path.getsize(dest_path) if os.path.exists(dest_path) else None
+    extracted_text = extract_text_from_pdf(dest_path)
+    store(drive_id, md5, dest_path, extracted_text, file_size)
+    return True, extracted_text, file_size, False
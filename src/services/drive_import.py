@@ -0,0 +1,303 @@
+"""Importación reanudable de carpetas de Google Drive.
+
+Cada importación es un DriveImportJob con un DriveImportItem por archivo.
+Cada item avanza pending -> downloaded -> extracted -> committed y el estado
+se persiste en cada paso, de modo que si gunicorn mata el request a mitad
+de camino la siguiente llamada continúa donde se quedó sin repetir trabajo.
+"""
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db, PDF, DriveImportJob, DriveImportItem
+from src.google_drive import (
+    list_pdfs_in_folder_recursive,
+    download_file_to_path,
+    upload_files_to_drive,
+)
+from src.routes.pdfs import sharded_upload_path, extract_text_from_pdf
+from src.services.drive_rate_limiter import DriveUnavailableError
+from src.services import drive_cache
+from src.services.metrics import observe_sync
+
+# Estados de los items
+PENDING = 'pending'
+DOWNLOADED = 'downloaded'
+EXTRACTED = 'extracted'
+COMMITTED = 'committed'
+FAILED = 'failed'
+UNFINISHED_STATUSES = (PENDING, DOWNLOADED, EXTRACTED)
+
+# Tiempo máximo de trabajo por request (por debajo del --timeout 120 de gunicorn)
+TIME_BUDGET_SECONDS = float(os.getenv('DRIVE_IMPORT_TIME_BUDGET', '90'))
+# Un worker que no renueva el lease en este tiempo se considera muerto
+LEASE_SECONDS = int(os.getenv('DRIVE_IMPORT_LEASE_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.getenv('DRIVE_IMPORT_MAX_ATTEMPTS', '3'))
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_active_job(folder):
+    """Devuelve el job en curso de la carpeta (si lo hay)."""
+    return (
+        DriveImportJob.query
+        .filter_by(folder_id=folder.id, status='running')
+        .order_by(DriveImportJob.id.desc())
+        .first()
+    )
+
+
+def start_job(user, folder, drive_folder_id, overwrite=True):
+    """Planifica una importación nueva.
+
+    Borra los PDFs locales que ya no están en Drive, sube los PDFs locales sin
+    drive_file_id y crea un item pendiente por cada archivo a descargar.
+
+    Toda la E/S con Drive (listado y subidas) ocurre antes de la primera
+    escritura y el plan completo se confirma en un único commit: ninguna
+    transacción de escritura queda abierta mientras se espera a la red. Si otro
+    request planificó a la vez, el índice único de jobs en curso lo detecta y
+    se devuelve ese job.
+    """
+    # Si Drive no está disponible se propaga DriveUnavailableError antes de
+    # borrar nada: un listado vacío por cuota no debe eliminar PDFs locales.
+    drive_files = list_pdfs_in_folder_recursive(user, drive_folder_id) or []
+    drive_ids = {f.get("id") for f in drive_files if f.get("id")}
+
+    # Subir a Drive los PDFs locales que no tienen drive_file_id (sincronización bidireccional).
+    # Subidas concurrentes; los ids se guardan junto con el resto del plan.
+    pdfs = list(folder.pdfs)
+    local_only = [p for p in pdfs if not p.drive_file_id]
+    uploaded = upload_files_to_drive(
+        user, drive_folder_id, [(p.file_path, p.original_filename) for p in local_only]
+    )
+
+    # A partir de aquí solo hay escrituras locales
+    # Eliminar PDFs locales que ya no existen en la carpeta de Drive (sincronización completa)
+    removed = [p for p in pdfs if p.drive_file_id and p.drive_file_id not in drive_ids]
+    removed_paths = [p.file_path for p in removed]
+    for p in removed:
+        db.session.delete(p)
+    pushed_count = _apply_uploaded_ids(local_only, uploaded)
+
+    existing_ids = {p.drive_file_id for p in pdfs if p.drive_file_id} & drive_ids
+    job = DriveImportJob(
+        user_id=user.id,
+        folder_id=folder.id,
+        drive_folder_id=drive_folder_id,
+        overwrite=overwrite,
+        deleted_count=len(removed),
+        pushed_count=pushed_count,
+    )
+    db.session.add(job)
+
+    seen = set()
+    total = 0
+    for f in drive_files:
+        drive_id = f.get("id")
+        if not drive_id or drive_id in seen:
+            continue
+        seen.add(drive_id)
+        # Si no queremos sobreescribir y ya existe, lo saltamos
+        if not overwrite and drive_id in existing_ids:
+            continue
+        file_name = (f.get("name") or "archivo.pdf").strip() or "archivo.pdf"
+        original_filename = file_name if file_name.lower().endswith(".pdf") else f"{file_name}.pdf"
+        # La ruta se fija al planificar: un reintento sobrescribe el mismo archivo
+        unique_filename = f"{uuid.uuid4().hex}.pdf"
+        job.items.append(DriveImportItem(
+            drive_file_id=drive_id,
+            md5_checksum=f.get("md5Checksum"),
+            original_filename=original_filename,
+            filename=unique_filename,
+            file_path=sharded_upload_path(unique_filename),
+            status=PENDING,
+        ))
+        total += 1
+    job.total_files = total
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Otro request creó el job de esta carpeta mientras planificábamos.
+        # Las subidas ya existen en Drive: se guardan sus ids para no repetirlas.
+        db.session.rollback()
+        if _apply_uploaded_ids(local_only, uploaded):
+            db.session.commit()
+        return get_active_job(folder)
+    # Los archivos se borran solo cuando el borrado de sus filas ya es firme
+    for path in removed_paths:
+        _remove_file(path)
+    return job
+
+
+def _apply_uploaded_ids(pdfs, uploaded):
+    """Asigna a cada PDF el id de Drive de su subida. Devuelve cuántos cambiaron."""
+    count = 0
+    for p in pdfs:
+        new_id = uploaded.get(p.file_path)
+        if new_id and not p.drive_file_id:
+            p.drive_file_id = new_id
+            count += 1
+    return count
+
+
+def _acquire_lease(job):
+    """Toma el lease del job de forma atómica. False si otro worker lo tiene."""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(DriveImportJob)
+        .where(
+            DriveImportJob.id == job.id,
+            or_(DriveImportJob.lease_until.is_(None), DriveImportJob.lease_until < now),
+        )
+        .values(lease_until=now + timedelta(seconds=LEASE_SECONDS))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _process_item(user, job, item):
+    """Avanza un item hasta 'committed' persistiendo cada paso."""
+    if item.status == PENDING:
+        # Otro usuario (o carpeta) ya descargó y extrajo esta misma versión
+        cached = drive_cache.lookup(item.drive_file_id, item.md5_checksum)
+        if cached and drive_cache.materialize(cached, item.file_path):
+            item.content = cached.content or ""
+            item.file_size = cached.file_size
+            item.status = EXTRACTED
+            job.cache_hits = (job.cache_hits or 0) + 1
+            db.session.commit()
+
+    if item.status == PENDING:
+        # El intento se confirma antes de descargar: así no queda una escritura
+        # pendiente que un autoflush convierta en lock durante la descarga
+        item.attempts = (item.attempts or 0) + 1
+        db.session.commit()
+        if not download_file_to_path(user, item.drive_file_id, item.file_path):
+            _remove_file(item.file_path)
+            if item.attempts >= MAX_ATTEMPTS:
+                item.status = FAILED
+            db.session.commit()
+            return
+        item.file_size = os.path.getsize(item.file_path) if os.path.exists(item.file_path) else None
+        item.status = DOWNLOADED
+        job.bytes_downloaded = (job.bytes_downloaded or 0) + (item.file_size or 0)
+        db.session.commit()
+
+    if item.status == DOWNLOADED:
+        if not os.path.exists(item.file_path):
+            # El archivo descargado se perdió (p. ej. disco efímero): volver a bajarlo
+            item.status = PENDING
+            db.session.commit()
+            return
+        item.content = extract_text_from_pdf(item.file_path)
+        item.status = EXTRACTED
+        db.session.commit()
+        drive_cache.store(item.drive_file_id, item.md5_checksum, item.file_path, item.content, item.file_size)
+
+    if item.status == EXTRACTED:
+        existing_pdf = PDF.query.filter_by(folder_id=job.folder_id, drive_file_id=item.drive_file_id).first()
+        if existing_pdf:
+            # Reemplazar archivo y contenido del registro existente
+            if existing_pdf.file_path != item.file_path:
+                _remove_file(existing_pdf.file_path)
+            existing_pdf.filename = item.filename
+            existing_pdf.original_filename = item.original_filename
+            existing_pdf.file_path = item.file_path
+            existing_pdf.content = item.content
+            existing_pdf.file_size = item.file_size
+            job.updated_count = (job.updated_count or 0) + 1
+        else:
+            db.session.add(PDF(
+                filename=item.filename,
+                original_filename=item.original_filename,
+                file_path=item.file_path,
+                content=item.content,
+                folder_id=job.folder_id,
+                file_size=item.file_size,
+                drive_file_id=item.drive_file_id,
+            ))
+            job.imported_count = (job.imported_count or 0) + 1
+        # El PDF y el checkpoint se confirman en la misma transacción
+        item.status = COMMITTED
+        item.content = None
+        db.session.commit()
+
+
+def run_job(user, job, time_budget=None):
+    """Procesa items pendientes hasta terminar o agotar el presupuesto de tiempo.
+
+    Devuelve True si el job quedó completado. Si otro worker tiene el lease,
+    no hace nada y devuelve False.
+    """
+    if job.status != 'running':
+        return True
+    if not _acquire_lease(job):
+        return False
+
+    budget = TIME_BUDGET_SECONDS if time_budget is None else time_budget
+    started = time.monotonic()
+    last_mark = started
+    outcome = 'error'
+    pending_ids = [
+        row[0] for row in
+        db.session.query(DriveImportItem.id)
+        .filter(DriveImportItem.job_id == job.id, DriveImportItem.status.in_(UNFINISHED_STATUSES))
+        .order_by(DriveImportItem.id)
+        .all()
+    ]
+    try:
+        for item_id in pending_ids:
+            if time.monotonic() - started >= budget:
+                break
+            item = DriveImportItem.query.get(item_id)
+            if not item or item.status not in UNFINISHED_STATUSES:
+                continue
+            try:
+                _process_item(user, job, item)
+            except DriveUnavailableError as e:
+                # Cuota agotada: dejar el resto pendiente para la próxima llamada
+                db.session.rollback()
+                print(f"[DriveImport] Job {job.id} pausado: {e}")
+                outcome = 'unavailable'
+                break
+            except Exception as e:
+                db.session.rollback()
+                print(f"[DriveImport] Job {job.id} item {item_id} error: {e}")
+            # Renovar lease y acumular tiempo activo
+            now_mono = time.monotonic()
+            job.active_seconds = (job.active_seconds or 0.0) + (now_mono - last_mark)
+            last_mark = now_mono
+            job.lease_until = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+            db.session.commit()
+
+        remaining = (
+            DriveImportItem.query
+            .filter(DriveImportItem.job_id == job.id, DriveImportItem.status.in_(UNFINISHED_STATUSES))
+            .count()
+        )
+        if remaining == 0:
+            now = datetime.utcnow()
+            job.status = 'completed'
+            job.finished_at = now
+            job.folder.last_drive_sync_at = now
+        job.active_seconds = (job.active_seconds or 0.0) + (time.monotonic() - last_mark)
+        if remaining == 0:
+            outcome = 'completed'
+        elif outcome != 'unavailable':
+            outcome = 'partial'
+        return remaining == 0
+    finally:
+        job.lease_until = None
+        db.session.commit()
+        observe_sync('import_job', outcome, time.monotonic() - started)
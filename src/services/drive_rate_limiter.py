@@ -0,0 +1,226 @@
+"""Limitador de llamadas a Google Drive compartido entre workers.
+
+Token bucket por usuario guardado en un SQLite aparte (las transacciones
+BEGIN IMMEDIATE serializan a los workers de gunicorn), con backoff
+exponencial adaptativo cuando Drive responde 403 de cuota, 429 o 5xx.
+Las métricas de cuota se acumulan en la misma base.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from src.services.sqlite_pool import SQLitePool
+
+QUOTA_DB_PATH = os.getenv(
+    'DRIVE_QUOTA_DB',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'drive_quota.db'),
+)
+RATE_PER_SECOND = float(os.getenv('DRIVE_RATE_PER_SECOND', '10'))
+BURST = float(os.getenv('DRIVE_RATE_BURST', '20'))
+# Espera máxima por un token antes de rendirse
+MAX_WAIT_SECONDS = float(os.getenv('DRIVE_RATE_MAX_WAIT', '15'))
+MAX_RETRIES = int(os.getenv('DRIVE_RATE_MAX_RETRIES', '4'))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+
+RATE_LIMIT_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded', 'dailyLimitExceeded', 'quotaExceeded'}
+
+_schema_ready = False
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class DriveUnavailableError(Exception):
+    """Drive no está disponible temporalmente (cuota agotada o errores 5xx).
+
+    A diferencia de un HttpError normal, nunca significa que el recurso no
+    exista: quien la reciba no debe borrar datos locales.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _setup(conn):
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS bucket ("
+        " user_key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+        " backoff_until REAL NOT NULL DEFAULT 0, backoff_level INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS quota_metric ("
+        " user_key TEXT NOT NULL, name TEXT NOT NULL, value REAL NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (user_key, name))"
+    )
+    _schema_ready = True
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            os.makedirs(os.path.dirname(QUOTA_DB_PATH) or '.', exist_ok=True)
+            _pool = SQLitePool(QUOTA_DB_PATH, timeout=10, on_connect=_setup)
+        return _pool
+
+
+@contextmanager
+def _db():
+    """Conexión prestada del pool (no una por greenlet); si algo falla a mitad de transacción, la deshace."""
+    with _get_pool().connection() as conn:
+        yield conn
+
+
+def _incr(conn, user_key, name, amount=1):
+    conn.execute(
+        "INSERT INTO quota_metric (user_key, name, value) VALUES (?, ?, ?)"
+        " ON CONFLICT(user_key, name) DO UPDATE SET value = value + excluded.value",
+        (user_key, name, amount),
+    )
+
+
+def record_metric(user_key, name, amount=1):
+    with _db() as conn:
+        _incr(conn, str(user_key), name, amount)
+
+
+def acquire(user_key, tokens=1, max_wait=None):
+    """Bloquea hasta obtener `tokens` del bucket del usuario.
+
+    Respeta el backoff activo. Lanza DriveUnavailableError si la espera
+    superaría max_wait.
+    """
+    user_key = str(user_key)
+    max_wait = MAX_WAIT_SECONDS if max_wait is None else max_wait
+    # Un batch puede pedir más tokens que la ráfaga: nunca esperar imposibles
+    tokens = min(float(tokens), BURST)
+    deadline = time.time() + max_wait
+    waited = 0.0
+    while True:
+        # Conexión solo durante la transacción: no se retiene mientras se espera
+        with _db() as conn:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated_at, backoff_until FROM bucket WHERE user_key = ?", (user_key,)
+            ).fetchone()
+            if row is None:
+                available, backoff_until = BURST, 0.0
+            else:
+                available = min(BURST, row[0] + (now - row[1]) * RATE_PER_SECOND)
+                backoff_until = row[2]
+
+            if now < backoff_until:
+                wait = backoff_until - now
+            elif available >= tokens:
+                wait = 0.0
+                available -= tokens
+            else:
+                wait = (tokens - available) / RATE_PER_SECOND
+
+            conn.execute(
+                "INSERT INTO bucket (user_key, tokens, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(user_key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (user_key, available, now),
+            )
+            if wait == 0.0:
+                _incr(conn, user_key, 'calls', tokens)
+                if waited:
+                    _incr(conn, user_key, 'throttled', 1)
+                    _incr(conn, user_key, 'wait_seconds', waited)
+                conn.execute("COMMIT")
+                return waited
+            conn.execute("COMMIT")
+
+        if now + wait > deadline:
+            record_metric(user_key, 'rejected', 1)
+            raise DriveUnavailableError(
+                "Cuota de Google Drive agotada temporalmente", retry_after=max(1, int(wait + 0.999))
+            )
+        time.sleep(wait)
+        waited += wait
+
+
+def report_throttled(user_key):
+    """Drive rechazó una llamada por cuota/5xx: aumentar el backoff compartido."""
+    user_key = str(user_key)
+    with _db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT backoff_level FROM bucket WHERE user_key = ?", (user_key,)).fetchone()
+        level = (row[0] if row else 0) + 1
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (level - 1)))
+        delay *= random.uniform(0.5, 1.0)
+        now = time.time()
+        conn.execute(
+            "INSERT INTO bucket (user_key, tokens, updated_at, backoff_until, backoff_level) VALUES (?, 0, ?, ?, ?)"
+            " ON CONFLICT(user_key) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at,"
+            " backoff_until = MAX(bucket.backoff_until, excluded.backoff_until), backoff_level = excluded.backoff_level",
+            (user_key, now, now + delay, level),
+        )
+        _incr(conn, user_key, 'rate_limited', 1)
+        conn.execute("COMMIT")
+        return delay
+
+
+def report_success(user_key):
+    """Tras una llamada correcta el nivel de backoff vuelve a cero."""
+    with _db() as conn:
+        conn.execute(
+            "UPDATE bucket SET backoff_level = 0 WHERE user_key = ? AND backoff_level > 0", (str(user_key),)
+        )
+
+
+def is_retryable(error):
+    """True si el HttpError es de cuota (403/429) o un error de servidor (5xx)."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    if status == 429 or status >= 500:
+        return True
+    if status == 403:
+        reasons = set()
+        try:
+            for detail in error.error_details or []:
+                if isinstance(detail, dict) and detail.get('reason'):
+                    reasons.add(detail['reason'])
+        except Exception:
+            pass
+        content = getattr(error, 'content', b'') or b''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'ignore')
+        return bool(reasons & RATE_LIMIT_REASONS) or any(r in content for r in RATE_LIMIT_REASONS)
+    return False
+
+
+def get_quota_metrics(user_key=None):
+    """Métricas acumuladas. Con user_key, solo las de ese usuario."""
+    with _db() as conn:
+        if user_key is None:
+            rows = conn.execute("SELECT user_key, name, value FROM quota_metric").fetchall()
+            out = {}
+            for key, name, value in rows:
+                out.setdefault(key, {})[name] = value
+            return out
+        rows = conn.execute(
+            "SELECT name, value FROM quota_metric WHERE user_key = ?", (str(user_key),)
+        ).fetchall()
+        metrics = {name: value for name, value in rows}
+        bucket = conn.execute(
+            "SELECT tokens, updated_at, backoff_until, backoff_level FROM bucket WHERE user_key = ?",
+            (str(user_key),),
+        ).fetchone()
+        now = time.time()
+        if bucket:
+            metrics['tokens_available'] = round(min(BURST, bucket[0] + (now - bucket[1]) * RATE_PER_SECOND), 2)
+            metrics['backoff_seconds_remaining'] = round(max(0.0, bucket[2] - now), 2)
+            metrics['backoff_level'] = bucket[3]
+        return metrics
@@ -0,0 +1,139 @@
+"""Embeddings de fragmentos de PDF con proveedor intercambiable (EMBEDDING_PROVIDER).
+
+- hashing (por defecto): embedder local y determinista por hashing de
+  palabras y bigramas. No usa red; pensado para desarrollo y pruebas offline.
+- openai: /embeddings de OPENAI_API_BASE (text-embedding-3-small por defecto).
+- gemini: batchEmbedContents (text-embedding-004 por defecto).
+
+Todos devuelven matrices float32 con filas normalizadas (L2), de modo que el
+producto punto es la similitud coseno.
+"""
+import os
+import re
+import zlib
+
+import numpy as np
+import requests
+
+EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'hashing').lower()
+HASHING_DIM = int(os.getenv('EMBEDDING_DIM', '256'))
+CHUNK_CHARS = int(os.getenv('EMBEDDING_CHUNK_CHARS', '1200'))
+CHUNK_OVERLAP = int(os.getenv('EMBEDDING_CHUNK_OVERLAP', '200'))
+REQUEST_BATCH = 64
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def chunk_text(text, size=None, overlap=None):
+    """Offsets (inicio, fin) de fragmentos de ~size caracteres que se solapan
+    `overlap` caracteres, cortando en espacios cuando es posible."""
+    size = CHUNK_CHARS if size is None else size
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    text = text or ''
+    length = len(text)
+    spans = []
+    start = 0
+    while start < length:
+        end = min(length, start + size)
+        if end < length:
+            cut = text.rfind(' ', start + size // 2, end)
+            if cut > start:
+                end = cut
+        if text[start:end].strip():
+            spans.append((start, end))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return spans
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Feature hashing de palabras y bigramas con signo (sin dependencias externas)."""
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall((text or '').lower())
+            features = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return _normalize(matrix)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model=None):
+        self.model = model or os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+        self.api_key = os.getenv('OPENAI_API_KEY')
+        self.api_base = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+        self.name = f'openai-{self.model}'
+
+    def embed(self, texts):
+        rows = []
+        for i in range(0, len(texts), REQUEST_BATCH):
+            response = requests.post(
+                f'{self.api_base}/embeddings',
+                headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+                json={'model': self.model, 'input': texts[i:i + REQUEST_BATCH]},
+                timeout=60,
+            )
+            response.raise_for_status()
+            data = sorted(response.json()['data'], key=lambda d: d['index'])
+            rows.extend(d['embedding'] for d in data)
+        return _normalize(np.asarray(rows, dtype=np.float32).reshape(len(texts), -1))
+
+
+class GeminiEmbedder:
+    def __init__(self, model=None):
+        self.model = model or os.getenv('EMBEDDING_MODEL', 'text-embedding-004')
+        self.api_key = os.getenv('GEMINI_API_KEY')
+        self.api_version = os.getenv('GEMINI_API_VERSION', 'v1beta').strip()
+        self.name = f'gemini-{self.model}'
+
+    def embed(self, texts):
+        url = (
+            f'https://generativelanguage.googleapis.com/{self.api_version}'
+            f'/models/{self.model}:batchEmbedContents'
+        )
+        rows = []
+        for i in range(0, len(texts), REQUEST_BATCH):
+            batch = texts[i:i + REQUEST_BATCH]
+            response = requests.post(
+                url,
+                headers={'Content-Type': 'application/json', 'X-goog-api-key': self.api_key},
+                json={'requests': [
+                    {'model': f'models/{self.model}', 'content': {'parts': [{'text': t}]}} for t in batch
+                ]},
+                timeout=60,
+            )
+            response.raise_for_status()
+            rows.extend(e['values'] for e in response.json()['embeddings'])
+        return _normalize(np.asarray(rows, dtype=np.float32).reshape(len(texts), -1))
+
+
+_embedder = None
+
+
+def get_embedder():
+    """Embedder configurado (una instancia por proceso)."""
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_PROVIDER == 'openai':
+            _embedder = OpenAIEmbedder()
+        elif EMBEDDING_PROVIDER == 'gemini':
+            _embedder = GeminiEmbedder()
+        elif EMBEDDING_PROVIDER == 'hashing':
+            _embedder = HashingEmbedder()
+        else:
+            raise ValueError(f"EMBEDDING_PROVIDER desconocido: {EMBEDDING_PROVIDER}")
+    return _embedder
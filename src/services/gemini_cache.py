@@ -0,0 +1,99 @@
+"""Handles de contexto cacheado explícito de Gemini (cachedContents).
+
+Con GEMINI_EXPLICIT_CACHE=1, el prefijo estable de un prompt (instrucciones
+de sistema + documentos) se sube una vez como cachedContent y las preguntas
+siguientes sobre la misma versión de la carpeta solo envían historial y
+pregunta. La clave es el hash de modelo + prefijo, así que cualquier cambio
+en los documentos genera un handle nuevo y el viejo expira por TTL.
+
+Los handles viven en memoria del proceso (LRU acotado); cada worker crea el
+suyo la primera vez que lo necesita.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+ENABLED = os.getenv('GEMINI_EXPLICIT_CACHE', '0') == '1'
+TTL_SECONDS = int(os.getenv('GEMINI_CACHE_TTL_SECONDS', '3600'))
+# Por debajo de este tamaño Gemini rechaza el caché explícito o no compensa
+MIN_PREFIX_CHARS = int(os.getenv('GEMINI_CACHE_MIN_CHARS', '16000'))
+MAX_HANDLES = 256
+# Margen para no usar un handle a punto de expirar
+EXPIRY_MARGIN_SECONDS = 60
+
+
+class GeminiContextCache:
+    def __init__(self):
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, system_prompt, documents):
+        h = hashlib.sha256()
+        for part in (model, system_prompt, documents):
+            h.update((part or '').encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                return False, None
+            name, expires_at = entry
+            if expires_at - EXPIRY_MARGIN_SECONDS <= time.time():
+                del self._handles[key]
+                return False, None
+            self._handles.move_to_end(key)
+            return True, name
+
+    def _put(self, key, name, expires_at):
+        with self._lock:
+            self._handles[key] = (name, expires_at)
+            self._handles.move_to_end(key)
+            while len(self._handles) > MAX_HANDLES:
+                self._handles.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._handles.pop(key, None)
+
+    def handle_for(self, base_url, headers, model, system_prompt, documents):
+        """(clave, nombre del cachedContent) o (clave, None) si no aplica o falló."""
+        if not ENABLED or len(documents or '') < MIN_PREFIX_CHARS:
+            return None, None
+        key = self.key(model, system_prompt, documents)
+        found, name = self._get(key)
+        if found:
+            return key, name
+        try:
+            response = requests.post(
+                f"{base_url}/cachedContents",
+                headers=headers,
+                json={
+                    'model': f'models/{model}',
+                    'systemInstruction': {'parts': [{'text': system_prompt}]},
+                    'contents': [{'role': 'user', 'parts': [{'text': documents}]}],
+                    'ttl': f'{TTL_SECONDS}s',
+                },
+                timeout=60,
+            )
+        except requests.RequestException as e:
+            print(f"[Gemini] No se pudo crear el contexto cacheado: {e}")
+            return key, None
+        if response.status_code != 200:
+            print(f"[Gemini] Contexto cacheado rechazado: {response.status_code} - {response.text[:200]}")
+            # No reintentar este prefijo hasta que pase el TTL
+            self._put(key, None, time.time() + TTL_SECONDS)
+            return key, None
+        name = response.json().get('name')
+        self._put(key, name, time.time() + TTL_SECONDS)
+        print(f"[Gemini] Contexto cacheado {name} ({len(documents)} caracteres)")
+        return key, name
+
+
+gemini_context_cache = GeminiContextCache()
@@ -0,0 +1,232 @@
+"""Modo map-reduce para preguntas sobre carpetas que no caben en un prompt.
+
+1. Plan: los PDFs seleccionados se empaquetan en grupos de hasta
+   MAP_REDUCE_GROUP_CHARS caracteres, en orden estable (carpeta, id); un PDF
+   más grande que un grupo se parte en trozos.
+2. Map: cada grupo se pregunta al proveedor en paralelo con concurrencia
+   acotada (MAP_REDUCE_CONCURRENCY). Las respuestas parciales se cachean por
+   pregunta + modelo + versión (hash) de cada trozo, así que repetir la
+   pregunta o añadir PDFs solo recalcula los grupos que cambiaron.
+3. Reduce: las respuestas parciales relevantes se combinan en una última
+   llamada (por niveles si no caben en MAP_REDUCE_REDUCE_CHARS).
+
+Todo el proceso tiene un plazo (MAP_REDUCE_DEADLINE_SECONDS): los grupos que
+no terminan a tiempo se omiten y la respuesta lo indica.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db, Folder, PDF, PartialAnswerCache
+from src.services.admission import llm_admission
+from src.services.simple_ai_service import ai_service
+from src.services.tracing import bind, current_span, span, traced
+
+GROUP_CHARS = int(os.getenv('MAP_REDUCE_GROUP_CHARS', '60000'))
+CONCURRENCY = int(os.getenv('MAP_REDUCE_CONCURRENCY', '8'))
+DEADLINE_SECONDS = float(os.getenv('MAP_REDUCE_DEADLINE_SECONDS', '90'))
+REDUCE_CHARS = int(os.getenv('MAP_REDUCE_REDUCE_CHARS', '60000'))
+CACHE_TTL_DAYS = int(os.getenv('MAP_REDUCE_CACHE_TTL_DAYS', '7'))
+
+
+def plan_groups(folder_ids, user_id, group_chars=None):
+    """Grupos de trozos (pdf_id, nombre, carpeta, inicio, fin, largo_pdf) de hasta group_chars."""
+    group_chars = GROUP_CHARS if group_chars is None else group_chars
+    rows = (
+        db.session.query(PDF.id, PDF.original_filename, Folder.name, func.length(PDF.content))
+        .join(Folder, Folder.id == PDF.folder_id)
+        .filter(Folder.id.in_(folder_ids), Folder.user_id == user_id)
+        .order_by(Folder.id, PDF.id)
+        .all()
+    )
+    groups, current, size = [], [], 0
+    for pdf_id, name, folder_name, length in rows:
+        for start in range(0, length or 0, group_chars):
+            end = min(length, start + group_chars)
+            if current and size + (end - start) > group_chars:
+                groups.append(current)
+                current, size = [], 0
+            current.append((pdf_id, name, folder_name, start, end, length))
+            size += end - start
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _model_key():
+    info = ai_service.get_provider_info()
+    return f"{info['provider']}:{info['model']}"
+
+
+def _cache_key(question, model_key, pieces):
+    h = hashlib.sha256()
+    h.update(model_key.encode('utf-8'))
+    h.update(b'\0')
+    h.update(' '.join(question.lower().split()).encode('utf-8'))
+    for (pdf_id, _, _, start, end, _), text in pieces:
+        h.update(f"\0{pdf_id}:{start}:{end}:".encode('utf-8'))
+        h.update(hashlib.sha1(text.encode('utf-8')).digest())
+    return h.hexdigest()
+
+
+def _map_group(app, question, group, model_key):
+    """(respuesta, desde_caché). respuesta None si el proveedor falló."""
+    with app.app_context(), span('map_reduce.group', pieces=len(group)) as group_span:
+        pieces = []
+        for piece in group:
+            pdf_id, _, _, start, end, _ = piece
+            text = db.session.query(func.substr(PDF.content, start + 1, end - start)).filter(PDF.id == pdf_id).scalar()
+            pieces.append((piece, text or ''))
+        key = _cache_key(question, model_key, pieces)
+        cached = PartialAnswerCache.query.filter_by(cache_key=key).first()
+        if cached is not None:
+            cached.hits = (cached.hits or 0) + 1
+            answer = cached.answer
+            db.session.commit()
+            group_span.set_attribute('cache_hit', True)
+            return answer, True
+        # Sin conexión retenida durante la llamada al proveedor
+        db.session.close()
+
+        blocks = []
+        for (_, name, folder_name, start, end, length), text in pieces:
+            label = f"{name} (carpeta {folder_name})"
+            if start > 0 or end < length:
+                label += f" [caracteres {start}-{end} de {length}]"
+            blocks.append(f"--- DOCUMENTO: {label} ---\n{text}")
+        group_span.set_attributes(cache_hit=False, chars=sum(len(text) for _, text in pieces))
+        answer = ai_service.answer_from_documents(question, "\n\n".join(blocks))
+        if answer is None:
+            return None, False
+        try:
+            db.session.add(PartialAnswerCache(cache_key=key, answer=answer))
+            db.session.commit()
+        except IntegrityError:
+            # Otro worker la guardó a la vez
+            db.session.rollback()
+        return answer, False
+
+
+def _group_label(group):
+    names = []
+    for _, name, _, _, _, _ in group:
+        if name not in names:
+            names.append(name)
+    return ', '.join(names[:5]) + (f' y {len(names) - 5} más' if len(names) > 5 else '')
+
+
+def _combine(question, partials):
+    """Reduce por niveles hasta que las respuestas parciales quepan en un prompt."""
+    while len(partials) > 1 and sum(len(p) for p in partials) > REDUCE_CHARS:
+        batches, batch, size = [], [], 0
+        for partial in partials:
+            if batch and size + len(partial) > REDUCE_CHARS:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(partial)
+            size += len(partial)
+        batches.append(batch)
+        if len(batches) == len(partials):
+            # Cada parcial ya es del tamaño máximo: no hay nada que agrupar
+            break
+        instructions = (
+            "Combina estas respuestas parciales a la misma pregunta en una sola respuesta "
+            "parcial, sin perder datos concretos ni las referencias a documentos."
+        )
+        merged = []
+        for batch in batches:
+            if len(batch) == 1:
+                merged.append(batch[0])
+                continue
+            text = ai_service.complete(
+                instructions, f"PREGUNTA: {question}\n\n" + "\n\n".join(batch), max_tokens=800,
+                purpose='combinación de respuestas parciales',
+            )
+            merged.append(text or "\n\n".join(batch)[:REDUCE_CHARS])
+        partials = merged
+    return "\n\n".join(partials)
+
+
+def _expire_cache():
+    cutoff = datetime.utcnow() - timedelta(days=CACHE_TTL_DAYS)
+    PartialAnswerCache.query.filter(PartialAnswerCache.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@traced('map_reduce.answer')
+def answer(question, folder_ids, user_id, conversation_history=None, history_summary=None):
+    """Responde con map-reduce. Devuelve (texto, estadísticas). Requiere app context."""
+    started = time.monotonic()
+    groups = plan_groups(folder_ids, user_id)
+    stats = {'groups': len(groups), 'cache_hits': 0, 'failed': 0, 'skipped': 0, 'relevant': 0}
+    if not groups:
+        return "No hay documentos con texto en las carpetas seleccionadas.", stats
+
+    app = current_app._get_current_object()
+    model_key = _model_key()
+    db.session.close()
+
+    results = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, min(CONCURRENCY, len(groups))), thread_name_prefix='map-reduce')
+    # Cada grupo carga su llamada al hueco de la petición (uno extra si van en paralelo)
+    map_group = llm_admission.bind(bind(_map_group))
+    futures = {pool.submit(map_group, app, question, group, model_key): i for i, group in enumerate(groups)}
+    try:
+        for future in as_completed(futures, timeout=max(0.0, DEADLINE_SECONDS - (time.monotonic() - started))):
+            i = futures[future]
+            try:
+                text, from_cache = future.result()
+            except Exception as e:
+                print(f"[MapReduce] Grupo {i} falló: {e}")
+                text, from_cache = None, False
+            if text is None:
+                stats['failed'] += 1
+                continue
+            stats['cache_hits'] += int(from_cache)
+            results[i] = text
+    except FutureTimeoutError:
+        pass
+    finally:
+        # Lo que no terminó dentro del plazo no se espera
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+    stats['skipped'] = len(groups) - len(results) - stats['failed']
+
+    partials = [
+        f"RESPUESTA PARCIAL {n} (documentos: {_group_label(groups[i])}):\n{results[i]}"
+        for n, i in enumerate(sorted(i for i in results if results[i]), start=1)
+    ]
+    stats['relevant'] = len(partials)
+    if not partials:
+        text = "No encuentro esa información en los documentos proporcionados"
+    else:
+        context = (
+            "Las siguientes son respuestas parciales obtenidas analizando por separado "
+            "grupos de documentos. Combínalas en una única respuesta.\n\n" + _combine(question, partials)
+        )
+        text = ai_service.generate_response(question, context, conversation_history, history_summary=history_summary)
+    missing = stats['skipped'] + stats['failed']
+    if missing:
+        text += (
+            f"\n\n(Nota: {missing} de {len(groups)} grupos de documentos no pudieron analizarse a tiempo; "
+            "la respuesta puede estar incompleta.)"
+        )
+    stats['seconds'] = round(time.monotonic() - started, 2)
+    current_span().set_attributes(**{f'map_reduce.{k}': v for k, v in stats.items()})
+    print(
+        f"[MapReduce] grupos={stats['groups']} cache={stats['cache_hits']} relevantes={stats['relevant']} "
+        f"fallidos={stats['failed']} omitidos={stats['skipped']} en {stats['seconds']}s"
+    )
+    try:
+        _expire_cache()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[MapReduce] No se pudo limpiar la caché: {e}")
+    return text, stats
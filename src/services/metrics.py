@@ -0,0 +1,251 @@
+"""Métricas en formato Prometheus expuestas en /metrics.
+
+- Peticiones HTTP: latencia por blueprint, ruta (plantilla de la URL, no la
+  URL concreta) y estado, más consultas SQL y tiempo de DB por petición.
+- Google Drive: llamadas por método de la API y resultado.
+- Proveedores de IA: latencia por proveedor/modelo y tokens (prompt,
+  cacheados, completados), más la cola de admisión (profundidad, huecos
+  ocupados y espera por hueco).
+- Extracción de texto de PDFs (tiempo por página) y duración de las
+  sincronizaciones con Drive.
+
+Con gunicorn, gunicorn.conf.py define PROMETHEUS_MULTIPROC_DIR y cada worker
+escribe sus valores en ese directorio; /metrics agrega los de todos. Sin esa
+variable (servidor de desarrollo) se usa el registro del proceso.
+
+prometheus_client es opcional: si no está instalado las métricas no hacen
+nada y /metrics responde 501. METRICS_TOKEN, si está definido, exige
+"Authorization: Bearer <token>" para leerlas. Sin token, /metrics solo es
+público fuera de producción: con FLASK_ENV=production responde 403 salvo
+que METRICS_PUBLIC=1 lo abra explícitamente (p. ej. detrás de una red
+privada).
+"""
+import os
+import time
+
+from flask import Response, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Sin token: público en desarrollo, cerrado en producción salvo METRICS_PUBLIC=1
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', '0' if os.getenv('FLASK_ENV') == 'production' else '1') == '1'
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+PAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+SYNC_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ADMISSION_BUCKETS = (0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+class _NoopMetric:
+    """Sustituto cuando prometheus_client no está instalado."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+HTTP_REQUEST_SECONDS = _metric(
+    'Histogram', 'http_request_duration_seconds',
+    'Latencia de las peticiones HTTP', ('blueprint', 'route', 'method', 'status'), buckets=HTTP_BUCKETS,
+)
+HTTP_IN_PROGRESS = _metric(
+    'Gauge', 'http_requests_in_progress',
+    'Peticiones HTTP en curso', ('blueprint',), multiprocess_mode='livesum',
+)
+DB_QUERIES_PER_REQUEST = _metric(
+    'Histogram', 'http_request_db_queries',
+    'Consultas SQL por petición HTTP', ('blueprint', 'route'), buckets=QUERY_COUNT_BUCKETS,
+)
+DB_SECONDS_PER_REQUEST = _metric(
+    'Histogram', 'http_request_db_seconds',
+    'Tiempo total en la DB por petición HTTP', ('blueprint', 'route'), buckets=HTTP_BUCKETS,
+)
+DB_QUERY_SECONDS = _metric(
+    'Histogram', 'db_query_duration_seconds',
+    'Duración de cada consulta SQL', ('operation',), buckets=DB_BUCKETS,
+)
+DRIVE_CALLS = _metric(
+    'Counter', 'drive_api_calls_total',
+    'Llamadas a la API de Google Drive', ('method', 'outcome'),
+)
+DRIVE_CALL_SECONDS = _metric(
+    'Histogram', 'drive_api_call_duration_seconds',
+    'Duración de las llamadas a Google Drive', ('method',), buckets=HTTP_BUCKETS,
+)
+LLM_CALL_SECONDS = _metric(
+    'Histogram', 'llm_request_duration_seconds',
+    'Latencia de las llamadas al proveedor de IA', ('provider', 'model', 'outcome'), buckets=LLM_BUCKETS,
+)
+LLM_TOKENS = _metric(
+    'Counter', 'llm_tokens_total',
+    'Tokens reportados por el proveedor de IA', ('provider', 'model', 'kind'),
+)
+EXTRACTION_PAGE_SECONDS = _metric(
+    'Histogram', 'pdf_extraction_page_seconds',
+    'Tiempo de extracción de texto por página', buckets=PAGE_BUCKETS,
+)
+EXTRACTION_PAGES = _metric(
+    'Counter', 'pdf_extraction_pages_total',
+    'Páginas de PDF procesadas', ('outcome',),
+)
+SYNC_SECONDS = _metric(
+    'Histogram', 'drive_sync_duration_seconds',
+    'Duración de las sincronizaciones con Drive', ('kind', 'outcome'), buckets=SYNC_BUCKETS,
+)
+
+LLM_ADMISSION_QUEUE_DEPTH = _metric(
+    'Gauge', 'llm_admission_queue_depth',
+    'Llamadas de IA esperando hueco en la cola de admisión', multiprocess_mode='livesum',
+)
+LLM_ADMISSION_ACTIVE = _metric(
+    'Gauge', 'llm_admission_active_slots',
+    'Huecos de admisión ocupados (llamadas de IA en curso)', multiprocess_mode='livesum',
+)
+LLM_ADMISSION_WAIT_SECONDS = _metric(
+    'Histogram', 'llm_admission_wait_seconds',
+    'Espera por un hueco de admisión', ('outcome',), buckets=ADMISSION_BUCKETS,
+)
+LLM_ADMISSION_REJECTED = _metric(
+    'Counter', 'llm_admission_rejected_total',
+    'Peticiones de IA rechazadas por la admisión', ('reason',),
+)
+
+
+def observe_drive_call(method, outcome, seconds):
+    DRIVE_CALLS.labels(method, outcome).inc()
+    DRIVE_CALL_SECONDS.labels(method).observe(seconds)
+
+
+def observe_llm_call(provider, model, outcome, seconds):
+    LLM_CALL_SECONDS.labels(provider, model, outcome).observe(seconds)
+
+
+def count_llm_tokens(provider, model, prompt_tokens, cached_tokens, completion_tokens):
+    for kind, amount in (('prompt', prompt_tokens), ('cached', cached_tokens), ('completion', completion_tokens)):
+        if amount:
+            LLM_TOKENS.labels(provider, model, kind).inc(amount)
+
+
+def observe_extraction(pages, seconds, ok=True):
+    EXTRACTION_PAGES.labels('ok' if ok else 'error').inc(pages)
+    if pages:
+        EXTRACTION_PAGE_SECONDS.observe(seconds / pages)
+
+
+def observe_sync(kind, outcome, seconds):
+    SYNC_SECONDS.labels(kind, outcome).observe(seconds)
+
+
+def set_admission_gauges(queue_depth, active):
+    LLM_ADMISSION_QUEUE_DEPTH.set(queue_depth)
+    LLM_ADMISSION_ACTIVE.set(active)
+
+
+def observe_admission(outcome, seconds=None):
+    """outcome: admitted, rejected (cola llena) o timed_out (plazo en cola vencido)."""
+    if outcome != 'admitted':
+        LLM_ADMISSION_REJECTED.labels(outcome).inc()
+    if seconds is not None:
+        LLM_ADMISSION_WAIT_SECONDS.labels(outcome).observe(seconds)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    DB_QUERY_SECONDS.labels(operation).observe(elapsed)
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_db_queries += 1
+        g.metrics_db_seconds += elapsed
+
+
+def _route_labels():
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return request.blueprint or 'app', rule
+
+
+def metrics_response():
+    """Texto de exposición con los valores de todos los workers."""
+    if prometheus_client is None:
+        return jsonify({'error': 'prometheus_client no está instalado'}), 501
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization', '') != f'Bearer {METRICS_TOKEN}':
+            return jsonify({'error': 'No autorizado'}), 401
+    elif not METRICS_PUBLIC:
+        return jsonify({'error': 'Define METRICS_TOKEN (o METRICS_PUBLIC=1) para exponer /metrics'}), 403
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    @app.before_request
+    def _metrics_start():
+        g.metrics_started = time.perf_counter()
+        g.metrics_db_queries = 0
+        g.metrics_db_seconds = 0.0
+        HTTP_IN_PROGRESS.labels(request.blueprint or 'app').inc()
+
+    @app.after_request
+    def _metrics_observe(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        blueprint, route = _route_labels()
+        HTTP_IN_PROGRESS.labels(blueprint).dec()
+        HTTP_REQUEST_SECONDS.labels(blueprint, route, request.method, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        DB_QUERIES_PER_REQUEST.labels(blueprint, route).observe(g.metrics_db_queries)
+        DB_SECONDS_PER_REQUEST.labels(blueprint, route).observe(g.metrics_db_seconds)
+        return response
+
+    @app.teardown_request
+    def _metrics_abort(error=None):
+        # Excepción no capturada: after_request no llegó a ejecutarse
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        blueprint, route = _route_labels()
+        HTTP_IN_PROGRESS.labels(blueprint).dec()
+        HTTP_REQUEST_SECONDS.labels(blueprint, route, request.method, '500').observe(time.perf_counter() - started)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_response)
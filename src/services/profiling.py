@@ -0,0 +1,343 @@
+"""Perfilado bajo demanda de un worker en producción.
+
+Dos herramientas, ambas sin coste mientras están apagadas:
+
+- Perfil de peticiones: al armarlo se añaden hooks before/teardown a la app
+  (y se quitan al terminar), así que sin perfil activo no hay nada en el
+  camino de cada petición. Modos:
+    * cprofile: cProfile por petición durante las N siguientes peticiones,
+      acumulado en un .prof (pstats; snakeviz, gprof2dot, flameprof...).
+    * sample: un hilo del sistema muestrea las pilas de todos los hilos cada
+      intervalo mientras pasan las N peticiones y genera pilas plegadas
+      ("a;b;c 42"), el formato de flamegraph.pl y speedscope.
+- Memoria: tracemalloc se arranca con la primera instantánea y se para al
+  borrarla; el diff contra la instantánea base muestra dónde crece la
+  memoria, junto con los objetos ORM vivos (p. ej. PDFs con su content).
+
+El estado es del proceso que atiende la petición de administración (cada
+worker de gunicorn se perfila por separado); los volcados se guardan en
+PROFILE_DIR para poder descargarlos desde cualquier worker.
+"""
+import cProfile
+import gc
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_DIR = os.getenv(
+    'PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'profiles'),
+)
+DEFAULT_REQUESTS = 20
+MAX_REQUESTS = 1000
+DEFAULT_INTERVAL_MS = 5
+# Un perfil olvidado se desarma solo
+MAX_PROFILE_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '600'))
+TRACEMALLOC_FRAMES = 25
+
+
+def _real_thread_class():
+    """threading.Thread sin parchear: con gevent el muestreador debe ser un hilo real."""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return monkey.get_original('threading', 'Thread')
+    except ImportError:
+        pass
+    return threading.Thread
+
+
+def _real_sleep():
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('time'):
+            return monkey.get_original('time', 'sleep')
+    except ImportError:
+        pass
+    return time.sleep
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    # Rutas relativas al proyecto o a site-packages para pilas legibles
+    for marker in (os.sep + 'site-packages' + os.sep, os.sep + 'src' + os.sep):
+        index = filename.rfind(marker)
+        if index >= 0:
+            filename = filename[index + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class _StackSampler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = _real_thread_class()(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        sleep = _real_sleep()
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            sleep(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """Perfil armado sobre las próximas N peticiones de este proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.app = None
+        self.session = None
+        self.last_result = None
+
+    # ---- Armado / desarmado -------------------------------------------------
+
+    def arm(self, app, mode='sample', requests=DEFAULT_REQUESTS, interval_ms=DEFAULT_INTERVAL_MS, path_prefix=None):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError("mode debe ser 'sample' o 'cprofile'")
+        requests = max(1, min(int(requests), MAX_REQUESTS))
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError('Ya hay un perfil en curso en este worker')
+            self.app = app
+            self.session = {
+                'id': uuid.uuid4().hex[:12],
+                'mode': mode,
+                'requested': requests,
+                'remaining': requests,
+                'path_prefix': path_prefix or '/api/',
+                'started_at': time.time(),
+                'pid': os.getpid(),
+                'profile': cProfile.Profile() if mode == 'cprofile' else None,
+                'sampler': _StackSampler(max(1, int(interval_ms)) / 1000.0) if mode == 'sample' else None,
+                'routes': Counter(),
+            }
+            if self.session['sampler'] is not None:
+                self.session['sampler'].start()
+            # Listas nuevas en vez de mutar las que Flask puede estar recorriendo
+            app.before_request_funcs[None] = app.before_request_funcs.get(None, []) + [self._before]
+            app.teardown_request_funcs[None] = app.teardown_request_funcs.get(None, []) + [self._teardown]
+            print(f"[Profile] {mode} armado para {requests} peticiones (pid {os.getpid()})")
+            return self.status()
+
+    def disarm(self):
+        """Quita los hooks y guarda el volcado. Devuelve el resultado o None."""
+        with self._lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            app = self.app
+            for funcs, hook in ((app.before_request_funcs, self._before), (app.teardown_request_funcs, self._teardown)):
+                funcs[None] = [func for func in funcs.get(None, []) if func != hook]
+        self.last_result = self._dump(session)
+        print(f"[Profile] {session['mode']} terminado: {self.last_result['file']}")
+        return self.last_result
+
+    def status(self):
+        session = self.session
+        if session is None:
+            return {'armed': False, 'pid': os.getpid(), 'last_result': self.last_result}
+        return {
+            'armed': True,
+            'pid': session['pid'],
+            'id': session['id'],
+            'mode': session['mode'],
+            'requested': session['requested'],
+            'remaining': session['remaining'],
+            'path_prefix': session['path_prefix'],
+            'elapsed_seconds': round(time.time() - session['started_at'], 1),
+        }
+
+    # ---- Hooks de petición (solo instalados con un perfil armado) ------------
+
+    def _before(self):
+        session = self.session
+        if session is None or not request.path.startswith(session['path_prefix']):
+            return None
+        if request.path.startswith('/api/admin/'):
+            return None
+        if session['profile'] is not None:
+            # cProfile no admite perfiles simultáneos en el mismo hilo
+            try:
+                session['profile'].enable()
+            except ValueError:
+                return None
+        g.profiling_session = session['id']
+        return None
+
+    def _teardown(self, error=None):
+        session = self.session
+        if session is None or g.pop('profiling_session', None) != session['id']:
+            return
+        if session['profile'] is not None:
+            session['profile'].disable()
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        with self._lock:
+            session['routes'][f"{request.method} {rule}"] += 1
+            session['remaining'] -= 1
+            done = session['remaining'] <= 0
+        if done or time.time() - session['started_at'] > MAX_PROFILE_SECONDS:
+            self.disarm()
+
+    # ---- Volcados ------------------------------------------------------------
+
+    def _dump(self, session):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if session['mode'] == 'cprofile':
+            path = os.path.join(PROFILE_DIR, f"{session['id']}.prof")
+            session['profile'].dump_stats(path)
+            extra = {}
+        else:
+            sampler = session['sampler']
+            sampler.stop()
+            path = os.path.join(PROFILE_DIR, f"{session['id']}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(sampler.folded())
+            extra = {'samples': sampler.samples, 'unique_stacks': len(sampler.stacks)}
+        result = {
+            'id': session['id'],
+            'mode': session['mode'],
+            'pid': session['pid'],
+            'requests': session['requested'] - max(0, session['remaining']),
+            'seconds': round(time.time() - session['started_at'], 2),
+            'routes': dict(session['routes']),
+            'file': os.path.basename(path),
+        }
+        result.update(extra)
+        return result
+
+
+def profile_path(profile_id):
+    """Ruta del volcado o None; solo ids generados aquí (sin rutas arbitrarias)."""
+    if not profile_id or not all(c in '0123456789abcdef' for c in profile_id):
+        return None
+    for ext in ('.folded', '.prof'):
+        path = os.path.join(PROFILE_DIR, profile_id + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def pstats_text(path, limit=50, sort='cumulative'):
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = []
+    for name in sorted(os.listdir(PROFILE_DIR)):
+        path = os.path.join(PROFILE_DIR, name)
+        entries.append({'file': name, 'bytes': os.path.getsize(path), 'modified': os.path.getmtime(path)})
+    return entries
+
+
+# ---- tracemalloc --------------------------------------------------------------
+
+_baseline = {'snapshot': None, 'taken_at': None}
+
+
+def memory_snapshot():
+    """Arranca tracemalloc si hace falta y fija la instantánea base."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    _baseline['snapshot'] = tracemalloc.take_snapshot()
+    _baseline['taken_at'] = time.time()
+    current, peak = tracemalloc.get_traced_memory()
+    return {'pid': os.getpid(), 'tracing': True, 'traced_bytes': current, 'peak_bytes': peak}
+
+
+def memory_stop():
+    _baseline['snapshot'] = None
+    _baseline['taken_at'] = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return {'pid': os.getpid(), 'tracing': False}
+
+
+def _orm_objects():
+    """Instancias ORM vivas por clase y caracteres de texto retenidos."""
+    from src.models.user import db
+    mapped = {mapper.class_ for mapper in db.Model.registry.mappers}
+    counts = Counter()
+    text_chars = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls not in mapped:
+            continue
+        counts[cls.__name__] += 1
+        # Solo atributos ya cargados: no disparar lazy loads
+        for key in ('content', 'summary'):
+            value = obj.__dict__.get(key)
+            if isinstance(value, str):
+                text_chars[f"{cls.__name__}.{key}"] += len(value)
+    return {'instances': dict(counts), 'loaded_text_chars': dict(text_chars)}
+
+
+def memory_diff(limit=25, group_by='lineno'):
+    """Top de diferencias contra la instantánea base. None si no hay base."""
+    if _baseline['snapshot'] is None or not tracemalloc.is_tracing():
+        return None
+    if group_by not in ('lineno', 'traceback', 'filename'):
+        group_by = 'lineno'
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+    stats = snapshot.compare_to(_baseline['snapshot'], group_by)
+    top = []
+    for stat in stats[:max(1, min(int(limit), 200))]:
+        top.append({
+            'size_diff_bytes': stat.size_diff,
+            'size_bytes': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        })
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'pid': os.getpid(),
+        'seconds_since_baseline': round(time.time() - _baseline['taken_at'], 1),
+        'traced_bytes': current,
+        'peak_bytes': peak,
+        'total_diff_bytes': sum(stat.size_diff for stat in stats),
+        'top': top,
+        'orm': _orm_objects(),
+    }
+
+
+request_profiler = RequestProfiler()
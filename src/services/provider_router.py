@@ -0,0 +1,223 @@
+"""Enrutado entre proveedores de IA con métricas de latencia, failover y hedging.
+
+Por cada (proveedor, modelo) se guardan las últimas latencias y resultados
+del proceso. Un destino con muchos errores recientes queda en enfriamiento
+y se salta mientras haya otro sano. Si AI_HEDGE_AFTER_MS está definido (ms o
+'auto' = p95 del destino principal), cuando el primero tarda más que ese
+umbral se lanza la misma petición al siguiente y gana la primera respuesta.
+
+Cada llamada lanzada (también las de hedging y failover) ocupa su propio
+hueco de la admisión (src/services/admission.py) mientras dura, incluso la
+perdedora que sigue en segundo plano; así map-reduce y los resúmenes en
+segundo plano también cuentan para LLM_MAX_CONCURRENT.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.services.admission import llm_admission
+from src.services.metrics import count_llm_tokens, observe_llm_call
+from src.services.tracing import KIND_CLIENT, bind, span
+
+WINDOW = 200
+# Enfriamiento: con al menos MIN_CALLS en la ventana reciente y esta tasa de error
+UNHEALTHY_MIN_CALLS = 5
+UNHEALTHY_ERROR_RATE = 0.5
+HEALTH_WINDOW = 20
+COOLDOWN_SECONDS = float(os.getenv('AI_PROVIDER_COOLDOWN_SECONDS', '30'))
+HEDGE_AFTER = os.getenv('AI_HEDGE_AFTER_MS', '').strip().lower()
+# Con 'auto' no se hace hedging hasta tener muestras suficientes
+HEDGE_MIN_SAMPLES = 20
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('AI_ROUTER_THREADS', '32')), thread_name_prefix='ai-router')
+
+
+class ProviderError(Exception):
+    """Fallo de un proveedor; el mensaje es apto para mostrar al usuario."""
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class TargetStats:
+    def __init__(self):
+        self.latencies = deque(maxlen=WINDOW)
+        self.outcomes = deque(maxlen=WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.hedges_won = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.last_error = None
+        self.last_error_at = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok, error=None):
+        with self.lock:
+            self.calls += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+            else:
+                self.errors += 1
+                self.last_error = error
+                self.last_error_at = time.time()
+
+    def record_usage(self, prompt_tokens, cached_tokens, completion_tokens):
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+
+    def healthy(self):
+        with self.lock:
+            recent = list(self.outcomes)[-HEALTH_WINDOW:]
+            last_error_at = self.last_error_at
+        if len(recent) < UNHEALTHY_MIN_CALLS:
+            return True
+        error_rate = recent.count(False) / len(recent)
+        return error_rate < UNHEALTHY_ERROR_RATE or time.time() - last_error_at > COOLDOWN_SECONDS
+
+    def percentile(self, pct):
+        with self.lock:
+            return _percentile(list(self.latencies), pct)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            recent = list(self.outcomes)
+            data = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'hedges_won': self.hedges_won,
+                'last_error': self.last_error,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+        data.update(
+            p50_ms=None if not latencies else round(_percentile(latencies, 50) * 1000, 1),
+            p95_ms=None if not latencies else round(_percentile(latencies, 95) * 1000, 1),
+            cache_hit_ratio=round(data['cached_tokens'] / data['prompt_tokens'], 3) if data['prompt_tokens'] else 0.0,
+            recent_error_rate=round(recent.count(False) / len(recent), 3) if recent else 0.0,
+            healthy=self.healthy(),
+        )
+        return data
+
+
+class ProviderRouter:
+    """Ejecuta una petición contra una lista ordenada de destinos (proveedor, modelo)."""
+
+    def __init__(self, hedge_after=HEDGE_AFTER):
+        self.hedge_after = hedge_after
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, target):
+        with self._lock:
+            if target not in self.stats:
+                self.stats[target] = TargetStats()
+            return self.stats[target]
+
+    def order(self, targets):
+        """Destinos sanos primero, conservando el orden de preferencia."""
+        healthy = [t for t in targets if self._stats(t).healthy()]
+        return healthy + [t for t in targets if t not in healthy]
+
+    def _hedge_delay(self, target):
+        if not self.hedge_after or self.hedge_after in ('0', 'off'):
+            return None
+        if self.hedge_after == 'auto':
+            stats = self._stats(target)
+            if len(stats.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return stats.percentile(95)
+        return float(self.hedge_after) / 1000.0
+
+    def _timed(self, target, fn):
+        started = time.perf_counter()
+        try:
+            with span('llm.call', KIND_CLIENT, **{'llm.provider': target[0], 'llm.model': target[1]}):
+                result = fn()
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            self._stats(target).record(elapsed, False, str(e)[:200])
+            observe_llm_call(target[0], target[1], 'error', elapsed)
+            raise
+        elapsed = time.perf_counter() - started
+        self._stats(target).record(elapsed, True)
+        observe_llm_call(target[0], target[1], 'ok', elapsed)
+        return result
+
+    def _admitted(self, target, fn):
+        with llm_admission.provider_call():
+            return self._timed(target, fn)
+
+    def call(self, calls, hedge=True):
+        """calls: lista ordenada de ((proveedor, modelo), función sin argumentos).
+
+        Devuelve el resultado del primer destino que responda. Si uno falla
+        se pasa al siguiente; si tarda más que el umbral de hedging se lanza
+        el siguiente en paralelo. Lanza ProviderError si fallan todos.
+        """
+        if not calls:
+            raise ProviderError("Error: No se ha configurado correctamente el proveedor de IA. "
+                                "Por favor, configura las credenciales de OpenAI o Gemini.")
+        functions = dict(calls)
+        targets = self.order([target for target, _ in calls])
+        pending = {}
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            target = targets[next_index]
+            next_index += 1
+            task = bind(llm_admission.bind(self._admitted))
+            pending[_executor.submit(task, target, functions[target])] = target
+
+        launch()
+        hedge_delay = self._hedge_delay(targets[0]) if hedge and len(targets) > 1 else None
+        hedged = False
+        while pending:
+            timeout = hedge_delay if not hedged and hedge_delay is not None else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # El principal va lento: pedir lo mismo al siguiente destino
+                hedged = True
+                if next_index < len(targets):
+                    launch()
+                continue
+            for future in done:
+                target = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if hedged and target != targets[0]:
+                    with self._stats(target).lock:
+                        self._stats(target).hedges_won += 1
+                # La petición perdedora sigue en segundo plano y registra sus métricas
+                return result
+            if not pending and next_index < len(targets):
+                launch()
+        last = errors[-1]
+        raise last if isinstance(last, ProviderError) else ProviderError(str(last))
+
+    def record_usage(self, target, prompt_tokens, cached_tokens, completion_tokens):
+        """Tokens reportados por el proveedor; cached_tokens es la parte servida desde caché de prefijo."""
+        self._stats(target).record_usage(prompt_tokens, cached_tokens, completion_tokens)
+        count_llm_tokens(target[0], target[1], prompt_tokens, cached_tokens, completion_tokens)
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self.stats.items())
+        return {f"{provider}:{model}": stats.snapshot() for (provider, model), stats in items}
@@ -0,0 +1,234 @@
+"""Registro de consultas lentas y detector de N+1 sobre los eventos de SQLAlchemy.
+
+Por cada petición se cuentan las sentencias SQL y su tiempo. Al terminar:
+- Las consultas que superan SLOW_QUERY_MS se registran con su plan
+  (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en PostgreSQL/MySQL).
+- Una misma sentencia repetida N_PLUS_ONE_THRESHOLD veces o más en la misma
+  petición se marca como probable N+1, con la línea de código que la lanzó
+  (típico de relaciones lazy recorridas en un bucle).
+
+capture_queries(explain=True) guarda además el plan de cada sentencia
+distinta del bloque (lo usa loadtest/scale.py para exigir índices).
+
+Para tests, query_budget() cuenta las consultas de un bloque y falla si se
+pasa del presupuesto o hay N+1. Con pytest se puede usar como fixture
+activando el plugin en conftest.py:
+
+    pytest_plugins = ['src.services.query_audit']
+
+    def test_listado(client, query_budget):
+        with query_budget(5):
+            client.get('/api/folders')
+
+query_budget() y capture_queries() funcionan siempre. El registro por
+petición se activa con QUERY_AUDIT=1 (QUERY_AUDIT=0 lo apaga); sin definir
+solo está activo en tests (pytest) y con la app en modo debug, para no
+pagar el coste de los hooks en producción.
+"""
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_AUDIT = os.getenv('QUERY_AUDIT', '').strip()
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+# Sentencias con plan consultable (no se explica DDL ni PRAGMA)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+MAX_STATEMENT_CHARS = 300
+
+_THIS_FILE = os.path.abspath(__file__)
+_SRC_DIR = os.path.dirname(os.path.dirname(_THIS_FILE))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Un bloque superó su presupuesto de consultas o tuvo N+1."""
+
+
+def _short(statement):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= MAX_STATEMENT_CHARS else statement[:MAX_STATEMENT_CHARS] + '...'
+
+
+def _call_site():
+    """Primera línea del proyecto (fuera de este módulo) que lanzó la consulta."""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_SRC_DIR) and filename != _THIS_FILE:
+            return f"{os.path.relpath(filename, os.path.dirname(_SRC_DIR))}:{frame.lineno} ({frame.name})"
+    return None
+
+
+class QueryLog:
+    """Consultas de una petición o de un bloque de test."""
+
+    def __init__(self, n_plus_one_threshold=None, explain=False):
+        self.threshold = N_PLUS_ONE_THRESHOLD if n_plus_one_threshold is None else n_plus_one_threshold
+        self.explain = explain
+        # sentencia -> plan (solo con explain=True; una vez por sentencia distinta)
+        self.plans = {}
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.call_sites = {}
+        self.slow = []
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+        if self.statements[statement] == self.threshold:
+            # La pila solo se inspecciona una vez por sentencia sospechosa
+            self.call_sites[statement] = _call_site()
+
+    def repeated(self):
+        """[(sentencia, veces, origen)] de las sentencias repetidas >= umbral."""
+        return [
+            (statement, times, self.call_sites.get(statement))
+            for statement, times in self.statements.most_common()
+            if times >= self.threshold
+        ]
+
+    def describe(self):
+        lines = [f"{self.count} consultas en {self.seconds * 1000:.1f} ms"]
+        for statement, times, site in self.repeated():
+            lines.append(f"  N+1 probable: {times}x {_short(statement)}" + (f" [{site}]" if site else ''))
+        return '\n'.join(lines)
+
+
+# Registros activos fuera de peticiones (query_budget en tests, herramientas)
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+def _explain(conn, statement, parameters):
+    """Plan de la consulta como texto, o None si no se puede obtener."""
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    if operation not in EXPLAINABLE:
+        return None
+    dialect = conn.engine.dialect.name
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    try:
+        # Cursor DBAPI directo: no pasa por los eventos de SQLAlchemy
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception as e:
+        return f"(sin plan: {e})"
+    if dialect == 'sqlite':
+        return ' | '.join(str(row[-1]) for row in rows)
+    return ' | '.join(' '.join(str(col) for col in row) for row in rows)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('audit_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('audit_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'query_log' in g:
+        g.query_log.record(statement, elapsed)
+    if _collectors:
+        with _collectors_lock:
+            for log in _collectors:
+                log.record(statement, elapsed)
+                if log.explain and not executemany and statement not in log.plans:
+                    log.plans[statement] = _explain(conn, statement, parameters)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        where = f"{request.method} {request.path} " if has_request_context() else ''
+        plan = None if executemany else _explain(conn, statement, parameters)
+        print(
+            f"[SlowQuery] {where}{elapsed * 1000:.1f} ms: {_short(statement)}"
+            + (f"\n[SlowQuery] plan: {plan}" if plan else '')
+        )
+        if has_request_context() and 'query_log' in g:
+            g.query_log.slow.append((statement, elapsed, plan))
+
+
+def _start_request_log():
+    g.query_log = QueryLog()
+
+
+def _report_request_log(error=None):
+    log = g.pop('query_log', None)
+    if log is None:
+        return
+    for statement, times, site in log.repeated():
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        print(
+            f"[N+1] {request.method} {route}: {times}x {_short(statement)}"
+            + (f" desde {site}" if site else '')
+        )
+
+
+@contextmanager
+def capture_queries(n_plus_one_threshold=None, explain=False):
+    """Registra las consultas del bloque (en cualquier petición o hilo); con
+    explain=True también el plan de cada sentencia distinta en log.plans."""
+    log = QueryLog(n_plus_one_threshold, explain=explain)
+    _install_listeners()
+    with _collectors_lock:
+        _collectors.append(log)
+    try:
+        yield log
+    finally:
+        with _collectors_lock:
+            _collectors.remove(log)
+
+
+@contextmanager
+def query_budget(max_queries, allow_n_plus_one=False, n_plus_one_threshold=None):
+    """Falla con QueryBudgetExceeded si el bloque supera max_queries o tiene N+1."""
+    with capture_queries(n_plus_one_threshold) as log:
+        yield log
+    problems = []
+    if log.count > max_queries:
+        problems.append(f"{log.count} consultas (presupuesto {max_queries})")
+    if not allow_n_plus_one and log.repeated():
+        problems.append("sentencias repetidas (N+1)")
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems) + '\n' + log.describe())
+
+
+def _install_listeners():
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def audit_enabled(app):
+    """QUERY_AUDIT=1/0 manda; sin definir, solo en tests y en modo debug."""
+    if QUERY_AUDIT:
+        return QUERY_AUDIT == '1'
+    return 'pytest' in sys.modules or app.debug
+
+
+def init_query_audit(app):
+    if not audit_enabled(app) or app.extensions.get('query_audit'):
+        return
+    app.extensions['query_audit'] = True
+    _install_listeners()
+    app.before_request(_start_request_log)
+    app.teardown_request(_report_request_log)
+
+
+if 'pytest' in sys.modules:
+    import pytest
+
+    @pytest.fixture(name='query_budget')
+    def query_budget_fixture():
+        """Fixture: `with query_budget(n): ...` falla el test si se supera n o hay N+1."""
+        return query_budget
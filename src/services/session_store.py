@@ -0,0 +1,243 @@
+"""Backends de sesión intercambiables (SESSION_BACKEND).
+
+- cookie (por defecto): sesión firmada en la propia cookie. Sin estado en el
+  servidor, funciona con varias instancias y no toca disco.
+- sqlite: sesión en servidor guardada en un SQLite aparte con columna de
+  expiración indexada. Compartida entre los workers del mismo host.
+- memory: LRU acotado en memoria del proceso. Solo para un único worker.
+- filesystem: comportamiento anterior con Flask-Session (compatibilidad).
+
+Las sesiones en servidor solo se escriben cuando cambian (o cuando les queda
+menos de la mitad de vida) y un hilo en segundo plano borra las expiradas.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from src.services.sqlite_pool import SQLitePool
+
+SESSION_DB_PATH = os.getenv(
+    'SESSION_SQLITE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'sessions.db'),
+)
+SWEEP_INTERVAL_SECONDS = int(os.getenv('SESSION_SWEEP_INTERVAL', '300'))
+SWEEP_BATCH = 1000
+MEMORY_MAX_ENTRIES = int(os.getenv('SESSION_MEMORY_MAX', '10000'))
+
+_serializer = TaggedJSONSerializer()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class _ServerSideSessionInterface(SessionInterface):
+    """Cookie con el id de sesión firmado; los datos viven en el store."""
+
+    session_class = ServerSideSession
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session', key_derivation='hmac')
+
+    # --- operaciones del store (implementadas por cada backend) ---
+    def load(self, sid):
+        """(datos, expires_at) o None si no existe o expiró."""
+        raise NotImplementedError
+
+    def store(self, sid, data, expires_at):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Borra sesiones expiradas. Devuelve cuántas."""
+        return 0
+
+    # --- SessionInterface ---
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                loaded = self.load(sid)
+                if loaded is not None:
+                    data, expires_at = loaded
+                    return self.session_class(data, sid=sid, expires_at=expires_at)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        response.vary.add('Cookie')
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Renovar solo si cambió o si le queda menos de la mitad de vida
+        needs_refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or session.new or needs_refresh):
+            return
+
+        expires_at = now + lifetime
+        self.store(session.sid, dict(session), expires_at)
+        session.expires_at = expires_at
+        if session.new or session.modified or session.permanent:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid.encode('utf-8')).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+class SQLiteSessionInterface(_ServerSideSessionInterface):
+    def __init__(self, path=SESSION_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Pool compartido por hilos y greenlets: abrir SQLite en cada request costaría más que la consulta
+        self._pool = SQLitePool(path, on_connect=lambda conn: conn.execute("PRAGMA synchronous=NORMAL"))
+        with self._pool.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expiry REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_session_expiry ON session (expiry)")
+
+    def load(self, sid):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                "SELECT data, expiry FROM session WHERE sid = ? AND expiry > ?", (sid, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return _serializer.loads(row[0]), row[1]
+        except ValueError:
+            return None
+
+    def store(self, sid, data, expires_at):
+        with self._pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session (sid, data, expiry) VALUES (?, ?, ?)",
+                (sid, _serializer.dumps(data), expires_at),
+            )
+
+    def delete(self, sid):
+        with self._pool.connection() as conn:
+            conn.execute("DELETE FROM session WHERE sid = ?", (sid,))
+
+    def sweep(self):
+        total = 0
+        while True:
+            with self._pool.connection() as conn:
+                cur = conn.execute(
+                    "DELETE FROM session WHERE rowid IN (SELECT rowid FROM session WHERE expiry < ? LIMIT ?)",
+                    (time.time(), SWEEP_BATCH),
+                )
+            total += cur.rowcount
+            if cur.rowcount < SWEEP_BATCH:
+                return total
+
+
+class MemorySessionInterface(_ServerSideSessionInterface):
+    def __init__(self, max_entries=MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            # Copia: el dict guardado no debe mutar fuera de store()
+            return dict(entry[0]), entry[1]
+
+    def store(self, sid, data, expires_at):
+        with self._lock:
+            self._data[sid] = (data, expires_at)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, exp) in self._data.items() if exp <= now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+def _start_sweeper(interface):
+    if SWEEP_INTERVAL_SECONDS <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(SWEEP_INTERVAL_SECONDS)
+            try:
+                removed = interface.sweep()
+                if removed:
+                    print(f"[Session] {removed} sesiones expiradas eliminadas")
+            except Exception as e:
+                print(f"[Session] Error limpiando sesiones: {e}")
+
+    thread = threading.Thread(target=loop, name='session-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_session_backend(app):
+    """Configura app.session_interface según app.config['SESSION_BACKEND']."""
+    backend = (app.config.get('SESSION_BACKEND') or 'cookie').lower()
+    if backend == 'filesystem':
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'filesystem'
+        Session(app)
+    elif backend == 'sqlite':
+        app.session_interface = SQLiteSessionInterface(app.config.get('SESSION_SQLITE_PATH') or SESSION_DB_PATH)
+        _start_sweeper(app.session_interface)
+    elif backend == 'memory':
+        app.session_interface = MemorySessionInterface()
+        _start_sweeper(app.session_interface)
+    elif backend != 'cookie':
+        raise ValueError(f"SESSION_BACKEND desconocido: {backend}")
+    # 'cookie': SecureCookieSessionInterface por defecto de Flask
+    return backend
@@ -1,13 +1,27 @@
 import os
+import threading
 import requests
 import json
 
+from collections import namedtuple
+
+from src.services.provider_router import ProviderError, ProviderRouter
+from src.services.gemini_cache import gemini_context_cache
+from src.services.tracing import current_span, span
+
+# Prompt de Gemini: prefijo estable (system + documents) y cola variable (tail)
+GeminiPrompt = namedtuple('GeminiPrompt', ['system', 'documents', 'tail'])
+
 class SimpleAIService:
+    # Respuesta esperada de la fase map cuando un grupo no aporta nada
+    NO_INFO_MARKER = 'SIN INFORMACIÓN'
+
     def __init__(self):
         self.provider = os.getenv('AI_PROVIDER', 'openai').lower()
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
         self.openai_api_base = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
         self.gemini_api_key = os.getenv('GEMINI_API_KEY')
+        self.gemini_api_base = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com').rstrip('/')
         # Permitir configurar el modelo de Gemini por .env
         # Valores válidos comunes: gemini-2.0-flash, gemini-1.5-flash, gemini-1.5-pro, y sus sufijos -latest
         self.gemini_model = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash').strip()
@@ -15,9 +29,20 @@ class SimpleAIService:
         self.gemini_api_version = os.getenv('GEMINI_API_VERSION', 'v1beta').strip()
         # Enviar API key por header como en el curl de muestra
         self.gemini_use_header_key = True
+        self.openai_model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini').strip()
+        # Alias de modelo ya resueltos (p. ej. gemini-1.5-flash-latest -> gemini-1.5-flash)
+        self._model_aliases = {}
+        self._alias_lock = threading.Lock()
+        # Failover/hedging entre proveedores configurados y métricas de latencia
+        self.router = ProviderRouter()
     
-    def generate_response(self, question, context, conversation_history=None):
-        """Genera una respuesta usando el proveedor de IA configurado"""
+    def generate_response(self, question, context, conversation_history=None, history_summary=None):
+        """Genera una respuesta usando el proveedor de IA configurado.
+
+        conversation_history son los mensajes recientes ya recortados al
+        presupuesto de tokens y history_summary el resumen de los anteriores
+        (ver src/services/conversation_memory.py).
+        """
         try:
             # Construir el prompt del sistema
             system_prompt = """Eres un asistente inteligente especializado en responder preguntas sobre documentos PDF. 
@@ -35,151 +60,297 @@ Reglas importantes:
 - Sé preciso y conciso en tus respuestas
 - Cuando sea posible, menciona de qué documento específico proviene la información"""
 
-            if self.provider == 'openai' and self.openai_api_key:
-                return self._generate_openai_response(system_prompt, question, context, conversation_history)
-            elif self.provider == 'gemini' and self.gemini_api_key:
-                return self._generate_gemini_response(system_prompt, question, context, conversation_history)
-            else:
-                return "Error: No se ha configurado correctamente el proveedor de IA. Por favor, configura las credenciales de OpenAI o Gemini."
-                
+            calls = self._route_calls(
+                lambda: self._openai_messages(system_prompt, question, context, conversation_history, history_summary),
+                lambda: self._gemini_prompt(system_prompt, question, context, conversation_history, history_summary),
+                max_tokens=1000,
+                temperature=0.7,
+            )
+            with span('ai.generate_response', context_chars=len(context or ''),
+                      history_messages=len(conversation_history or []), has_summary=bool(history_summary)):
+                return self.router.call(calls)
+        
+        except ProviderError as e:
+            print(f"Error generando respuesta de IA ({self.provider}): {str(e)}")
+            return str(e)
         except Exception as e:
             print(f"Error generando respuesta de IA ({self.provider}): {str(e)}")
             return "Lo siento, hubo un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
     
-    def _generate_openai_response(self, system_prompt, question, context, conversation_history):
-        """Genera respuesta usando OpenAI con requests"""
+    def _provider_order(self):
+        """Proveedores configurados en orden de preferencia (AI_PROVIDERS o AI_PROVIDER primero)"""
+        preferred = [p.strip().lower() for p in os.getenv('AI_PROVIDERS', '').split(',') if p.strip()]
+        if not preferred:
+            preferred = [self.provider] + [p for p in ('openai', 'gemini') if p != self.provider]
+        configured = {'openai': bool(self.openai_api_key), 'gemini': bool(self.gemini_api_key)}
+        return [p for p in preferred if configured.get(p)]
+    
+    def _route_calls(self, build_openai, build_gemini, max_tokens, temperature):
+        """Lista [((proveedor, modelo), función)] para el router; cada proveedor arma su propio prompt"""
+        calls = []
+        for provider in self._provider_order():
+            if provider == 'openai':
+                calls.append((
+                    ('openai', self.openai_model),
+                    lambda: self._openai_chat(build_openai(), max_tokens, temperature),
+                ))
+            elif provider == 'gemini':
+                calls.append((
+                    ('gemini', self._resolved_gemini_model()),
+                    lambda: self._gemini_generate(build_gemini(), max_tokens, temperature),
+                ))
+        return calls
+    
+    def _openai_messages(self, system_prompt, question, context, conversation_history, history_summary=None):
+        """Mensajes para OpenAI con prefijo estable: sistema + documentos primero y
+        lo que cambia en cada turno (resumen, historial, pregunta) al final, para
+        aprovechar el caché automático de prefijos."""
         messages = [
-            {"role": "system", "content": system_prompt}
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": self._documents_block(context)},
         ]
         
-        # Agregar historial de conversación si existe
+        # Resumen de los turnos anteriores a los mensajes recientes
+        if history_summary:
+            messages.append({"role": "system", "content": f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{history_summary}"})
+        
+        # Agregar historial de conversación si existe (ya acotado por tokens)
         if conversation_history:
-            for msg in conversation_history[-10:]:  # Últimos 10 mensajes
+            for msg in conversation_history:
                 role = "user" if msg.is_user else "assistant"
                 messages.append({"role": role, "content": msg.content})
         
-        # Agregar contexto de documentos
-        if context.strip():
-            context_message = f"CONTENIDO DE LOS DOCUMENTOS:\n\n{context}\n\nPREGUNTA DEL USUARIO: {question}"
-        else:
-            context_message = f"No hay documentos seleccionados. PREGUNTA DEL USUARIO: {question}"
-        
-        messages.append({"role": "user", "content": context_message})
-        
-        # Llamar a OpenAI usando requests
+        messages.append({"role": "user", "content": f"PREGUNTA DEL USUARIO: {question}"})
+        return messages
+    
+    @staticmethod
+    def _documents_block(context):
+        if context and context.strip():
+            return f"CONTENIDO DE LOS DOCUMENTOS:\n\n{context}"
+        return "No hay documentos seleccionados."
+    
+    def _openai_chat(self, messages, max_tokens, temperature):
+        """Llama a OpenAI usando requests. Lanza ProviderError si falla."""
         headers = {
             'Authorization': f'Bearer {self.openai_api_key}',
             'Content-Type': 'application/json'
         }
         
         data = {
-            'model': 'gpt-4o-mini',
+            'model': self.openai_model,
             'messages': messages,
-            'max_tokens': 1000,
-            'temperature': 0.7
+            'max_tokens': max_tokens,
+            'temperature': temperature
         }
         
-        response = requests.post(
-            f'{self.openai_api_base}/chat/completions',
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        try:
+            response = requests.post(
+                f'{self.openai_api_base}/chat/completions',
+                headers=headers,
+                json=data,
+                timeout=30
+            )
+        except requests.RequestException as e:
+            raise ProviderError(f"Error en la API de OpenAI: {e}")
         
         if response.status_code == 200:
             result = response.json()
+            usage = result.get('usage') or {}
+            self._record_usage(
+                ('openai', self.openai_model),
+                usage.get('prompt_tokens'),
+                (usage.get('prompt_tokens_details') or {}).get('cached_tokens'),
+                usage.get('completion_tokens'),
+            )
             return result['choices'][0]['message']['content']
-        else:
-            return f"Error en la API de OpenAI: {response.status_code}"
+        raise ProviderError(f"Error en la API de OpenAI: {response.status_code}")
     
-    def _generate_gemini_response(self, system_prompt, question, context, conversation_history):
-        """Genera respuesta usando Gemini con requests"""
-        # Construir el prompt completo para Gemini
-        full_prompt = f"{system_prompt}\n\n"
+    def _gemini_prompt(self, system_prompt, question, context, conversation_history, history_summary=None):
+        """Prompt para Gemini separado en prefijo estable (sistema + documentos) y cola variable"""
+        tail = "\n\n"
+        
+        if history_summary:
+            tail += f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{history_summary}\n\n"
         
-        # Agregar historial de conversación si existe
+        # Agregar historial de conversación si existe (ya acotado por tokens)
         if conversation_history:
-            full_prompt += "HISTORIAL DE CONVERSACIÓN:\n"
-            for msg in conversation_history[-10:]:  # Últimos 10 mensajes
+            tail += "HISTORIAL DE CONVERSACIÓN:\n"
+            for msg in conversation_history:
                 role = "Usuario" if msg.is_user else "Asistente"
-                full_prompt += f"{role}: {msg.content}\n"
-            full_prompt += "\n"
+                tail += f"{role}: {msg.content}\n"
+            tail += "\n"
         
-        # Agregar contexto de documentos
-        if context.strip():
-            full_prompt += f"CONTENIDO DE LOS DOCUMENTOS:\n\n{context}\n\n"
-        else:
-            full_prompt += "No hay documentos seleccionados.\n\n"
-        
-        full_prompt += f"PREGUNTA DEL USUARIO: {question}\n\nRESPUESTA:"
-        
-        # Llamar a Gemini usando requests (compatible con curl de muestra)
-        model = self.gemini_model
-        base = f"https://generativelanguage.googleapis.com/{self.gemini_api_version}"
+        tail += f"PREGUNTA DEL USUARIO: {question}\n\nRESPUESTA:"
+        return GeminiPrompt(system_prompt, self._documents_block(context), tail)
+    
+    def _resolved_gemini_model(self):
+        return self._model_aliases.get(self.gemini_model, self.gemini_model)
+    
+    def _gemini_base(self):
+        return f"{self.gemini_api_base}/{self.gemini_api_version}"
+    
+    def _gemini_headers(self):
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        if self.gemini_use_header_key:
+            headers['X-goog-api-key'] = self.gemini_api_key
+        return headers
+    
+    def _gemini_post(self, model, data):
+        base = self._gemini_base()
         # Si usamos header para la API key, no la añadimos en la query
         if self.gemini_use_header_key:
             url = f"{base}/models/{model}:generateContent"
         else:
             url = f"{base}/models/{model}:generateContent?key={self.gemini_api_key}"
-        
-        headers = {
-            'Content-Type': 'application/json'
+        try:
+            return requests.post(url, headers=self._gemini_headers(), json=data, timeout=30)
+        except requests.RequestException as e:
+            raise ProviderError(f"Error en la API de Gemini: {e}")
+    
+    def _gemini_generate(self, prompt, max_tokens, temperature):
+        """Llama a Gemini usando requests (compatible con curl de muestra). Lanza ProviderError si falla.
+
+        prompt es un GeminiPrompt; con caché explícito el prefijo (sistema +
+        documentos) va por cachedContent y solo se envía la cola.
+        """
+        generation_config = {
+            'maxOutputTokens': max_tokens,
+            'temperature': temperature
         }
-        if self.gemini_use_header_key:
-            headers['X-goog-api-key'] = self.gemini_api_key
+        model = self._resolved_gemini_model()
+        cache_key, cache_name = gemini_context_cache.handle_for(
+            self._gemini_base(), self._gemini_headers(), model, prompt.system, prompt.documents
+        )
+        response = None
+        if cache_name:
+            response = self._gemini_post(model, {
+                'cachedContent': cache_name,
+                'contents': [{'role': 'user', 'parts': [{'text': prompt.tail.strip()}]}],
+                'generationConfig': generation_config,
+            })
+            if response.status_code in (400, 403, 404):
+                # Handle expirado o borrado: olvidarlo y enviar el prompt completo
+                gemini_context_cache.invalidate(cache_key)
+                response = None
         
         # Estructura de contents como en el ejemplo de curl (sin 'role')
         data = {
             'contents': [{
                 'parts': [{
-                    'text': full_prompt
+                    'text': "\n\n".join(part for part in (prompt.system, prompt.documents) if part) + prompt.tail
                 }]
             }],
-            'generationConfig': {
-                'maxOutputTokens': 1000,
-                'temperature': 0.7
-            }
+            'generationConfig': generation_config
         }
+        if response is None:
+            response = self._gemini_post(model, data)
+        # Alias '-latest' inexistente (404): resolver al modelo base una sola vez
+        if response.status_code == 404 and model.endswith('-latest'):
+            fallback_model = model.replace('-latest', '')
+            fallback_resp = self._gemini_post(fallback_model, data)
+            if fallback_resp.status_code != 200:
+                raise ProviderError(
+                    f"Error en la API de Gemini (fallback {fallback_model}): "
+                    f"{fallback_resp.status_code} - {fallback_resp.text}"
+                )
+            with self._alias_lock:
+                self._model_aliases[model] = fallback_model
+            print(f"[AI] Alias de Gemini {model} resuelto a {fallback_model}")
+            model = fallback_model
+            response = fallback_resp
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-
         if response.status_code == 200:
             result = response.json()
+            usage = result.get('usageMetadata') or {}
+            self._record_usage(
+                ('gemini', model),
+                usage.get('promptTokenCount'),
+                usage.get('cachedContentTokenCount'),
+                usage.get('candidatesTokenCount'),
+            )
             if 'candidates' in result and len(result['candidates']) > 0:
                 return result['candidates'][0]['content']['parts'][0]['text']
-            else:
-                return "No se pudo generar una respuesta con Gemini."
-        else:
-            # Si hay 404 con alias '-latest', intentar sin '-latest' como fallback
-            if response.status_code == 404 and model.endswith('-latest'):
-                try:
-                    fallback_model = model.replace('-latest', '')
-                    if self.gemini_use_header_key:
-                        fallback_url = f"{base}/models/{fallback_model}:generateContent"
-                    else:
-                        fallback_url = f"{base}/models/{fallback_model}:generateContent?key={self.gemini_api_key}"
-                    fallback_resp = requests.post(fallback_url, headers=headers, json=data, timeout=30)
-                    if fallback_resp.status_code == 200:
-                        result = fallback_resp.json()
-                        if 'candidates' in result and len(result['candidates']) > 0:
-                            return result['candidates'][0]['content']['parts'][0]['text']
-                    # Si el fallback también falla, devolver detalle
-                    return (
-                        f"Error en la API de Gemini (fallback {fallback_model}): "
-                        f"{fallback_resp.status_code} - {fallback_resp.text}"
-                    )
-                except Exception as e:
-                    return f"Error en la API de Gemini (fallback): {str(e)}"
-            # Incluir el cuerpo de respuesta para mejor diagnóstico
-            return f"Error en la API de Gemini: {response.status_code} - {response.text}"
+            return "No se pudo generar una respuesta con Gemini."
+        # Incluir el cuerpo de respuesta para mejor diagnóstico
+        raise ProviderError(f"Error en la API de Gemini: {response.status_code} - {response.text}")
+    
+    def _record_usage(self, target, prompt_tokens, cached_tokens, completion_tokens):
+        """Tokens de la respuesta (incluidos los servidos desde caché de prefijo)"""
+        self.router.record_usage(target, prompt_tokens or 0, cached_tokens or 0, completion_tokens or 0)
+        current_span().set_attributes(**{
+            'llm.prompt_tokens': prompt_tokens,
+            'llm.cached_tokens': cached_tokens,
+            'llm.completion_tokens': completion_tokens,
+        })
+        if cached_tokens:
+            print(f"[AI] {target[0]}:{target[1]} tokens prompt={prompt_tokens} cacheados={cached_tokens}")
+    
+    def summarize_history(self, previous_summary, messages, max_tokens=400):
+        """Integra `messages` en el resumen previo. Devuelve el texto o None si falla."""
+        instructions = (
+            "Resume la conversación entre un usuario y un asistente sobre documentos PDF. "
+            "Conserva preguntas, datos concretos, nombres de documentos y conclusiones que "
+            "puedan necesitarse en turnos siguientes. Escribe en el idioma de la conversación, "
+            "en prosa breve y sin inventar información."
+        )
+        parts = []
+        if previous_summary:
+            parts.append(f"RESUMEN ACTUAL:\n{previous_summary}\n")
+        parts.append("NUEVOS MENSAJES:")
+        for msg in messages:
+            role = "Usuario" if msg.is_user else "Asistente"
+            parts.append(f"{role}: {msg.content}")
+        parts.append("\nDevuelve el resumen actualizado completo.")
+        prompt = "\n".join(parts)
+        return self.complete(instructions, prompt, max_tokens=max_tokens, purpose='resumen de conversación')
+    
+    def answer_from_documents(self, question, context, max_tokens=600):
+        """Respuesta parcial sobre un grupo de documentos (fase map de map-reduce).
+        Devuelve '' si el grupo no contiene información relevante y None si falla."""
+        instructions = (
+            "Eres un asistente que analiza un subconjunto de documentos PDF. Responde la pregunta "
+            "usando únicamente estos documentos y menciona el documento de cada dato. Si no contienen "
+            f"información relevante, responde exactamente: {self.NO_INFO_MARKER}"
+        )
+        prompt = f"CONTENIDO DE LOS DOCUMENTOS:\n\n{context}\n\nPREGUNTA DEL USUARIO: {question}"
+        answer = self.complete(instructions, prompt, max_tokens=max_tokens, purpose='respuesta parcial')
+        if answer is None:
+            return None
+        if answer.strip().rstrip('.').upper() == self.NO_INFO_MARKER:
+            return ''
+        return answer
+    
+    def complete(self, instructions, prompt, max_tokens=1000, temperature=0.2, purpose='completado'):
+        """Llamada simple instrucciones + prompt al proveedor. Devuelve el texto o None si falla."""
+        calls = self._route_calls(
+            lambda: [
+                {'role': 'system', 'content': instructions},
+                {'role': 'user', 'content': prompt},
+            ],
+            lambda: GeminiPrompt(instructions, '', f"\n\n{prompt}"),
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        if not calls:
+            return None
+        try:
+            with span('ai.complete', purpose=purpose, prompt_chars=len(instructions) + len(prompt)):
+                return (self.router.call(calls) or '').strip() or None
+        except Exception as e:
+            print(f"[AI] Error en {purpose}: {e}")
+            return None
     
     def get_provider_info(self):
         """Retorna información sobre el proveedor de IA actual"""
         return {
             'provider': self.provider,
-            'model': 'gpt-4o-mini' if self.provider == 'openai' else self.gemini_model,
+            'model': self.openai_model if self.provider == 'openai' else self._resolved_gemini_model(),
             'configured': (self.provider == 'openai' and bool(self.openai_api_key)) or 
-                         (self.provider == 'gemini' and bool(self.gemini_api_key))
+                         (self.provider == 'gemini' and bool(self.gemini_api_key)),
+            'providers': self._provider_order(),
+            'routing': self.router.snapshot()
         }
 
 # Instancia global del servicio de IA
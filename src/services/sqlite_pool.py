@@ -0,0 +1,70 @@
+"""Pool pequeño de conexiones SQLite para las bases auxiliares (sesiones, cuota de Drive).
+
+No se cachean conexiones en threading.local: con workers gevent eso es una
+conexión por greenlet, es decir por request, que nunca se cierra. El pool
+presta una conexión por operación y la devuelve al terminar; guarda como
+mucho `size` inactivas y cierra las sobrantes. Tras un fork (gunicorn con
+preload) se descartan las heredadas sin usarlas.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLitePool:
+    def __init__(self, path, size=4, timeout=5, on_connect=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def _new_connection(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _take(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Conexiones del proceso padre: no se pueden usar ni cerrar aquí
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._new_connection()
+
+    def _give_back(self, conn):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Conexión en autocommit; si algo falla a mitad de transacción, la deshace."""
+        conn = self._take()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                # Conexión en mal estado: no vuelve al pool
+                conn.close()
+            else:
+                self._give_back(conn)
+            raise
+        self._give_back(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,164 @@
+"""Servido de estáticos del frontend con variantes precomprimidas y caché HTTP.
+
+Al arrancar se construye un manifiesto del directorio static/ (ruta -> archivo,
+ETag fuerte, tipo MIME y variantes .br/.gz), así que servir un asset no hace
+ninguna consulta al sistema de archivos por request. Los bundles con hash en
+el nombre (assets/index-CH8wmkyY.js) se sirven como `immutable` por un año y
+el index.html con vida corta para que un deploy nuevo se vea enseguida.
+
+Las variantes se generan en build con:
+    python -m src.services.static_assets
+(.br solo si el paquete opcional `brotli` está instalado).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.html', '.svg', '.json', '.txt', '.map', '.ico', '.xml'}
+MIN_COMPRESS_BYTES = 1024
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+INDEX_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+# Nombres generados por Vite: <nombre>-<hash>.<ext>
+HASHED_NAME = re.compile(r'-[A-Za-z0-9_]{8,}\.[a-z0-9]+$')
+# Preferencia de codificación cuando el cliente acepta varias
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_compressed_variants(root):
+    """Genera .gz (y .br si hay brotli) para los archivos comprimibles que no
+    los tengan o los tengan desactualizados. Devuelve cuántos escribió."""
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, name)
+            if os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                variant = path + suffix
+                if os.path.exists(variant) and os.path.getmtime(variant) >= mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                # Solo vale la pena si realmente ahorra bytes
+                if len(compressed) < len(data):
+                    _write_atomic(variant, compressed)
+                    written += 1
+    return written
+
+
+class StaticManifest:
+    """Índice en memoria de los archivos de static/."""
+
+    def __init__(self, root, build_missing=True):
+        self.root = root
+        self.entries = {}
+        if not root or not os.path.isdir(root):
+            return
+        if build_missing:
+            try:
+                build_compressed_variants(root)
+            except OSError as e:
+                print(f"[Static] No se pudieron generar variantes comprimidas: {e}")
+        self._scan()
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(('.gz', '.br', '.tmp')):
+                    continue
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:32]
+                mtime = os.path.getmtime(path)
+                variants = {}
+                for encoding, suffix in ENCODINGS:
+                    variant = path + suffix
+                    if os.path.exists(variant) and os.path.getmtime(variant) >= mtime:
+                        variants[encoding] = variant
+                if rel == 'index.html':
+                    cache_control = INDEX_CACHE_CONTROL
+                elif HASHED_NAME.search(name):
+                    cache_control = IMMUTABLE_CACHE_CONTROL
+                else:
+                    cache_control = DEFAULT_CACHE_CONTROL
+                self.entries[rel] = {
+                    'path': path,
+                    'etag': digest,
+                    'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                    'variants': variants,
+                    'cache_control': cache_control,
+                }
+
+    def get(self, rel_path):
+        return self.entries.get(rel_path)
+
+    def respond(self, rel_path):
+        """Response para el archivo del manifiesto (None si no existe)."""
+        entry = self.entries.get(rel_path)
+        if entry is None:
+            return None
+
+        file_path = entry['path']
+        encoding = None
+        if entry['variants']:
+            accepted = request.accept_encodings
+            for candidate, _ in ENCODINGS:
+                if candidate in entry['variants'] and accepted[candidate]:
+                    encoding = candidate
+                    file_path = entry['variants'][candidate]
+                    break
+        # ETag distinto por codificación: son representaciones distintas
+        etag = entry['etag'] + (f"-{encoding}" if encoding else "")
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = send_file(
+                file_path,
+                mimetype=entry['mimetype'],
+                conditional=False,
+                etag=False,
+                max_age=None,
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = entry['cache_control']
+        if entry['variants']:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+if __name__ == '__main__':
+    static_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
+    print(f"Variantes comprimidas generadas: {build_compressed_variants(static_root)}")
@@ -0,0 +1,355 @@
+"""Trazas ligeras por petición (spans compatibles con OpenTelemetry).
+
+Cada petición HTTP abre un span raíz; dentro se cuelgan spans hijos para las
+consultas SQL, las llamadas a Google Drive, la extracción de texto de PDFs y
+las llamadas al proveedor de IA, con atributos de tamaños y recuentos.
+Al cerrar la raíz la traza completa se exporta en formato OTLP/JSON
+(resourceSpans), así que el fichero JSONL se puede leer con el receptor
+otlpjsonfile del OpenTelemetry Collector o inspeccionar a mano.
+
+TRACING_EXPORTER: off (por defecto), console (stdout) o jsonl (TRACING_FILE).
+TRACING_SAMPLE_RATE: fracción de peticiones trazadas. Si la petición trae
+cabecera traceparent (W3C) se continúa esa traza. La respuesta siempre
+lleva X-Trace-Id y traceparent cuando la petición se trazó.
+
+Sin traza activa (tracing desactivado, petición no muestreada o trabajo en
+segundo plano) span() devuelve un span vacío sin coste apreciable.
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request, session
+
+EXPORTER = os.getenv('TRACING_EXPORTER', 'off').lower()
+TRACE_FILE = os.getenv(
+    'TRACING_FILE',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'traces.jsonl'),
+)
+SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '1.0'))
+# Una petición con miles de consultas no debe generar una traza sin límite
+MAX_SPANS_PER_TRACE = int(os.getenv('TRACING_MAX_SPANS', '2000'))
+SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'pdf-chat-app')
+MAX_ATTRIBUTE_CHARS = 500
+
+ENABLED = EXPORTER in ('console', 'jsonl')
+
+_current = ContextVar('tracing_span', default=None)
+_export_lock = threading.Lock()
+
+# Códigos de estado y tipos de span de OTLP
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)[:MAX_ATTRIBUTE_CHARS]}
+
+
+class _Trace:
+    """Spans terminados de una traza, pendientes de exportar."""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.dropped = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            if self.closed:
+                # Span que terminó después de la raíz (p. ej. hedging): va solo
+                late = True
+            elif len(self.spans) >= MAX_SPANS_PER_TRACE:
+                self.dropped += 1
+                return
+            else:
+                self.spans.append(span)
+                late = False
+        if late:
+            _export([span])
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes',
+                 'status', 'status_message')
+
+    def __init__(self, trace, name, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_message = ''
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"[:MAX_ATTRIBUTE_CHARS]
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.add(self)
+
+    def to_otlp(self):
+        data = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or self.start_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.status_message} if self.status_message else {'code': self.status},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        return data
+
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _export(spans):
+    if not spans:
+        return
+    payload = json.dumps({
+        'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+            ]},
+            'scopeSpans': [{'scope': {'name': 'src.services.tracing'}, 'spans': [s.to_otlp() for s in spans]}],
+        }]
+    }, ensure_ascii=False)
+    try:
+        if EXPORTER == 'console':
+            print(f"[Trace] {payload}")
+        else:
+            # Una línea por traza; el lock evita intercalar líneas entre hilos
+            with _export_lock:
+                with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                    f.write(payload + '\n')
+    except Exception as e:
+        print(f"[Trace] No se pudo exportar la traza: {e}")
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def start_span(name, kind=KIND_INTERNAL, **attributes):
+    """Span hijo del actual sin activarlo (el llamador debe llamar end())."""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, kind, attributes)
+
+
+@contextmanager
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """Span hijo activo durante el bloque; las excepciones lo marcan como error."""
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, name, parent.span_id, kind, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def traced(name, **attributes):
+    """Decorador: ejecuta la función dentro de span(name)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn):
+    """fn ejecutada en otro hilo cuelga sus spans del span actual."""
+    parent = _current.get()
+    if parent is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def _parse_traceparent(header):
+    """(trace_id, parent_span_id) de una cabecera W3C traceparent válida."""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None, None
+    return parts[1], parts[2]
+
+
+def _start_request_trace():
+    trace_id, parent_id = _parse_traceparent(request.headers.get('traceparent'))
+    if trace_id is None:
+        if SAMPLE_RATE < 1.0 and random.random() >= SAMPLE_RATE:
+            return
+        trace_id = '%032x' % random.getrandbits(128)
+    root = Span(_Trace(trace_id), f"{request.method} {request.path}", parent_id, KIND_SERVER, {
+        'http.method': request.method,
+        'http.target': request.path,
+    })
+    g.trace_root = root
+    g.trace_token = _current.set(root)
+
+
+def _finish_request_trace(response):
+    root = g.get('trace_root')
+    if root is None:
+        return response
+    root.set_attribute('http.status_code', response.status_code)
+    if request.url_rule is not None:
+        root.set_attribute('http.route', request.url_rule.rule)
+        root.name = f"{request.method} {request.url_rule.rule}"
+    if response.status_code >= 500:
+        root.status = STATUS_ERROR
+    user_id = g.get('user_id') or session.get('user_id')
+    if user_id:
+        root.set_attribute('enduser.id', str(user_id))
+    response.headers['X-Trace-Id'] = root.trace_id
+    response.headers['traceparent'] = f"00-{root.trace_id}-{root.span_id}-01"
+    return response
+
+
+def _end_request_trace(error=None):
+    root = g.pop('trace_root', None)
+    if root is None:
+        return
+    token = g.pop('trace_token', None)
+    if error is not None:
+        root.record_error(error)
+    root.end()
+    trace = root.trace
+    with trace.lock:
+        trace.closed = True
+        spans, dropped = trace.spans, trace.dropped
+        trace.spans = []
+    if dropped:
+        root.set_attribute('tracing.dropped_spans', dropped)
+    _export(spans)
+    if token is not None:
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    child = start_span('db.query', KIND_CLIENT)
+    if child is NOOP_SPAN:
+        return
+    child.set_attributes(**{
+        'db.system': conn.engine.dialect.name,
+        'db.operation': statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER',
+        'db.statement': statement,
+    })
+    if executemany:
+        child.set_attribute('db.executemany', len(parameters))
+    conn.info.setdefault('tracing_spans', []).append(child)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('tracing_spans')
+    if not spans:
+        return
+    child = spans.pop()
+    rowcount = getattr(cursor, 'rowcount', -1)
+    if rowcount is not None and rowcount >= 0:
+        child.set_attribute('db.rowcount', rowcount)
+    child.end()
+
+
+def _handle_db_error(exception_context):
+    conn = exception_context.connection
+    spans = conn.info.get('tracing_spans') if conn is not None else None
+    if spans:
+        child = spans.pop()
+        child.record_error(exception_context.original_exception)
+        child.end()
+
+
+def init_tracing(app):
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_db_error)
+    # La raíz se abre antes que cualquier otro before_request (auth, métricas)
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request_trace)
+    app.after_request(_finish_request_trace)
+    app.teardown_request(_end_request_trace)
+    if EXPORTER == 'jsonl':
+        os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+    print(f"[Trace] Trazas activas ({EXPORTER}, muestreo {SAMPLE_RATE})")
@@ -0,0 +1,337 @@
+"""Mantenimiento del directorio de subidas.
+
+- migrate_to_sharded_layout(): mueve los archivos del layout plano antiguo
+  (uploads/<archivo>) al particionado uploads/ab/cd/<archivo>.
+- sweep_orphans(): recolector que reconcilia el disco con las tablas PDF,
+  DriveFileCache y DriveImportItem por lotes acotados, y emite métricas.
+- start_upload_gc(app): hilo periódico que ejecuta ambos. Un flock sobre
+  uploads/.gc.lock garantiza que solo un worker de gunicorn barre a la vez.
+  No se lanza al importar la app (scripts, tests y benchmarks no barren):
+  lo arrancan el hook post_worker_init de gunicorn.conf.py y el servidor de
+  desarrollo de src/main.py.
+
+Uso manual: python -m src.services.upload_storage [migrate|sweep|stats]
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+from src.models.user import db, PDF, DriveFileCache, DriveImportItem
+from src.routes.pdfs import ensure_upload_directory, sharded_upload_path
+from src.services.drive_cache import CACHE_DIRNAME, cache_blob_name
+
+GC_INTERVAL_SECONDS = int(os.getenv('UPLOAD_GC_INTERVAL_SECONDS', '3600'))
+# Archivos por barrido y por consulta a la DB
+GC_BATCH_FILES = int(os.getenv('UPLOAD_GC_BATCH_FILES', '5000'))
+GC_QUERY_CHUNK = 500
+# No tocar archivos recientes: pueden ser subidas/descargas aún sin fila en la DB
+GC_GRACE_SECONDS = int(os.getenv('UPLOAD_GC_GRACE_SECONDS', '3600'))
+# Entradas de la caché de Drive sin uso durante este tiempo se eliminan
+CACHE_TTL_DAYS = int(os.getenv('DRIVE_CACHE_TTL_DAYS', '30'))
+
+LOCK_FILENAME = '.gc.lock'
+STATE_FILENAME = '.gc_state.json'
+
+
+def _load_state(root):
+    try:
+        with open(os.path.join(root, STATE_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(root, state):
+    tmp = os.path.join(root, STATE_FILENAME + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(root, STATE_FILENAME))
+
+
+class _SweepLock:
+    """flock no bloqueante; acquired=False si otro proceso ya está barriendo."""
+
+    def __init__(self, root):
+        self.path = os.path.join(root, LOCK_FILENAME)
+        self.fh = None
+        self.acquired = False
+
+    def __enter__(self):
+        self.fh = open(self.path, 'a')
+        if fcntl is None:
+            self.acquired = True
+            return self
+        try:
+            fcntl.flock(self.fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except OSError:
+            self.acquired = False
+        return self
+
+    def __exit__(self, *exc):
+        if self.acquired and fcntl is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+        self.fh.close()
+
+
+def _move(src, dest):
+    if os.path.abspath(src) == os.path.abspath(dest):
+        return
+    os.replace(src, dest)
+
+
+def migrate_to_sharded_layout(batch_size=200):
+    """Mueve PDFs, blobs de caché e items de importación al layout particionado.
+
+    Idempotente: las filas ya migradas se saltan y un archivo que no está en
+    la ruta guardada se busca por nombre en la raíz de uploads.
+    Devuelve el número de rutas actualizadas.
+    """
+    root = ensure_upload_directory()
+    cache_root = os.path.join(root, CACHE_DIRNAME)
+    moved = 0
+
+    def relocate(current_path, filename, base=None):
+        target = sharded_upload_path(filename, base=base)
+        if current_path == target:
+            return None
+        for candidate in (current_path, os.path.join(base or root, filename)):
+            if candidate and os.path.exists(candidate):
+                _move(candidate, target)
+                return target
+        # Sin archivo en disco: apuntar igualmente a la nueva ubicación
+        return target
+
+    for model, name_of, base, path_attr in (
+        (PDF, lambda r: r.filename, None, 'file_path'),
+        (DriveImportItem, lambda r: r.filename, None, 'file_path'),
+        (DriveFileCache, lambda r: cache_blob_name(r.drive_file_id, r.md5_checksum), cache_root, 'blob_path'),
+    ):
+        last_id = 0
+        while True:
+            rows = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                last_id = row.id
+                try:
+                    new_path = relocate(getattr(row, path_attr), name_of(row), base=base)
+                except OSError as e:
+                    print(f"[UploadGC] No se pudo migrar {getattr(row, path_attr)}: {e}")
+                    continue
+                if new_path:
+                    setattr(row, path_attr, new_path)
+                    moved += 1
+            db.session.commit()
+    if moved:
+        print(f"[UploadGC] Migración a layout particionado: {moved} rutas actualizadas")
+    return moved
+
+
+def _scan_units(root):
+    """Unidades de barrido en orden estable: raíz (layout antiguo), shards y shards de caché."""
+    units = ['']
+    for entry in sorted(os.listdir(root)):
+        if len(entry) == 2 and os.path.isdir(os.path.join(root, entry)):
+            units.append(entry)
+    cache_root = os.path.join(root, CACHE_DIRNAME)
+    if os.path.isdir(cache_root):
+        units.append(CACHE_DIRNAME)
+        for entry in sorted(os.listdir(cache_root)):
+            if len(entry) == 2 and os.path.isdir(os.path.join(cache_root, entry)):
+                units.append(os.path.join(CACHE_DIRNAME, entry))
+    # El cursor compara por orden de texto: la lista debe seguir el mismo orden
+    return sorted(units)
+
+
+def _unit_files(root, unit):
+    base = os.path.join(root, unit)
+    if unit in ('', CACHE_DIRNAME):
+        # Solo archivos sueltos (layout plano)
+        for entry in os.scandir(base):
+            if entry.is_file() and not entry.name.startswith('.'):
+                yield entry.path
+        return
+    for dirpath, _, filenames in os.walk(base):
+        for name in filenames:
+            if not name.startswith('.'):
+                yield os.path.join(dirpath, name)
+
+
+def _referenced_names(names, in_cache):
+    """Subconjunto de nombres de archivo referenciados por alguna fila."""
+    if in_cache:
+        by_md5 = {}
+        for name in names:
+            stem = name[:-4] if name.endswith('.pdf') else name
+            drive_id, _, md5 = stem.rpartition('-')
+            by_md5.setdefault(md5, set()).add(drive_id)
+        rows = db.session.query(DriveFileCache.drive_file_id, DriveFileCache.md5_checksum).filter(
+            DriveFileCache.md5_checksum.in_(list(by_md5))
+        ).all()
+        return {cache_blob_name(d, m) for d, m in rows if d in by_md5.get(m, ())}
+    referenced = {r[0] for r in db.session.query(PDF.filename).filter(PDF.filename.in_(names))}
+    referenced |= {
+        r[0] for r in db.session.query(DriveImportItem.filename).filter(DriveImportItem.filename.in_(names))
+    }
+    return referenced
+
+
+def _expire_cache_entries(stats, now):
+    cutoff = now - timedelta(days=CACHE_TTL_DAYS)
+    expired = DriveFileCache.query.filter(DriveFileCache.last_used_at < cutoff).limit(GC_QUERY_CHUNK).all()
+    for entry in expired:
+        if entry.blob_path and os.path.exists(entry.blob_path):
+            try:
+                stats['bytes_freed'] += os.path.getsize(entry.blob_path)
+                os.remove(entry.blob_path)
+            except OSError:
+                pass
+        db.session.delete(entry)
+        stats['cache_entries_expired'] += 1
+    if expired:
+        db.session.commit()
+
+
+def _check_missing_files(state, stats, max_rows):
+    """Filas PDF cuyo archivo ya no está en disco (solo se cuentan: el texto sigue en la DB)."""
+    last_id = state.get('pdf_cursor', 0)
+    rows = (
+        db.session.query(PDF.id, PDF.file_path)
+        .filter(PDF.id > last_id)
+        .order_by(PDF.id)
+        .limit(max_rows)
+        .all()
+    )
+    for pdf_id, path in rows:
+        stats['pdf_rows_checked'] += 1
+        if not path or not os.path.exists(path):
+            stats['missing_files'] += 1
+    state['pdf_cursor'] = rows[-1][0] if len(rows) == max_rows else 0
+
+
+def sweep_orphans(max_files=None, grace_seconds=None):
+    """Un barrido acotado. Devuelve las métricas del barrido o None si otro
+    proceso tiene el lock."""
+    max_files = GC_BATCH_FILES if max_files is None else max_files
+    grace_seconds = GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    root = ensure_upload_directory()
+    with _SweepLock(root) as lock:
+        if not lock.acquired:
+            return None
+        started = time.monotonic()
+        now = datetime.utcnow()
+        state = _load_state(root)
+        if not state.get('sharded_migration_done'):
+            migrate_to_sharded_layout()
+            state['sharded_migration_done'] = True
+
+        stats = {
+            'files_scanned': 0,
+            'orphans_deleted': 0,
+            'bytes_freed': 0,
+            'cache_entries_expired': 0,
+            'pdf_rows_checked': 0,
+            'missing_files': 0,
+        }
+        _expire_cache_entries(stats, now)
+
+        units = _scan_units(root)
+        cursor = state.get('unit_cursor')
+        start = 0
+        if cursor is not None:
+            start = next((i for i, u in enumerate(units) if u > cursor), len(units))
+        cutoff = time.time() - grace_seconds
+        for unit in units[start:]:
+            in_cache = unit.startswith(CACHE_DIRNAME)
+            paths = list(_unit_files(root, unit))
+            for i in range(0, len(paths), GC_QUERY_CHUNK):
+                chunk = paths[i:i + GC_QUERY_CHUNK]
+                referenced = _referenced_names([os.path.basename(p) for p in chunk], in_cache)
+                for path in chunk:
+                    stats['files_scanned'] += 1
+                    if os.path.basename(path) in referenced:
+                        continue
+                    try:
+                        st = os.stat(path)
+                        if st.st_mtime > cutoff:
+                            continue
+                        os.remove(path)
+                        stats['orphans_deleted'] += 1
+                        stats['bytes_freed'] += st.st_size
+                    except OSError:
+                        pass
+            cursor = unit
+            if stats['files_scanned'] >= max_files:
+                break
+        else:
+            # Vuelta completa: el próximo barrido empieza desde el principio
+            cursor = None
+        state['unit_cursor'] = cursor
+
+        _check_missing_files(state, stats, max_files)
+
+        stats['duration_seconds'] = round(time.monotonic() - started, 3)
+        stats['finished_at'] = now.isoformat()
+        totals = state.get('totals', {})
+        for key in ('files_scanned', 'orphans_deleted', 'bytes_freed', 'cache_entries_expired'):
+            totals[key] = totals.get(key, 0) + stats[key]
+        totals['sweeps'] = totals.get('sweeps', 0) + 1
+        state['totals'] = totals
+        state['last_run'] = stats
+        _save_state(root, state)
+        print(
+            f"[UploadGC] escaneados={stats['files_scanned']} huérfanos={stats['orphans_deleted']} "
+            f"liberados={stats['bytes_freed']}B sin_archivo={stats['missing_files']} "
+            f"en {stats['duration_seconds']}s"
+        )
+        return stats
+
+
+def get_gc_stats():
+    """Métricas del último barrido y acumuladas."""
+    state = _load_state(ensure_upload_directory())
+    return {'last_run': state.get('last_run'), 'totals': state.get('totals', {})}
+
+
+def start_upload_gc(app):
+    """Lanza el barrido periódico en un hilo daemon (UPLOAD_GC_INTERVAL_SECONDS=0 lo desactiva)."""
+    if GC_INTERVAL_SECONDS <= 0:
+        return None
+
+    def loop():
+        # Desfase aleatorio para que los workers no despierten a la vez
+        time.sleep(random.uniform(60, 120))
+        while True:
+            try:
+                with app.app_context():
+                    sweep_orphans()
+            except Exception as e:
+                print(f"[UploadGC] Error en barrido: {e}")
+            time.sleep(GC_INTERVAL_SECONDS * random.uniform(0.9, 1.1))
+
+    thread = threading.Thread(target=loop, name='upload-gc', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    import sys
+    from src.main import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'sweep'
+    with app.app_context():
+        if command == 'migrate':
+            print(migrate_to_sharded_layout())
+        elif command == 'stats':
+            print(json.dumps(get_gc_stats(), indent=2))
+        else:
+            print(sweep_orphans())
@@ -0,0 +1,496 @@
+"""Índice de embeddings por carpeta, en disco y mapeado en memoria.
+
+Layout en uploads/_embeddings/<folder_id>/:
+- vectors.<gen>.f32: matriz float32 (filas x dim), un fragmento por fila,
+  solo se le añaden filas al final.
+- meta.<gen>.i64: por fila (pdf_id, inicio, fin) del fragmento dentro de
+  PDF.content.
+- manifest.json: generación vigente, filas confirmadas, proveedor/dimensión
+  y, por PDF, rango de filas, hash y largo del contenido indexado. Las filas de PDFs borrados quedan como
+  rangos muertos hasta que se compacta el índice.
+
+Las escrituras (siempre bajo flock del directorio) añaden al final de los
+archivos y después reemplazan el manifiesto de forma atómica; los lectores
+no toman el lock y solo mapean las filas que el manifiesto declara, así que
+nunca ven filas a medio escribir. Compactar escribe los archivos de la
+generación siguiente y conserva los de la anterior hasta la próxima
+compactación: un lector que leyó el manifiesto viejo todavía los encuentra
+(y si llegara tarde, relee el manifiesto). Lo ya mapeado sigue siendo válido
+aunque los archivos se borren. La consulta es un producto punto por bloques
+con selección top-k por argpartition.
+
+Los PDFs se indexan al confirmarse su alta o un cambio de su contenido
+(hilo en segundo plano lanzado desde un listener de la sesión) y
+sync_folder() reconcilia lo que falte o cambió de largo antes de cada
+consulta: los rangos (inicio, fin) solo valen para el texto que se indexó.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+from src.models.user import db, Folder, PDF
+from src.routes.pdfs import ensure_upload_directory
+from src.services.embeddings import chunk_text, get_embedder
+
+INDEX_DIRNAME = '_embeddings'
+VECTORS_FILENAME = 'vectors.{generation}.f32'
+META_FILENAME = 'meta.{generation}.i64'
+DATA_FILE_RE = re.compile(r'^(?:vectors|meta)\.(\d+)\.(?:f32|i64)$')
+# Versión del layout: un índice con otra se reconstruye (es derivable de la DB)
+INDEX_FORMAT = 2
+MANIFEST_FILENAME = 'manifest.json'
+LOCK_FILENAME = '.lock'
+META_COLUMNS = 3
+# Filas por bloque al puntuar: acota la memoria temporal de la consulta
+QUERY_BLOCK_ROWS = 65536
+# Indexar al dar de alta PDFs solo si el chat usa recuperación semántica
+INDEX_ON_INGEST = os.getenv('CHAT_CONTEXT_STRATEGY', 'full').lower() in ('semantic', 'auto')
+# Compactar cuando las filas muertas superan esta fracción
+COMPACT_DEAD_RATIO = 0.25
+# Vistas mapeadas que se mantienen abiertas por proceso (LRU)
+MAX_OPEN_VIEWS = int(os.getenv('VECTOR_INDEX_MAX_VIEWS', '64'))
+# Reintentos de un lector que llega después de que se borrara su generación
+OPEN_VIEW_ATTEMPTS = 3
+
+
+def index_directory(folder_id):
+    return os.path.join(ensure_upload_directory(), INDEX_DIRNAME, str(folder_id))
+
+
+class _IndexLock:
+    """flock exclusivo (bloqueante) del directorio del índice."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, LOCK_FILENAME)
+        self.fh = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.fh = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+        self.fh.close()
+
+
+def _load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(directory, manifest):
+    tmp = os.path.join(directory, f"{MANIFEST_FILENAME}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST_FILENAME))
+
+
+def _new_manifest(embedder, generation=0):
+    return {
+        'format': INDEX_FORMAT, 'provider': embedder.name, 'dim': None, 'rows': 0,
+        'generation': generation, 'pdfs': {}, 'dead': [],
+    }
+
+
+def _data_path(directory, template, generation):
+    return os.path.join(directory, template.format(generation=generation))
+
+
+def _prune_generations(directory, keep):
+    """Borra los archivos de datos de generaciones fuera de keep (y los del layout antiguo)."""
+    for name in os.listdir(directory):
+        match = DATA_FILE_RE.match(name)
+        if (match and int(match.group(1)) not in keep) or name in ('vectors.f32', 'meta.i64'):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _content_hash(text):
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _usable(manifest, embedder):
+    return manifest is not None and manifest.get('format') == INDEX_FORMAT and manifest['provider'] == embedder.name
+
+
+def _truncate_to(directory, manifest):
+    """Descarta filas escritas por un proceso que murió antes de confirmar el manifiesto."""
+    rows = manifest['rows']
+    dim = manifest['dim'] or 0
+    for template, row_bytes in ((VECTORS_FILENAME, dim * 4), (META_FILENAME, META_COLUMNS * 8)):
+        path = _data_path(directory, template, manifest['generation'])
+        if os.path.exists(path) and os.path.getsize(path) > rows * row_bytes:
+            os.truncate(path, rows * row_bytes)
+
+
+def _reset(directory, embedder, previous=None):
+    """Índice vacío en una generación nueva; se conservan los archivos de la
+    generación vigente para los lectores que todavía la usan."""
+    if previous is not None and previous.get('format') == INDEX_FORMAT:
+        keep = {previous['generation']}
+        generation = previous['generation'] + 1
+    else:
+        keep, generation = set(), 0
+    _prune_generations(directory, keep)
+    for template in (VECTORS_FILENAME, META_FILENAME):
+        path = _data_path(directory, template, generation)
+        if os.path.exists(path):
+            os.remove(path)
+    return _new_manifest(embedder, generation)
+
+
+def _dead_rows(manifest):
+    return sum(end - start for start, end in manifest['dead'])
+
+
+def _compact(directory, manifest):
+    """Reescribe el índice solo con las filas vivas en la generación siguiente.
+
+    Los archivos de la generación actual se conservan (los lectores que
+    leyeron el manifiesto anterior pueden seguir abriéndolos); los de la
+    anterior a esa se borran.
+    """
+    dim = manifest['dim']
+    rows = manifest['rows']
+    generation = manifest['generation']
+    vectors = np.memmap(_data_path(directory, VECTORS_FILENAME, generation), dtype=np.float32, mode='r', shape=(rows, dim))
+    meta = np.memmap(_data_path(directory, META_FILENAME, generation), dtype=np.int64, mode='r', shape=(rows, META_COLUMNS))
+    new_pdfs = {}
+    cursor = 0
+    with open(_data_path(directory, VECTORS_FILENAME, generation + 1), 'wb') as fv, \
+            open(_data_path(directory, META_FILENAME, generation + 1), 'wb') as fm:
+        for pdf_id, entry in sorted(manifest['pdfs'].items(), key=lambda item: item[1]['rows'][0]):
+            start, end = entry['rows']
+            fv.write(np.ascontiguousarray(vectors[start:end]).tobytes())
+            fm.write(np.ascontiguousarray(meta[start:end]).tobytes())
+            new_pdfs[pdf_id] = dict(entry, rows=[cursor, cursor + (end - start)])
+            cursor += end - start
+        fv.flush()
+        fm.flush()
+        os.fsync(fv.fileno())
+        os.fsync(fm.fileno())
+    del vectors, meta
+    _prune_generations(directory, {generation, generation + 1})
+    manifest.update(rows=cursor, pdfs=new_pdfs, dead=[], generation=generation + 1)
+    return manifest
+
+
+def index_pdfs(folder_id, pdfs):
+    """Añade al índice de la carpeta los PDFs [(pdf_id, contenido)] que falten
+    o cuyo contenido cambió. Devuelve cuántos fragmentos se embebieron."""
+    embedder = get_embedder()
+    directory = index_directory(folder_id)
+    embedded = 0
+    with _IndexLock(directory):
+        manifest = _load_manifest(directory)
+        if not _usable(manifest, embedder):
+            # Sin índice, de otro layout o creado con otro proveedor: empezar de cero
+            manifest = _reset(directory, embedder, manifest)
+        _truncate_to(directory, manifest)
+        generation = manifest['generation']
+        with open(_data_path(directory, VECTORS_FILENAME, generation), 'ab') as fv, \
+                open(_data_path(directory, META_FILENAME, generation), 'ab') as fm:
+            for pdf_id, content in pdfs:
+                key = str(pdf_id)
+                digest = _content_hash(content)
+                entry = manifest['pdfs'].get(key)
+                if entry and entry['hash'] == digest:
+                    # Manifiestos anteriores no guardaban el largo
+                    entry.setdefault('chars', len(content or ''))
+                    continue
+                if entry:
+                    manifest['dead'].append(entry['rows'])
+                spans = chunk_text(content)
+                start_row = manifest['rows']
+                if spans:
+                    vectors = embedder.embed([content[s:e] for s, e in spans])
+                    if manifest['dim'] is None:
+                        manifest['dim'] = int(vectors.shape[1])
+                    meta = np.array([(pdf_id, s, e) for s, e in spans], dtype=np.int64)
+                    fv.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                    fm.write(meta.tobytes())
+                    manifest['rows'] += len(spans)
+                    embedded += len(spans)
+                manifest['pdfs'][key] = {
+                    'hash': digest, 'chars': len(content or ''), 'rows': [start_row, manifest['rows']],
+                }
+            fv.flush()
+            fm.flush()
+            os.fsync(fv.fileno())
+            os.fsync(fm.fileno())
+        if manifest['rows'] and _dead_rows(manifest) > manifest['rows'] * COMPACT_DEAD_RATIO:
+            _compact(directory, manifest)
+        _save_manifest(directory, manifest)
+    return embedded
+
+
+def remove_pdfs(folder_id, pdf_ids):
+    """Marca como muertas las filas de esos PDFs (se eliminan al compactar)."""
+    directory = index_directory(folder_id)
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    with _IndexLock(directory):
+        manifest = _load_manifest(directory)
+        if manifest is None or manifest.get('format') != INDEX_FORMAT:
+            return 0
+        for pdf_id in pdf_ids:
+            entry = manifest['pdfs'].pop(str(pdf_id), None)
+            if entry:
+                manifest['dead'].append(entry['rows'])
+                removed += 1
+        if removed:
+            if manifest['rows'] and _dead_rows(manifest) > manifest['rows'] * COMPACT_DEAD_RATIO:
+                _truncate_to(directory, manifest)
+                _compact(directory, manifest)
+            _save_manifest(directory, manifest)
+    return removed
+
+
+def drop_index(folder_id):
+    shutil.rmtree(index_directory(folder_id), ignore_errors=True)
+
+
+def sync_folder(folder_id):
+    """Reconcilia el índice con los PDFs de la carpeta en la DB. Requiere app context.
+
+    Reindexa los PDFs que faltan y los que cambiaron de largo (el hash exacto
+    lo compara index_pdfs; los cambios de igual largo los recoge el listener).
+    """
+    manifest = _load_manifest(index_directory(folder_id))
+    indexed = (
+        {int(k): entry.get('chars') for k, entry in manifest['pdfs'].items()}
+        if _usable(manifest, get_embedder()) else {}
+    )
+    current = {
+        pdf_id: chars or 0
+        for pdf_id, chars in db.session.query(PDF.id, func.length(PDF.content)).filter(PDF.folder_id == folder_id)
+    }
+    stale = set(indexed) - set(current)
+    if stale:
+        remove_pdfs(folder_id, stale)
+    missing = sorted(pdf_id for pdf_id, chars in current.items() if indexed.get(pdf_id, -1) != chars)
+    # Por tandas para no cargar a la vez el texto de toda la carpeta
+    for i in range(0, len(missing), 50):
+        rows = db.session.query(PDF.id, PDF.content).filter(PDF.id.in_(missing[i:i + 50])).all()
+        index_pdfs(folder_id, [(pdf_id, content or '') for pdf_id, content in rows])
+    return len(missing), len(stale)
+
+
+class _IndexView:
+    """Vista de solo lectura de una versión confirmada del índice."""
+
+    def __init__(self, directory, manifest):
+        self.key = (manifest['generation'], manifest['rows'], len(manifest['dead']))
+        self.provider = manifest['provider']
+        rows, dim = manifest['rows'], manifest['dim']
+        self.rows = rows
+        if rows:
+            generation = manifest['generation']
+            self.vectors = np.memmap(
+                _data_path(directory, VECTORS_FILENAME, generation), dtype=np.float32, mode='r', shape=(rows, dim)
+            )
+            self.meta = np.memmap(
+                _data_path(directory, META_FILENAME, generation), dtype=np.int64, mode='r', shape=(rows, META_COLUMNS)
+            )
+        else:
+            self.vectors = self.meta = None
+        self.dead_mask = None
+        if manifest['dead']:
+            self.dead_mask = np.zeros(rows, dtype=bool)
+            for start, end in manifest['dead']:
+                self.dead_mask[start:end] = True
+
+
+# folder_id -> _IndexView, de la menos a la más usada recientemente
+_views = OrderedDict()
+_views_lock = threading.Lock()
+
+
+def _open_view(folder_id):
+    directory = index_directory(folder_id)
+    for _ in range(OPEN_VIEW_ATTEMPTS):
+        manifest = _load_manifest(directory)
+        if manifest is None or manifest.get('format') != INDEX_FORMAT:
+            return None
+        key = (manifest['generation'], manifest['rows'], len(manifest['dead']))
+        with _views_lock:
+            view = _views.get(folder_id)
+            if view is not None and view.key == key:
+                _views.move_to_end(folder_id)
+                return view
+        try:
+            view = _IndexView(directory, manifest)
+        except (OSError, ValueError):
+            # La generación de este manifiesto ya se borró: releerlo
+            continue
+        with _views_lock:
+            _views[folder_id] = view
+            _views.move_to_end(folder_id)
+            while len(_views) > MAX_OPEN_VIEWS:
+                _views.popitem(last=False)
+        return view
+    return None
+
+
+def _top_k(scores, k):
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def search(folder_ids, query, k=8):
+    """Los k fragmentos más similares a la consulta en esas carpetas:
+    [{'folder_id', 'pdf_id', 'start', 'end', 'score'}] de mayor a menor."""
+    embedder = get_embedder()
+    views = [(fid, _open_view(fid)) for fid in folder_ids]
+    views = [(fid, v) for fid, v in views if v is not None and v.rows and v.provider == embedder.name]
+    if not views or k <= 0:
+        return []
+    q = embedder.embed([query])[0]
+
+    best_scores, best_refs = [], []
+    for folder_id, view in views:
+        for start in range(0, view.rows, QUERY_BLOCK_ROWS):
+            end = min(view.rows, start + QUERY_BLOCK_ROWS)
+            scores = view.vectors[start:end] @ q
+            if view.dead_mask is not None:
+                scores[view.dead_mask[start:end]] = -np.inf
+            top = _top_k(scores, k)
+            best_scores.append(scores[top])
+            best_refs.extend((folder_id, view, start + int(i)) for i in top)
+    all_scores = np.concatenate(best_scores)
+    results = []
+    for i in _top_k(all_scores, k):
+        if not np.isfinite(all_scores[i]):
+            continue
+        folder_id, view, row = best_refs[i]
+        pdf_id, s, e = (int(x) for x in view.meta[row])
+        results.append({'folder_id': folder_id, 'pdf_id': pdf_id, 'start': s, 'end': e, 'score': float(all_scores[i])})
+    return results
+
+
+def retrieve_passages(folder_ids, query, k=8):
+    """Fragmentos más relevantes con su texto, agrupados por PDF y en orden de
+    documento; los solapados se fusionan. Requiere app context.
+
+    Devuelve [(pdf_id, original_filename, folder_id, [texto, ...])].
+    """
+    for folder_id in folder_ids:
+        sync_folder(folder_id)
+    hits = search(folder_ids, query, k)
+    spans_by_pdf = {}
+    for hit in hits:
+        spans_by_pdf.setdefault(hit['pdf_id'], []).append((hit['start'], hit['end']))
+
+    passages = []
+    for pdf_id in sorted(spans_by_pdf):
+        merged = []
+        for start, end in sorted(spans_by_pdf[pdf_id]):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        # substr en SQLite: solo viaja el fragmento, no el texto completo del PDF
+        texts = [
+            db.session.query(func.substr(PDF.content, start + 1, end - start)).filter(PDF.id == pdf_id).scalar() or ''
+            for start, end in merged
+        ]
+        name, folder_id = db.session.query(PDF.original_filename, PDF.folder_id).filter(PDF.id == pdf_id).one()
+        passages.append((pdf_id, name, folder_id, texts))
+    return passages
+
+
+# ---- Indexado al confirmar altas, bajas y cambios de contenido de PDFs ----
+
+@event.listens_for(Session, 'after_flush')
+def _collect_index_changes(session, flush_context):
+    changes = session.info.setdefault('vector_index_changes', {'added': set(), 'removed': set(), 'folders': set()})
+    for obj in session.new:
+        if isinstance(obj, PDF):
+            changes['added'].add((obj.folder_id, obj.id))
+    for obj in session.dirty:
+        # Contenido reescrito (p. ej. reimportación desde Drive): baja + alta
+        if isinstance(obj, PDF) and inspect(obj).attrs.content.history.has_changes():
+            changes['removed'].add((obj.folder_id, obj.id))
+            changes['added'].add((obj.folder_id, obj.id))
+    for obj in session.deleted:
+        if isinstance(obj, PDF):
+            changes['removed'].add((obj.folder_id, obj.id))
+        elif isinstance(obj, Folder):
+            changes['folders'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_index_changes(session):
+    session.info.pop('vector_index_changes', None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _schedule_index_changes(session):
+    changes = session.info.pop('vector_index_changes', None)
+    if not changes or not any(changes.values()) or not has_app_context():
+        return
+    if not INDEX_ON_INGEST:
+        # Sin indexado en la ingesta solo hay que limpiar índices existentes
+        changes['added'] = set()
+        if not changes['folders'] and not changes['removed']:
+            return
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                for folder_id in changes['folders']:
+                    drop_index(folder_id)
+                removed = {}
+                for folder_id, pdf_id in changes['removed']:
+                    if folder_id not in changes['folders']:
+                        removed.setdefault(folder_id, set()).add(pdf_id)
+                for folder_id, pdf_ids in removed.items():
+                    remove_pdfs(folder_id, pdf_ids)
+                added = {}
+                for folder_id, pdf_id in changes['added']:
+                    if folder_id not in changes['folders']:
+                        added.setdefault(folder_id, []).append(pdf_id)
+                for folder_id, pdf_ids in added.items():
+                    rows = db.session.query(PDF.id, PDF.content).filter(PDF.id.in_(pdf_ids)).all()
+                    index_pdfs(folder_id, [(pdf_id, content or '') for pdf_id, content in rows])
+        except Exception as e:
+            print(f"[VectorIndex] Error indexando cambios: {e}")
+
+    threading.Thread(target=run, name='vector-index', daemon=True).start()
+
+
+if __name__ == '__main__':
+    import sys
+    from src.main import app
+
+    with app.app_context():
+        folder_ids = [int(x) for x in sys.argv[1:]] or [row[0] for row in db.session.query(Folder.id)]
+        for fid in folder_ids:
+            print(fid, sync_folder(fid))
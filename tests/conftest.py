@@ -0,0 +1,44 @@
+"""Fixtures comunes: la app sobre una base SQLite temporal y un usuario con sesión."""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# Antes de importar src.main: nunca tocar src/database/app.db ni los uploads reales
+_TMP_DIR = tempfile.mkdtemp(prefix='pdfchat-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP_DIR, 'app.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_TMP_DIR, 'uploads')
+
+# Fixture query_budget (ver src/services/query_audit.py)
+pytest_plugins = ['src.services.query_audit']
+
+
+@pytest.fixture(scope='session')
+def app():
+    from src.main import app as flask_app
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    from src.models.user import db, User
+    with app.app_context():
+        suffix = uuid.uuid4().hex[:12]
+        row = User(google_id=f"test-{suffix}", username='Test', email=f"{suffix}@example.com")
+        db.session.add(row)
+        db.session.commit()
+        return row.id
+
+
+@pytest.fixture
+def logged_client(client, user):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user
+    return client
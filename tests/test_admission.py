@@ -0,0 +1,36 @@
+"""Cada llamada al proveedor, también la perdedora de un hedge, ocupa un hueco de la admisión."""
+import threading
+import time
+
+from src.services import provider_router
+from src.services.admission import AdmissionController
+
+
+def test_hedge_loser_keeps_its_slot(monkeypatch):
+    controller = AdmissionController(max_concurrent=4, per_user=1)
+    monkeypatch.setattr(provider_router, 'llm_admission', controller)
+    router = provider_router.ProviderRouter(hedge_after='20')
+    release_slow = threading.Event()
+    peak = []
+
+    def slow():
+        release_slow.wait(5)
+        return 'lento'
+
+    def fast():
+        peak.append(controller.snapshot()['active'])
+        return 'rápido'
+
+    with controller.slot('u1'):
+        result = router.call([(('a', 'm'), slow), (('b', 'm'), fast)])
+    assert result == 'rápido'
+    # Principal + hedge en curso a la vez
+    assert peak == [2]
+    # La petición terminó, pero la llamada lenta sigue ocupando su hueco
+    assert controller.snapshot()['active'] == 1
+
+    release_slow.set()
+    deadline = time.monotonic() + 5
+    while controller.snapshot()['active'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.snapshot()['active'] == 0
@@ -0,0 +1,43 @@
+"""Rotación de refresh tokens: cada token se canjea una sola vez."""
+import threading
+
+from src.models.user import db, RefreshToken, User
+from src.routes.auth import create_refresh_token
+
+
+def _token(app, user_id):
+    with app.app_context():
+        return create_refresh_token(db.session.get(User, user_id))
+
+
+def _live_tokens(app, user_id):
+    with app.app_context():
+        return RefreshToken.query.filter_by(user_id=user_id, revoked_at=None).count()
+
+
+def test_reused_refresh_token_revokes_family(app, client, user):
+    token = _token(app, user)
+    first = client.post('/api/auth/refresh', json={'refresh_token': token})
+    assert first.status_code == 200
+
+    again = client.post('/api/auth/refresh', json={'refresh_token': token})
+    assert again.status_code == 401
+    assert _live_tokens(app, user) == 0
+
+
+def test_concurrent_rotation_issues_one_token(app, user):
+    token = _token(app, user)
+    barrier = threading.Barrier(4)
+    statuses = []
+
+    def rotate():
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(client.post('/api/auth/refresh', json={'refresh_token': token}).status_code)
+
+    threads = [threading.Thread(target=rotate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses.count(200) <= 1
@@ -0,0 +1,38 @@
+"""Limitador de Drive: conexiones del pool compartido y token bucket por usuario."""
+import threading
+
+import pytest
+
+from src.services import drive_rate_limiter as limiter
+
+
+@pytest.fixture
+def quota_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(limiter, 'QUOTA_DB_PATH', str(tmp_path / 'quota' / 'drive_quota.db'))
+    monkeypatch.setattr(limiter, '_pool', None)
+    monkeypatch.setattr(limiter, '_schema_ready', False)
+    yield
+    if limiter._pool is not None:
+        limiter._pool.close()
+
+
+def test_calls_from_many_threads_reuse_one_connection(quota_db):
+    opened = []
+    pool = limiter._get_pool()
+    new_connection = pool._new_connection
+    pool._new_connection = lambda: opened.append(1) or new_connection()
+
+    for _ in range(20):
+        # Cada hilo hace de un request (un greenlet con gevent)
+        thread = threading.Thread(target=limiter.acquire, args=('u1',))
+        thread.start()
+        thread.join()
+    assert len(opened) == 1
+    assert limiter.get_quota_metrics('u1')['calls'] == 20
+
+
+def test_exhausted_bucket_raises_unavailable(quota_db):
+    limiter.acquire('u2', tokens=limiter.BURST)
+    with pytest.raises(limiter.DriveUnavailableError):
+        limiter.acquire('u2', tokens=limiter.BURST, max_wait=0)
+    assert limiter.get_quota_metrics('u2')['rejected'] == 1
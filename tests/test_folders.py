@@ -0,0 +1,56 @@
+"""Borrado de carpetas: los archivos se eliminan solo si el commit prospera."""
+import os
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from src.models.user import db, Folder, PDF
+
+
+def _folder_with_file(app, user_id, tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(b'%PDF-1.4')
+    with app.app_context():
+        folder = Folder(name='Borrar', user_id=user_id)
+        db.session.add(folder)
+        db.session.flush()
+        db.session.add(PDF(filename='doc.pdf', original_filename='doc.pdf', file_path=str(path),
+                           content='texto', folder_id=folder.id))
+        db.session.commit()
+        return folder.id, path
+
+
+def test_delete_folder_removes_rows_and_files(app, logged_client, user, tmp_path):
+    folder_id, path = _folder_with_file(app, user, tmp_path)
+    assert logged_client.delete(f'/api/folders/{folder_id}').status_code == 204
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert db.session.get(Folder, folder_id) is None
+
+
+def test_failed_commit_keeps_files(app, logged_client, user, tmp_path, monkeypatch):
+    folder_id, path = _folder_with_file(app, user, tmp_path)
+
+    def fail():
+        raise OperationalError('COMMIT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(db.session, 'commit', fail)
+    with pytest.raises(OperationalError):
+        logged_client.delete(f'/api/folders/{folder_id}')
+    monkeypatch.undo()
+    assert os.path.exists(path)
+
+
+def test_delete_drive_files_is_opt_in(app, logged_client, user, tmp_path, monkeypatch):
+    from src.routes import folders
+    calls = []
+    monkeypatch.setattr(folders, 'delete_drive_files', lambda u, ids: calls.append(ids) or {i: True for i in ids})
+
+    for query, expected in (('', []), ('?delete_drive_files=1', [['drive-1']])):
+        folder_id, _ = _folder_with_file(app, user, tmp_path)
+        with app.app_context():
+            db.session.get(Folder, folder_id).drive_folder_id = 'drive-folder'
+            db.session.query(PDF).filter_by(folder_id=folder_id).update({'drive_file_id': 'drive-1'})
+            db.session.commit()
+        assert logged_client.delete(f'/api/folders/{folder_id}{query}').status_code == 204
+        assert calls == expected
@@ -0,0 +1,32 @@
+"""Listado recursivo de Drive: completo o error, nunca parcial."""
+from types import SimpleNamespace
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src import google_drive
+from src.services.drive_rate_limiter import DriveUnavailableError
+
+
+class _FakeFiles:
+    def list(self, **kwargs):
+        return kwargs
+
+
+def test_listing_error_mid_pagination_is_not_partial(monkeypatch):
+    pages = iter([
+        {'files': [{'id': 'a', 'name': 'a.pdf'}], 'nextPageToken': 'p2'},
+        HttpError(httplib2.Response({'status': 400}), b'bad request'),
+    ])
+
+    def execute(user_key, request):
+        page = next(pages)
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    monkeypatch.setattr(google_drive, 'get_drive_service', lambda user: SimpleNamespace(files=_FakeFiles))
+    monkeypatch.setattr(google_drive, '_execute', execute)
+    with pytest.raises(DriveUnavailableError):
+        google_drive.list_pdfs_in_folder_recursive(SimpleNamespace(id=1), 'root-folder')
@@ -0,0 +1,44 @@
+"""Presupuesto de consultas de los listados: el número de consultas no crece con los datos."""
+from src.models.user import db, Folder, PDF, Conversation, Message
+
+
+def _seed(app, user_id, folders=5, pdfs_per_folder=4, messages=6):
+    with app.app_context():
+        folder_ids = []
+        for i in range(folders):
+            folder = Folder(name=f"Carpeta {i}", user_id=user_id)
+            db.session.add(folder)
+            db.session.flush()
+            folder_ids.append(folder.id)
+            for j in range(pdfs_per_folder):
+                db.session.add(PDF(
+                    filename=f"{folder.id}-{j}.pdf",
+                    original_filename=f"doc-{j}.pdf",
+                    file_path=f"/nonexistent/{folder.id}-{j}.pdf",
+                    content=f"contenido del documento {j}",
+                    folder_id=folder.id,
+                    file_size=1024,
+                ))
+        conversation = Conversation(user_id=user_id, title='Test')
+        db.session.add(conversation)
+        db.session.flush()
+        for i in range(messages):
+            db.session.add(Message(conversation_id=conversation.id, content=f"mensaje {i}", is_user=i % 2 == 0))
+        db.session.commit()
+        return folder_ids, conversation.id
+
+
+def test_list_folders_query_budget(app, logged_client, user, query_budget):
+    _seed(app, user)
+    with query_budget(6):
+        response = logged_client.get('/api/folders')
+    assert response.status_code == 200
+    folders = response.get_json()
+    assert len(folders) == 5
+
+
+def test_get_conversation_query_budget(app, logged_client, user, query_budget):
+    _, conversation_id = _seed(app, user)
+    with query_budget(3):
+        response = logged_client.get(f'/api/conversations/{conversation_id}')
+    assert response.status_code == 200
@@ -0,0 +1,42 @@
+"""Sesiones en SQLite: conexiones prestadas por un pool acotado, no una por hilo/greenlet."""
+import threading
+import time
+
+from src.services.session_store import SQLiteSessionInterface
+
+
+def test_connections_are_pooled_across_threads(tmp_path):
+    interface = SQLiteSessionInterface(str(tmp_path / 'sessions.db'))
+    pool = interface._pool
+    opened = []
+    new_connection = pool._new_connection
+    pool._new_connection = lambda: opened.append(1) or new_connection()
+
+    def request(i):
+        # Cada hilo hace de un request (un greenlet con gevent)
+        sid = f"sid-{i}"
+        interface.store(sid, {'user_id': i}, time.time() + 60)
+        assert interface.load(sid)[0] == {'user_id': i}
+
+    # Requests uno tras otro, cada uno en su hilo: reutilizan la conexión del arranque
+    for i in range(20):
+        thread = threading.Thread(target=request, args=(i,))
+        thread.start()
+        thread.join()
+    assert opened == []
+
+    # En paralelo se abren las que hagan falta, pero solo size quedan abiertas
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(20, 40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(pool._idle) <= pool.size
+
+
+def test_sweep_deletes_expired(tmp_path):
+    interface = SQLiteSessionInterface(str(tmp_path / 'sessions.db'))
+    interface.store('old', {'a': 1}, time.time() - 1)
+    interface.store('new', {'a': 2}, time.time() + 60)
+    assert interface.sweep() == 1
+    assert interface.load('old') is None and interface.load('new') is not None
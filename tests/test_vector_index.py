@@ -0,0 +1,63 @@
+"""El índice de embeddings sigue al contenido de los PDFs, no solo a sus altas y bajas."""
+import threading
+
+from src.models.user import db, Folder, PDF
+from src.services import vector_index
+
+
+def _wait_index_threads():
+    for thread in threading.enumerate():
+        if thread.name == 'vector-index':
+            thread.join(timeout=10)
+
+
+def _make_pdf(user_id, content):
+    folder = Folder(name='Índice', user_id=user_id)
+    db.session.add(folder)
+    db.session.flush()
+    pdf = PDF(filename='a.pdf', original_filename='a.pdf', file_path='/nonexistent/a.pdf',
+              content=content, folder_id=folder.id)
+    db.session.add(pdf)
+    db.session.commit()
+    _wait_index_threads()
+    return folder.id, pdf.id
+
+
+def _indexed_hash(folder_id, pdf_id):
+    manifest = vector_index._load_manifest(vector_index.index_directory(folder_id))
+    entry = (manifest or {}).get('pdfs', {}).get(str(pdf_id))
+    return entry and entry['hash']
+
+
+def test_rewritten_content_is_reindexed(app, user):
+    with app.app_context():
+        folder_id, pdf_id = _make_pdf(user, 'manzana pera uva ' * 200)
+        vector_index.sync_folder(folder_id)
+
+        new_content = 'volcán lava ceniza erupción ' * 300
+        pdf = db.session.get(PDF, pdf_id)
+        pdf.content = new_content
+        db.session.commit()
+        _wait_index_threads()
+
+        # Lo que ve el chat: retrieve_passages sincroniza antes de buscar
+        vector_index.retrieve_passages([folder_id], 'volcán lava', k=3)
+        assert _indexed_hash(folder_id, pdf_id) == vector_index._content_hash(new_content)
+        hits = vector_index.search([folder_id], 'volcán lava', k=50)
+        assert hits and all(hit['end'] <= len(new_content) for hit in hits)
+
+
+def test_same_length_rewrite_drops_stale_rows(app, user):
+    with app.app_context():
+        folder_id, pdf_id = _make_pdf(user, 'a' * 500 + ' perro gato ' + 'b' * 500)
+        vector_index.sync_folder(folder_id)
+
+        new_content = 'a' * 500 + ' tigre leon ' + 'b' * 500
+        pdf = db.session.get(PDF, pdf_id)
+        pdf.content = new_content
+        db.session.commit()
+        _wait_index_threads()
+
+        # Mismo largo: sync_folder no lo distingue, lo da de baja el listener
+        vector_index.sync_folder(folder_id)
+        assert _indexed_hash(folder_id, pdf_id) == vector_index._content_hash(new_content)